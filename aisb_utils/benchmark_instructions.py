@@ -0,0 +1,99 @@
+"""
+Benchmark InstructionMaker on the largest solution files, with and without cached markdown cells.
+
+Run from the repository root:
+
+    python aisb_utils/benchmark_instructions.py --largest 5
+"""
+
+import argparse
+import contextlib
+import gc
+import glob
+import io
+import os
+import statistics
+import time
+
+import libcst as cst
+from solution_parsing import (
+    InstructionMaker,
+    SolutionTemplate,
+    is_toplevel_string_constant,
+    render_markdown_cell,
+)
+
+
+def make_instructions(module: cst.Module) -> str:
+    maker = InstructionMaker()
+    with contextlib.redirect_stdout(io.StringIO()):  # Don't time printing warnings about HTML tags
+        module.visit(maker)
+    instructions = io.StringIO()
+    maker.dump(instructions, "")
+    return instructions.getvalue()
+
+
+def edit_one_cell(module: cst.Module) -> cst.Module:
+    """Return the module with a word appended to its middle markdown cell."""
+    cells = [stmt.body[0].value for stmt in module.body if is_toplevel_string_constant(stmt)]  # type: ignore
+    cell = cells[len(cells) // 2]
+    quote = cell.quote
+    edited = cell.with_changes(value=cell.value[: -len(quote)] + " edited" + quote)
+    return module.deep_replace(cell, edited)  # type: ignore
+
+
+def timed(fn, repeats: int, setup=None) -> float:
+    """Median seconds of fn() over repeats runs, calling setup() before each run."""
+    times = []
+    for _ in range(repeats):
+        if setup is not None:
+            setup()
+        gc.collect()
+        gc.disable()  # Like timeit, so that collecting the large trees doesn't add noise
+        try:
+            start = time.perf_counter()
+            fn()
+            times.append(time.perf_counter() - start)
+        finally:
+            gc.enable()
+    return statistics.median(times)
+
+
+def benchmark_file(path: str, repeats: int) -> None:
+    with open(path, "r") as f:
+        module = cst.parse_module(f.read())
+    template = module.visit(SolutionTemplate(test_file_name=path.replace("_solution.py", "_test.py")))
+    edited = edit_one_cell(template)
+    raw_values = [stmt.body[0].value.raw_value for stmt in template.body if is_toplevel_string_constant(stmt)]  # type: ignore
+
+    def render_cells():
+        for raw_value in raw_values:
+            render_markdown_cell(raw_value)
+
+    assert make_instructions(template) != make_instructions(edited)
+    cells_cold = timed(render_cells, repeats, setup=render_markdown_cell.cache_clear)
+    cells_warm = timed(render_cells, repeats)
+    cold = timed(lambda: make_instructions(template), repeats, setup=render_markdown_cell.cache_clear)
+    warm = timed(lambda: make_instructions(template), repeats)
+
+    def prepare_edit():
+        render_markdown_cell.cache_clear()
+        make_instructions(template)
+
+    one_cell = timed(lambda: make_instructions(edited), repeats, setup=prepare_edit)
+    print(
+        f"{path:<32} {os.path.getsize(path) // 1024:>4} KiB {len(raw_values):>3} cells | "
+        f"markdown {cells_cold * 1000:5.2f} -> {cells_warm * 1000:5.2f}ms | "
+        f"InstructionMaker cold {cold * 1000:6.1f}ms, cached {warm * 1000:6.1f}ms, one cell edited {one_cell * 1000:6.1f}ms"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("files", nargs="*", help="Solution files to benchmark (default: the largest ones)")
+    parser.add_argument("--largest", "-n", type=int, default=5, help="Number of largest solution files to use")
+    parser.add_argument("--repeats", type=int, default=20, help="Runs per measurement, the median is reported")
+    args = parser.parse_args()
+    files = args.files or sorted(glob.glob("**/*_solution.py", recursive=True), key=os.path.getsize, reverse=True)
+    for path in files if args.files else files[: args.largest]:
+        benchmark_file(path, args.repeats)
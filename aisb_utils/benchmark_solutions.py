@@ -0,0 +1,239 @@
+"""
+Benchmark functions of the solution files over several input sizes and compare with a saved baseline.
+
+Each benchmark imports a solution module, prepares inputs of a given size and times one call of a solution
+function. Results can be saved as a JSON baseline; later runs flag sizes that got slower than the baseline
+by more than a threshold, so that edits which make an exercise much slower to run are noticed.
+
+Run from the repository root:
+
+    python aisb_utils/benchmark_solutions.py --save          # Record a baseline
+    python aisb_utils/benchmark_solutions.py md5_hash        # Compare one benchmark with the baseline
+"""
+
+import argparse
+import ast
+import gc
+import inspect
+import itertools
+import json
+import os
+import random
+import statistics
+import sys
+import time
+from collections.abc import Callable
+from dataclasses import dataclass
+
+from solution_loader import load_solution as load_definitions
+from termcolor import colored
+
+BASELINE_PATH = "benchmark_baseline.json"
+
+
+@dataclass
+class Benchmark:
+    name: str
+    solution: str  # Path of the solution file, relative to the repository root
+    sizes: list[int]
+    unit: str
+    setup: Callable  # (solution module, size) -> function to time
+
+    @property
+    def names(self) -> set[str]:
+        """Names the setup function uses from the solution module, e.g. {"md5_hash"} for solution.md5_hash."""
+        tree = ast.parse(inspect.getsource(self.setup))
+        solution = tree.body[0].args.args[0].arg  # type: ignore
+        return {
+            node.attr
+            for node in ast.walk(tree)
+            if isinstance(node, ast.Attribute) and isinstance(node.value, ast.Name) and node.value.id == solution
+        }
+
+
+BENCHMARKS: dict[str, Benchmark] = {}
+
+
+def benchmark(solution: str, sizes: list[int], unit: str):
+    """Register a setup function as a benchmark of the given solution file."""
+
+    def decorator(setup):
+        BENCHMARKS[setup.__name__] = Benchmark(setup.__name__, solution, sizes, unit, setup)
+        return setup
+
+    return decorator
+
+
+@benchmark("w1d4/w1d4_solution.py", sizes=[64, 4096, 65536], unit="bytes")
+def md5_hash(solution, size):
+    message = random.Random(size).randbytes(size)
+    return lambda: solution.md5_hash(message)
+
+
+@benchmark("w1d1/w1d1_solution.py", sizes=[2, 16, 128], unit="keystream bytes")
+def recover_lcg_state(solution, size):
+    # The low byte of each state only depends on the previous low byte, so the search accepts the first
+    # candidate it checks and the time is spent verifying the keystream
+    keystream = list(itertools.islice(solution.lcg_keystream(random.Random(size).getrandbits(32)), size))
+    return lambda: solution.recover_lcg_state(keystream)
+
+
+@benchmark("w1d1/w1d1_solution.py", sizes=[1, 4, 16], unit="bytes")
+def meet_in_the_middle_attack(solution, size):
+    plaintext = random.Random(size).randbytes(size)
+    ciphertext = solution.double_encrypt(123, 456, plaintext)
+    return lambda: solution.meet_in_the_middle_attack(plaintext, ciphertext)
+
+
+@benchmark("w1d4/w1d4_solution.py", sizes=[16, 64, 256], unit="bytes")
+def padding_oracle_attack(solution, size):
+    rng = random.Random(size)
+    key, iv = rng.randbytes(16), rng.randbytes(16)
+    ciphertext = iv + solution.cbc_encrypt(rng.randbytes(size), key, iv)
+
+    def oracle(ciphertext: bytes) -> bool:
+        try:
+            solution.cbc_decrypt(ciphertext[16:], key, ciphertext[:16])
+            return True
+        except solution.InvalidPaddingError:
+            return False
+
+    return lambda: solution.padding_oracle_attack(oracle, ciphertext)
+
+
+@benchmark("w1d4/w1d4_solution.py", sizes=[1024, 16384, 262144], unit="bytes")
+def cbc_encrypt(solution, size):
+    rng = random.Random(size)
+    plaintext, key, iv = rng.randbytes(size), rng.randbytes(16), rng.randbytes(16)
+    return lambda: solution.cbc_encrypt(plaintext, key, iv)
+
+
+@benchmark("w1d4/w1d4_solution.py", sizes=[16, 64, 256], unit="bits")
+def generate_keys(solution, size):
+    return lambda: solution.generate_keys(size)
+
+
+def time_call(fn: Callable, repeats: int, min_time: float) -> float:
+    """
+    Median seconds per call of fn.
+
+    Like timeit, fast functions are called in loops of at least min_time seconds, and the garbage collector is
+    disabled while timing.
+    """
+    start = time.perf_counter()
+    fn()
+    first = time.perf_counter() - start
+    loops = max(1, int(min_time / first)) if first > 0 else 1000
+    times = []
+    for _ in range(repeats):
+        gc.collect()
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            for _ in range(loops):
+                fn()
+            times.append((time.perf_counter() - start) / loops)
+        finally:
+            gc.enable()
+    return statistics.median(times)
+
+
+def load_solution(path: str, names: set[str], modules: dict):
+    """Import the definitions of a solution module once, from its own directory like when running it."""
+    if path not in modules:
+        root = os.getcwd()
+        os.chdir(os.path.dirname(os.path.abspath(path)))
+        try:
+            # Only what the benchmarks use, without running the solution's own tests and demos
+            modules[path], _ = load_definitions(os.path.join(root, path), names)
+        finally:
+            os.chdir(root)
+    return modules[path]
+
+
+def load_baseline(path: str) -> dict:
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def save_baseline(path: str, baseline: dict) -> None:
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(baseline, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def run_benchmarks(names: list[str], baseline: dict, threshold: float, repeats: int, min_time: float) -> dict:
+    """
+    Run the benchmarks and print each result next to its baseline.
+
+    Returns:
+        {name: {size: seconds}} with sizes as strings, the format of the baseline file
+    """
+    modules: dict = {}
+    results: dict[str, dict[str, float]] = {}
+    for name in names:
+        bench = BENCHMARKS[name]
+        # Everything that the benchmarks of the same solution file need, as it is only loaded once
+        needed = set().union(
+            *(BENCHMARKS[other].names for other in names if BENCHMARKS[other].solution == bench.solution)
+        )
+        solution = load_solution(bench.solution, needed, modules)
+        results[name] = {}
+        for size in bench.sizes:
+            fn = bench.setup(solution, size)
+            seconds = time_call(fn, repeats, min_time)
+            results[name][str(size)] = seconds
+
+            line = f"{name:<28} {size:>8} {bench.unit:<17} {seconds * 1000:10.3f}ms"
+            base = baseline.get(name, {}).get(str(size))
+            if base:
+                ratio = seconds / base
+                if ratio > 1 + threshold:
+                    line += colored(f"  {ratio:5.2f}x baseline  REGRESSION", "red")
+                elif ratio < 1 / (1 + threshold):
+                    line += colored(f"  {ratio:5.2f}x baseline  faster", "green")
+                else:
+                    line += f"  {ratio:5.2f}x baseline"
+            print(line)
+    return results
+
+
+def regressions(results: dict, baseline: dict, threshold: float) -> list[str]:
+    return [
+        f"{name}[{size}]"
+        for name, sizes in results.items()
+        for size, seconds in sizes.items()
+        if baseline.get(name, {}).get(size) and seconds / baseline[name][size] > 1 + threshold
+    ]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("names", nargs="*", help=f"Benchmarks to run (default: all of {', '.join(BENCHMARKS)})")
+    parser.add_argument("--baseline", "-b", default=BASELINE_PATH, help="Path of the JSON baseline")
+    parser.add_argument("--save", "-s", action="store_true", help="Save the results as the new baseline")
+    parser.add_argument(
+        "--threshold", "-t", type=float, default=0.25, help="Flag results this much slower than the baseline"
+    )
+    parser.add_argument("--repeats", "-r", type=int, default=5, help="Timing runs per size, the median is used")
+    parser.add_argument("--min-time", type=float, default=0.1, help="Minimum seconds per timing run")
+    args = parser.parse_args()
+
+    unknown = [name for name in args.names if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"Unknown benchmarks: {', '.join(unknown)}")
+    names = args.names or list(BENCHMARKS)
+    baseline = load_baseline(args.baseline)
+    results = run_benchmarks(names, baseline, args.threshold, args.repeats, args.min_time)
+
+    if args.save:
+        save_baseline(args.baseline, baseline | results)
+        print(f"Saved baseline to {args.baseline}")
+    slower = regressions(results, baseline, args.threshold)
+    if slower:
+        print(colored(f"{len(slower)} regressions beyond {args.threshold:.0%}: {', '.join(slower)}", "red"))
+        sys.exit(1)
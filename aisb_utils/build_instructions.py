@@ -4,27 +4,85 @@ Convert solution Python scripts containing triple-quoted Markdown strings to a M
 
 import argparse
 import asyncio
+import ctypes
+import ctypes.util
 import glob
+import hashlib
+import json
 import logging
 import os
+import struct
+import time
+from concurrent.futures import ProcessPoolExecutor
 
-from solution_parsing import build, build_reference_py
+from solution_parsing import IncrementalBuild, build, build_outputs, build_reference_py
 
 logging.basicConfig(level=logging.INFO)
 
+MANIFEST_PATH = ".build_manifest.json"
+BUILDER_SOURCES = [
+    os.path.join(os.path.dirname(os.path.realpath(__file__)), name)
+    for name in ("build_instructions.py", "solution_parsing.py")
+]
 
-def needs_build(inpath: str, outpaths: list[str]):
-    mod_in = os.stat(inpath).st_mtime
-    for outpath in outpaths:
-        if not os.path.exists(outpath):
-            return True
-        mod_out = os.stat(outpath).st_mtime
-        if mod_in > mod_out:
+
+def file_hash(path: str) -> str:
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def builder_version() -> str:
+    """Hash of the builder's own source, so that changing the builder invalidates the cache."""
+    digest = hashlib.sha256()
+    for path in BUILDER_SOURCES:
+        digest.update(file_hash(path).encode())
+    return digest.hexdigest()
+
+
+class BuildCache:
+    """
+    Manifest of source hashes that outputs were last built from.
+
+    Files are compared by content, so unchanged files are skipped even when their mtime changes
+    (e.g. after a git checkout). The hash of a file is only recomputed when its mtime or size differ
+    from the ones recorded in the manifest.
+    """
+
+    def __init__(self, path: str = MANIFEST_PATH):
+        self.path = path
+        self.version = builder_version()
+        self.files: dict[str, dict] = {}
+        try:
+            with open(path, "r") as f:
+                manifest = json.load(f)
+            if manifest.get("builder_version") == self.version:
+                self.files = manifest["files"]
+        except (FileNotFoundError, json.JSONDecodeError, KeyError):
+            pass
+
+    def source_hash(self, inpath: str) -> str:
+        stat = os.stat(inpath)
+        entry = self.files.setdefault(inpath, {"outputs": {}})
+        if entry.get("mtime_ns") != stat.st_mtime_ns or entry.get("size") != stat.st_size:
+            entry.update(sha256=file_hash(inpath), mtime_ns=stat.st_mtime_ns, size=stat.st_size)
+        return entry["sha256"]
+
+    def needs_build(self, inpath: str, kind: str, outpaths: list[str]) -> bool:
+        if not all(os.path.exists(outpath) for outpath in outpaths):
             return True
-    return False
+        return self.files.get(inpath, {}).get("outputs", {}).get(kind) != self.source_hash(inpath)
+
+    def record(self, inpath: str, kind: str, source_hash: str):
+        self.files.setdefault(inpath, {"outputs": {}})["outputs"][kind] = source_hash
+
+    def save(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"builder_version": self.version, "files": self.files}, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.path)
 
 
-def build_instructions(inpath, instruction_path, test_path):
+def build_instructions(inpath, instruction_path, test_path, incremental: IncrementalBuild | None = None):
     ro_files = [instruction_path, test_path]
     for ro_file in ro_files:
         if os.path.exists(ro_file):
@@ -35,7 +93,7 @@ def build_instructions(inpath, instruction_path, test_path):
         open(instruction_path, "w") as instruction_file,
         open(test_path, "w") as test_file,
     ):
-        build(infile, instruction_file, test_file)
+        build(infile, instruction_file, test_file, incremental)
     for ro_file in ro_files:
         # Make these files read-only
         if os.path.exists(ro_file):
@@ -55,34 +113,369 @@ def build_reference(inpath, reference_path, test_path):
     os.chmod(reference_path, 0o544)
 
 
-def build_all(force=False, files: list[str] | None = None, reference=False):
+def build_instructions_and_reference(inpath, instruction_path, test_path, reference_path):
+    """Build instructions, tests and reference from a single parse of the solution file."""
+    print(f"Building: {inpath} -> {instruction_path}, {test_path}, {reference_path}")
+    for out_file in [instruction_path, test_path, reference_path]:
+        if os.path.exists(out_file):
+            # Temporarily make writable for editing
+            os.chmod(out_file, 0o644)
+    with (
+        open(inpath, "r") as infile,
+        open(instruction_path, "w") as instruction_file,
+        open(test_path, "w") as test_file,
+        open(reference_path, "w") as reference_file,
+    ):
+        build_outputs(infile, instruction_file, test_file, reference_file)
+    for ro_file in [instruction_path, test_path]:
+        # Make these files read-only
+        if os.path.exists(ro_file):
+            os.chmod(ro_file, 0o444)
+    os.chmod(reference_path, 0o544)
+
+
+def output_paths(inpath: str) -> dict[str, list[str]]:
+    return {
+        "instructions": [
+            inpath.replace("_solution.py", "_instructions.md"),
+            inpath.replace("_solution.py", "_test.py"),
+        ],
+        "reference": [inpath.replace("_solution.py", "_reference.py")],
+    }
+
+
+def build_file(
+    inpath: str, kinds: list[str], incremental: IncrementalBuild | None = None
+) -> tuple[str, list[str], float, str | None]:
+    """
+    Build the given kinds of outputs for one solution file. Runs in a worker process, or in the watcher.
+
+    Returns:
+        (inpath, kinds that were built, seconds taken, error message or None)
+    """
+    start = time.perf_counter()
+    outputs = output_paths(inpath)
+    instruction_file, test_file = outputs["instructions"]
+    (reference_file,) = outputs["reference"]
+    built = []
+    try:
+        if kinds == ["instructions", "reference"]:
+            build_instructions_and_reference(inpath, instruction_file, test_file, reference_file)
+            built.extend(kinds)
+        elif kinds == ["instructions"]:
+            build_instructions(inpath, instruction_file, test_file, incremental)
+            built.append("instructions")
+        elif kinds == ["reference"]:
+            build_reference(inpath, reference_file, test_file)
+            built.append("reference")
+    except SyntaxError as e:
+        return inpath, built, time.perf_counter() - start, f"Syntax error - will not rebuild until next save.\n{e}"
+    except UnicodeDecodeError as e:
+        return inpath, built, time.perf_counter() - start, f"Unicode error - will not rebuild until next save.\n{e}"
+    return inpath, built, time.perf_counter() - start, None
+
+
+def build_all(force=False, files: list[str] | None = None, reference=False, jobs: int | None = None):
     if files is None:
         files = glob.glob("**/*_solution.py", recursive=True)
     for file in files:
         assert file.endswith("_solution.py")
 
+    cache = BuildCache()
+    wanted = ["instructions", "reference"] if reference else ["instructions"]
+    dirty: dict[str, list[str]] = {}
+    hashes = {}
     for inpath in files:
-        instruction_file = inpath.replace("_solution.py", "_instructions.md")
-        test_file = inpath.replace("_solution.py", "_test.py")
-        reference_file = inpath.replace("_solution.py", "_reference.py")
+        outputs = output_paths(inpath)
+        hashes[inpath] = cache.source_hash(inpath)
+        kinds = [kind for kind in wanted if force or cache.needs_build(inpath, kind, outputs[kind])]
+        if kinds:
+            dirty[inpath] = kinds
+
+    if len(dirty) > 1 and jobs != 1:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            results = list(pool.map(build_file, dirty, dirty.values()))
+    else:
+        results = [build_file(inpath, kinds) for inpath, kinds in dirty.items()]
+
+    for inpath, built, elapsed, error in results:
+        for kind in built:
+            cache.record(inpath, kind, hashes[inpath])
+        if error:
+            print(error)
+        else:
+            print(f"Built {inpath} in {elapsed:.2f}s")
+    if len(results) > 1:
+        print(f"Built {len(results)} files, {sum(r[2] for r in results):.2f}s total build time")
+    cache.save()
+
+
+# inotify(7) constants from <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+INOTIFY_EVENT = struct.Struct("iIII")  # wd, mask, cookie, len; followed by len bytes of name
+
+
+class InotifyWatcher:
+    """
+    Reports solution files that were written, using inotify. Blocks in the event loop while idle.
+
+    Watches directories rather than files, because many editors save by writing a new file and renaming
+    it over the old one. With follow_new_directories, directories created in watched ones are watched too.
+    """
+
+    def __init__(self, directories: list[str], wanted, debounce_secs: float, follow_new_directories: bool = False):
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.follow_new_directories = follow_new_directories
+        self.directories = {}
+        try:
+            for directory in directories:
+                self._watch(directory)
+        except OSError:
+            os.close(self.fd)
+            raise
+        self.wanted = wanted
+        self.debounce_secs = debounce_secs
+        self.changed: set[str] = set()
+        self.event = asyncio.Event()
+        asyncio.get_running_loop().add_reader(self.fd, self._read_events)
+
+    def _watch(self, directory: str) -> None:
+        mask = IN_CLOSE_WRITE | IN_MOVED_TO | (IN_CREATE if self.follow_new_directories else 0)
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), mask)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f"inotify_add_watch failed for {directory}")
+        self.directories[wd] = directory
+
+    def _read_events(self):
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = INOTIFY_EVENT.unpack_from(data, offset)
+            offset += INOTIFY_EVENT.size
+            name = os.fsdecode(data[offset : offset + length].rstrip(b"\0"))
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                self._rescan()  # Events were dropped, so any file may have changed
+            elif wd in self.directories:  # Events of a removed watch can still be queued
+                path = os.path.normpath(os.path.join(self.directories[wd], name))
+                if mask & IN_ISDIR:
+                    if self.follow_new_directories and not name.startswith("."):
+                        self._add_directory(path)
+                elif not mask & IN_CREATE:  # A created file is reported once it is written
+                    self._add(path)
+
+    def _add(self, path: str) -> None:
+        if self.wanted(path):
+            self.changed.add(path)
+            self.event.set()
+
+    def _add_directory(self, directory: str) -> None:
+        """Watch a new directory and its subdirectories, and report the files already written to them."""
         try:
-            if needs_build(inpath, [instruction_file, test_file]) or force:
-                build_instructions(inpath, instruction_file, test_file)
-            if reference and (needs_build(inpath, [reference_file]) or force):
-                build_reference(inpath, reference_file, test_file)
-        except SyntaxError as e:
-            print("Syntax error - will not rebuild until next save.")
-            print(e)
-        except UnicodeDecodeError as e:
-            print("Unicode error - will not rebuild until next save.")
-            print(e)
-
-
-async def watch_for_changes(interval_secs=2, files=None):
+            # Watch before listing, so that no file is missed in between
+            self._watch(directory)
+            names = os.listdir(directory)
+        except OSError:
+            return  # Removed again already
+        for name in names:
+            path = os.path.normpath(os.path.join(directory, name))
+            if not os.path.isdir(path):
+                self._add(path)
+            elif not name.startswith("."):
+                self._add_directory(path)
+
+    def _rescan(self) -> None:
+        """Report every solution file in the watched directories, the build cache skips unchanged ones."""
+        watched = set(self.directories.values())
+        for directory in list(watched):
+            try:
+                names = os.listdir(directory)
+            except FileNotFoundError:
+                continue
+            for name in names:
+                path = os.path.normpath(os.path.join(directory, name))
+                if not os.path.isdir(path):
+                    self._add(path)
+                elif self.follow_new_directories and not name.startswith(".") and path not in watched:
+                    self._add_directory(path)
+
+    async def wait(self) -> set[str]:
+        """Wait until files changed and no more events arrived for debounce_secs."""
+        while True:
+            await self.event.wait()
+            # Editors often write a file several times when saving, only build once they are done
+            while self.event.is_set():
+                self.event.clear()
+                try:
+                    await asyncio.wait_for(self.event.wait(), self.debounce_secs)
+                except TimeoutError:
+                    break
+            changed, self.changed = self.changed, set()
+            if changed:
+                return changed
+
+
+class PollingWatcher:
+    """
+    Reports solution files that were written, by polling, for systems without inotify.
+
+    Only the solution files and the directories are stat'ed on each poll. Directories are listed again only
+    when their own mtime changed, i.e. when files were added, removed or renamed in them. With
+    follow_new_directories, directories found in a listing are polled too.
+    """
+
+    def __init__(
+        self,
+        directories: list[str],
+        wanted,
+        debounce_secs: float,
+        interval_secs: float,
+        follow_new_directories: bool = False,
+    ):
+        self.wanted = wanted
+        self.debounce_secs = debounce_secs
+        self.interval_secs = interval_secs
+        self.follow_new_directories = follow_new_directories
+        self.directories = {directory: None for directory in directories}
+        self.files: list[str] = []
+        self.stats = self._scan()
+
+    def _scan(self) -> dict[str, tuple[int, int]]:
+        pending = list(self.directories)
+        while pending:
+            directory = pending.pop()
+            try:
+                current = os.stat(directory).st_mtime_ns
+                listed = [os.path.normpath(os.path.join(directory, name)) for name in os.listdir(directory)]
+            except FileNotFoundError:
+                del self.directories[directory]
+                self.files = [f for f in self.files if os.path.dirname(f) != directory]
+                continue
+            if current != self.directories[directory]:
+                self.directories[directory] = current
+                self.files = [f for f in self.files if os.path.dirname(f) != directory]
+                self.files.extend(f for f in listed if self.wanted(f))
+                if self.follow_new_directories:
+                    new = [
+                        path
+                        for path in listed
+                        if path not in self.directories
+                        and not os.path.basename(path).startswith(".")
+                        and os.path.isdir(path)
+                    ]
+                    self.directories.update(dict.fromkeys(new))
+                    pending.extend(new)
+        stats = {}
+        for path in self.files:
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            stats[path] = (stat.st_mtime_ns, stat.st_size)
+        return stats
+
+    async def wait(self) -> set[str]:
+        """Wait until files changed and stayed unchanged for debounce_secs."""
+        while True:
+            await asyncio.sleep(self.interval_secs)
+            stats = self._scan()
+            changed = {path for path, stat in stats.items() if self.stats.get(path) != stat}
+            while changed:
+                await asyncio.sleep(self.debounce_secs)
+                latest = self._scan()
+                if latest == stats:
+                    break
+                changed |= {path for path, stat in latest.items() if stats.get(path) != stat}
+                stats = latest
+            self.stats = stats
+            if changed:
+                return changed
+
+
+def searched_directories(root: str = ".") -> list[str]:
+    """The directories that glob("**/*_solution.py", recursive=True) searches: all but hidden ones."""
+    directories = []
+    for dirpath, dirnames, _ in os.walk(root):
+        dirnames[:] = [name for name in dirnames if not name.startswith(".")]
+        directories.append(os.path.normpath(dirpath))
+    return directories
+
+
+def make_watcher(files: list[str] | None, debounce_secs: float, interval_secs: float):
+    if files is None:
+        # Watch every directory a solution file could be added to, and follow new ones
+        directories = searched_directories()
+
+        def wanted(path):
+            return path.endswith("_solution.py")
+
+    else:
+        files = {os.path.normpath(f) for f in files}
+        directories = sorted({os.path.dirname(f) or "." for f in files})
+
+        def wanted(path):
+            return os.path.normpath(path) in files
+
+    follow = files is None
+    try:
+        return InotifyWatcher(directories, wanted, debounce_secs, follow)
+    except (OSError, AttributeError) as e:
+        # AttributeError: libc has no inotify functions, e.g. on macOS
+        print(f"inotify unavailable ({e}), polling every {interval_secs}s instead")
+        return PollingWatcher(directories, wanted, debounce_secs, interval_secs, follow)
+
+
+def rebuild_changed(inpath: str, incremental: IncrementalBuild) -> None:
+    """Rebuild the instructions of one changed solution file, only splicing in a markdown cell if possible."""
+    cache = BuildCache()
+    outputs = output_paths(inpath)
+    if not os.path.exists(inpath) or not cache.needs_build(inpath, "instructions", outputs["instructions"]):
+        return
+    source_hash = cache.source_hash(inpath)
+
+    start = time.perf_counter()
+    try:
+        with open(inpath, "r") as f:
+            instructions = incremental.update(f.read())
+    except UnicodeDecodeError:
+        instructions = None  # The full build reports the error
+    if instructions is None:
+        _, _, elapsed, error = build_file(inpath, ["instructions"], incremental)
+        if error:
+            print(error)
+            return
+        print(f"Built {inpath} in {elapsed:.2f}s")
+    else:
+        instruction_path = outputs["instructions"][0]
+        os.chmod(instruction_path, 0o644)
+        with open(instruction_path, "w") as f:
+            f.write(instructions)
+        os.chmod(instruction_path, 0o444)
+        print(f"Updated markdown of {inpath} in {time.perf_counter() - start:.3f}s")
+    cache.record(inpath, "instructions", source_hash)
+    cache.save()
+
+
+async def watch_for_changes(interval_secs=2, files=None, debounce_secs=0.1):
     """Watch and rebuild on input changes."""
+    build_all(files=files)
+    watcher = make_watcher(files, debounce_secs, interval_secs)
+    incremental: dict[str, IncrementalBuild] = {}
     while True:
-        build_all(files=files)
-        await asyncio.sleep(interval_secs)
+        for inpath in sorted(await watcher.wait()):
+            rebuild_changed(inpath, incremental.setdefault(inpath, IncrementalBuild()))
 
 
 if __name__ == "__main__":
@@ -100,6 +493,13 @@ if __name__ == "__main__":
         action="store_true",
         help="Force rebuild even if files are up to date",
     )
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        type=int,
+        default=None,
+        help="Number of files to build in parallel (default: number of CPUs)",
+    )
     parser.add_argument(
         "--reference",
         "-r",
@@ -110,4 +510,4 @@ if __name__ == "__main__":
     if args.watch:
         asyncio.run(watch_for_changes(files=args.files if args.files else None))
     else:
-        build_all(force=args.force, files=args.files if args.files else None, reference=args.reference)
+        build_all(force=args.force, files=args.files if args.files else None, reference=args.reference, jobs=args.jobs)
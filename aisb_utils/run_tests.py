@@ -0,0 +1,343 @@
+"""
+Run the generated *_test.py functions against a solution module in parallel and report their timings.
+
+The test functions take the code under test as arguments, so the runner reads the calls in the solution file
+(e.g. `test_md5(md5_hex)`) and evaluates their arguments in the namespace of the module being tested. That
+is the solution module itself by default, or e.g. a participant's answers file with --module.
+
+Only the definitions that the called tests need are imported, see solution_loader; --eager imports both
+modules in full instead, running the solution's own top level code.
+
+Run from the repository root:
+
+    python aisb_utils/run_tests.py w1d4/w1d4_solution.py --jobs 4 --timeout 60
+"""
+
+import argparse
+import ast
+import contextlib
+import glob
+import importlib
+import importlib.util
+import io
+import json
+import multiprocessing
+import multiprocessing.connection
+import os
+import sys
+import time
+import traceback
+from collections import deque
+from dataclasses import asdict, dataclass, field
+
+from solution_loader import LoadReport, load_solution
+from termcolor import colored
+
+REPORT_PATH = "test_report.json"
+
+
+@dataclass
+class TestCase:
+    name: str  # Function name, with [n] appended for the n-th further call of the same function
+    function: str
+    args: list[str]  # Source of the arguments, evaluated in the namespace of the module under test
+    kwargs: dict[str, str]
+    lineno: int
+
+
+@dataclass
+class TestResult:
+    name: str
+    status: str  # passed, failed, error, timeout or skipped
+    seconds: float
+    lineno: int = 0
+    error: str | None = None
+    output: str = field(default="", repr=False)
+    imports: dict[str, float] = field(default_factory=dict)  # Lazy modules first imported by this test
+
+
+def _test_calls(statements: list[ast.stmt]):
+    """
+    Yield the toplevel test_* calls, only following the SOLUTION branch of `if "SOLUTION":` blocks.
+
+    Calls whose result is assigned count too:
+
+    >>> source = 'test_a(f)\\nposition = test_b(g, h)\\nresult: bool = test_c()\\nx = helper()'
+    >>> [call.func.id for call in _test_calls(ast.parse(source).body)]
+    ['test_a', 'test_b', 'test_c']
+    """
+    for stmt in statements:
+        if isinstance(stmt, (ast.Expr, ast.Assign, ast.AnnAssign)) and isinstance(stmt.value, ast.Call):
+            call = stmt.value
+            if isinstance(call.func, ast.Name) and call.func.id.startswith("test_"):
+                yield call
+        elif isinstance(stmt, ast.If):
+            marker = stmt.test.value if isinstance(stmt.test, ast.Constant) else None
+            if isinstance(marker, str) and marker.startswith("SOLUTION"):
+                yield from _test_calls(stmt.body)
+            elif marker != "SKIP":
+                yield from _test_calls(stmt.body)
+                yield from _test_calls(stmt.orelse)
+        elif isinstance(stmt, (ast.With, ast.Try)):
+            yield from _test_calls(stmt.body)
+
+
+def test_functions(test_path: str) -> set[str]:
+    """Names of the test_* functions defined in a test file, without importing it."""
+    with open(test_path, "r") as f:
+        tree = ast.parse(f.read(), test_path)
+    return {
+        stmt.name
+        for stmt in tree.body
+        if isinstance(stmt, (ast.FunctionDef, ast.AsyncFunctionDef)) and stmt.name.startswith("test_")
+    }
+
+
+def discover_tests(solution_path: str, functions: set[str]) -> list[TestCase]:
+    """Find the calls of the given test functions in a solution file."""
+    with open(solution_path, "r") as f:
+        tree = ast.parse(f.read(), solution_path)
+
+    cases: list[TestCase] = []
+    seen = set()
+    counts: dict[str, int] = {}
+    for call in _test_calls(tree.body):
+        function = call.func.id  # type: ignore
+        if function not in functions:
+            continue  # A helper defined and used in the solution itself
+        args = [ast.unparse(arg) for arg in call.args]
+        kwargs = {kw.arg: ast.unparse(kw.value) for kw in call.keywords if kw.arg is not None}
+        key = (function, tuple(args), tuple(sorted(kwargs.items())))
+        if key in seen:
+            continue  # e.g. the same call in both branches of `if "SOLUTION":`
+        seen.add(key)
+        count = counts.get(function, 0)
+        counts[function] = count + 1
+        name = f"{function}[{count}]" if count else function
+        cases.append(TestCase(name, function, args, kwargs, call.lineno))
+    return cases
+
+
+def load_module(path: str, name: str | None = None):
+    """Import a module from a file, with its own directory on sys.path like when running it directly."""
+    directory = os.path.dirname(os.path.abspath(path))
+    if directory not in sys.path:
+        sys.path.insert(0, directory)
+    name = name or os.path.splitext(os.path.basename(path))[0]
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)  # type: ignore
+    sys.modules[name] = module
+    spec.loader.exec_module(module)  # type: ignore
+    return module
+
+
+def _argument_names(cases: list[TestCase]) -> set[str]:
+    """Names that the arguments of the test calls load from the module under test."""
+    sources = [arg for case in cases for arg in case.args] + [v for case in cases for v in case.kwargs.values()]
+    return {
+        node.id
+        for source in sources
+        for node in ast.walk(ast.parse(source, mode="eval"))
+        if isinstance(node, ast.Name) and isinstance(node.ctx, ast.Load)
+    }
+
+
+def _run_case(conn, test_module, namespace: dict, case: TestCase, loads: list[LoadReport]) -> None:
+    """Run one test in a forked worker process and send the TestResult back."""
+    imported_before = {name for load in loads for name in load.imports}
+    output = io.StringIO()
+    status, error = "passed", None
+    start = time.perf_counter()
+    try:
+        with contextlib.redirect_stdout(output), contextlib.redirect_stderr(output):
+            # Arguments are evaluated here, so that a missing function only fails its own tests
+            try:
+                args = [eval(arg, namespace) for arg in case.args]
+                kwargs = {key: eval(value, namespace) for key, value in case.kwargs.items()}
+                test = getattr(test_module, case.function)
+            except (NameError, AttributeError) as e:
+                status, error = "error", f"{type(e).__name__}: {e}"
+            else:
+                test(*args, **kwargs)
+    except BaseException:  # noqa: BLE001 - anything a test raises, including SystemExit, only fails that test
+        status, error = "failed", traceback.format_exc()
+    seconds = time.perf_counter() - start
+    # Lazy modules are imported in the worker by the first test that uses them
+    imports = {name: t for load in loads for name, t in load.imports.items() if name not in imported_before}
+    conn.send(TestResult(case.name, status, seconds, case.lineno, error, output.getvalue(), imports))
+    conn.close()
+
+
+def run_cases(
+    test_module, namespace: dict, cases: list[TestCase], jobs: int, timeout: float, loads: list[LoadReport]
+) -> list[TestResult]:
+    """
+    Run each test in its own forked process, at most jobs at a time.
+
+    Forking after the modules were imported means that workers start immediately and share the parent's
+    memory. A test that exceeds the timeout is killed without affecting the others.
+    """
+    ctx = multiprocessing.get_context("fork")
+    pending = deque(cases)
+    running: dict = {}  # connection -> (case, process, start time)
+    results = []
+    while pending or running:
+        while pending and len(running) < jobs:
+            case = pending.popleft()
+            receiver, sender = ctx.Pipe(duplex=False)
+            process = ctx.Process(target=_run_case, args=(sender, test_module, namespace, case, loads))
+            process.start()
+            sender.close()
+            running[receiver] = (case, process, time.perf_counter())
+
+        next_deadline = min(start for _, _, start in running.values()) + timeout
+        ready = multiprocessing.connection.wait(list(running), max(0.0, next_deadline - time.perf_counter()))
+        now = time.perf_counter()
+        for conn in list(running):
+            case, process, start = running[conn]
+            if conn in ready:
+                try:
+                    results.append(conn.recv())
+                except EOFError:
+                    # The worker died without sending a result, e.g. because the test called os._exit
+                    process.join()
+                    results.append(
+                        TestResult(case.name, "error", now - start, case.lineno, f"Exit code {process.exitcode}")
+                    )
+            elif now - start >= timeout:
+                process.kill()
+                results.append(
+                    TestResult(case.name, "timeout", now - start, case.lineno, f"Timed out after {timeout}s")
+                )
+            else:
+                continue
+            process.join()
+            conn.close()
+            del running[conn]
+    order = {case.name: i for i, case in enumerate(cases)}
+    return sorted(results, key=lambda result: order[result.name])
+
+
+def run_solution_tests(
+    solution_path: str, module_path: str | None, jobs: int, timeout: float, keyword: str | None, eager: bool = False
+) -> dict:
+    """Import the modules for one solution file, run its tests and return its part of the report."""
+    test_path = solution_path.replace("_solution.py", "_test.py")
+    module_path = module_path or solution_path
+    report = {"solution": solution_path, "module": module_path, "tests": test_path}
+
+    functions = test_functions(test_path)
+    all_cases = discover_tests(solution_path, functions)
+    cases = [case for case in all_cases if not keyword or keyword in case.name]
+
+    start = time.perf_counter()
+    import_output = io.StringIO()
+    try:
+        # The modules may run code at import time, including the tests themselves in the solution file
+        with contextlib.redirect_stdout(import_output):
+            if eager:
+                test_module = load_module(test_path)
+                module = load_module(module_path)
+                loads = []
+            else:
+                test_module, test_load = load_solution(test_path, {case.function for case in cases})
+                module, module_load = load_solution(module_path, _argument_names(cases))
+                loads = [test_load, module_load]
+    except BaseException:  # noqa: BLE001 - a solution file that fails to import is reported, the other files still run
+        report.update(import_seconds=time.perf_counter() - start, error=traceback.format_exc(), results=[])
+        return report
+    report["import_seconds"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    results = run_cases(test_module, vars(module), cases, jobs, timeout, loads)
+    report["wall_seconds"] = time.perf_counter() - start
+
+    # Seconds per imported module, including lazy modules imported by the tests (each worker imports them
+    # anew, the slowest import is reported)
+    imports: dict[str, float] = {}
+    for load in loads:
+        for name, seconds in load.imports.items():
+            imports[name] = imports.get(name, 0.0) + seconds
+    for result in results:
+        for name, seconds in result.imports.items():
+            imports[name] = max(imports.get(name, 0.0), seconds)
+    report["imports"] = dict(sorted(imports.items(), key=lambda item: item[1], reverse=True))
+    report["lazy"] = [name for load in loads for name in load.lazy]
+
+    called = {case.function for case in all_cases}
+    for name in sorted(functions):
+        if name not in called and (not keyword or keyword in name):
+            results.append(TestResult(name, "skipped", 0.0, error="Not called in the solution file"))
+    report["results"] = [asdict(result) for result in results]
+    return report
+
+
+STATUS_COLORS = {"passed": "green", "failed": "red", "error": "red", "timeout": "red", "skipped": "yellow"}
+
+
+def print_report(report: dict, verbose: bool) -> None:
+    print(f"{report['tests']} against {report['module']}:")
+    if "error" in report:
+        print(colored(f"  Import failed after {report['import_seconds']:.2f}s", "red"))
+        print(report["error"])
+        return
+    for result in report["results"]:
+        status = colored(f"{result['status']:>7}", STATUS_COLORS[result["status"]])
+        print(f"  {status} {result['seconds']:8.2f}s  {result['name']}")
+        if result["error"] and result["status"] != "skipped":
+            print("    " + result["error"].rstrip().replace("\n", "\n    "))
+        if verbose and result["output"]:
+            print("    " + result["output"].rstrip().replace("\n", "\n    "))
+    slowest = [f"{name} {seconds:.2f}s" for name, seconds in list(report["imports"].items())[:5] if seconds >= 0.01]
+    if slowest:
+        print(f"  slowest imports: {', '.join(slowest)}")
+    total = sum(result["seconds"] for result in report["results"])
+    print(
+        f"  import {report['import_seconds']:.2f}s, tests {total:.2f}s in total, "
+        f"{report['wall_seconds']:.2f}s wall clock time"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("files", nargs="*", help="Solution files whose tests to run (default: all with a test file)")
+    parser.add_argument("--module", "-m", help="Module to test instead of the solution, e.g. an answers file")
+    parser.add_argument("--jobs", "-j", type=int, default=None, help="Tests to run in parallel (default: CPUs)")
+    parser.add_argument("--timeout", "-t", type=float, default=120, help="Seconds before a test is killed")
+    parser.add_argument("--keyword", "-k", help="Only run tests whose name contains this string")
+    parser.add_argument("--report", "-r", default=REPORT_PATH, help="Path of the JSON timing report")
+    parser.add_argument("--verbose", "-v", action="store_true", help="Print the output of each test")
+    parser.add_argument("--eager", action="store_true", help="Import the modules in full, running their top level code")
+    args = parser.parse_args()
+
+    files = args.files or sorted(glob.glob("**/*_solution.py", recursive=True))
+    files = [os.path.abspath(f) for f in files if os.path.exists(f.replace("_solution.py", "_test.py"))]
+    if args.module and len(files) != 1:
+        parser.error("--module needs exactly one solution file")
+    module_path = os.path.abspath(args.module) if args.module else None
+    report_path = os.path.abspath(args.report)
+    root = os.getcwd()
+
+    reports = []
+    for solution_path in files:
+        # Solutions open their resources relative to their own directory
+        os.chdir(os.path.dirname(solution_path))
+        try:
+            report = run_solution_tests(
+                solution_path, module_path, args.jobs or os.cpu_count() or 1, args.timeout, args.keyword, args.eager
+            )
+        finally:
+            os.chdir(root)
+        for key in ("solution", "module", "tests"):
+            report[key] = os.path.relpath(report[key], root)
+        print_report(report, args.verbose)
+        reports.append(report)
+
+    with open(report_path, "w") as f:
+        json.dump({"timeout": args.timeout, "reports": reports}, f, indent=1)
+    print(f"Wrote {os.path.relpath(report_path, root)}")
+    results = [result for report in reports for result in report["results"]]
+    failed = any("error" in report for report in reports) or any(
+        result["status"] in ("failed", "error", "timeout") for result in results
+    )
+    sys.exit(1 if failed else 0)
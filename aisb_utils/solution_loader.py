@@ -0,0 +1,257 @@
+"""
+Import only the definitions of a solution (or test, or answers) file, without running its exercises.
+
+Importing a solution file runs every test call, demo and benchmark cell at top level, and imports every
+third-party package the day uses. For running tests or benchmarks we only need a few functions, so
+load_solution executes just the toplevel definitions that the requested names depend on:
+
+- Imports, functions, classes and assignments are definitions, and so are calls that configure an imported
+  module (`sys.path.append(...)`, `django.setup()`) or modify a toplevel variable (`handlers.append(...)`,
+  `exec(source, namespace)`). Other expression statements (test calls, demos, markdown strings), loops,
+  `with` blocks and `if __name__ == "__main__":` are skipped.
+- `if "SOLUTION":` blocks contribute their SOLUTION branch, `if "SKIP":` blocks nothing.
+- A definition is kept if it defines a requested name or a name used by another kept definition.
+- `import x` of a third-party package binds a lazy module, which is only imported on first attribute access.
+
+Tests that depend on state created by a demo cell need a regular import instead.
+"""
+
+import ast
+import builtins
+import importlib.util
+import os
+import sys
+import time
+import types
+from dataclasses import dataclass, field
+
+BUILTIN_NAMES = set(dir(builtins))
+# Builtins whose calls modify their arguments, e.g. exec(source, namespace)
+MUTATING_BUILTINS = {"exec", "setattr", "delattr"}
+
+
+@dataclass
+class LoadReport:
+    path: str
+    seconds: float = 0.0
+    definitions: int = 0  # Toplevel definitions in the file
+    executed: int = 0  # Definitions that were needed and executed
+    imports: dict[str, float] = field(default_factory=dict)  # Seconds spent importing each module
+    lazy: list[str] = field(default_factory=list)  # Modules bound lazily, timed once they are used
+
+
+@dataclass
+class Definition:
+    node: ast.stmt
+    defines: set[str]
+    uses: set[str]
+
+
+def _defined_names(node: ast.stmt) -> set[str]:
+    if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+        return {node.name}
+    if isinstance(node, (ast.Import, ast.ImportFrom)):
+        return {alias.asname or alias.name.split(".")[0] for alias in node.names}
+    if isinstance(node, (ast.Assign, ast.AnnAssign, ast.AugAssign)):
+        targets = node.targets if isinstance(node, ast.Assign) else [node.target]
+        return {n.id for target in targets for n in ast.walk(target) if isinstance(n, ast.Name)}
+    names = set()
+    for child in ast.iter_child_nodes(node):
+        if isinstance(child, ast.stmt):
+            names |= _defined_names(child)
+        elif isinstance(child, ast.excepthandler):
+            for stmt in child.body:
+                names |= _defined_names(stmt)
+    return names
+
+
+def _used_names(node: ast.stmt) -> set[str]:
+    return {n.id for n in ast.walk(node) if isinstance(n, ast.Name) and isinstance(n.ctx, ast.Load)}
+
+
+def _filter_definitions(statements: list[ast.stmt], toplevel: bool = True) -> list[ast.stmt]:
+    """Keep the statements that define something, recursing into if and try blocks."""
+    kept = []
+    for stmt in statements:
+        if isinstance(
+            stmt,
+            (
+                ast.Import,
+                ast.ImportFrom,
+                ast.FunctionDef,
+                ast.AsyncFunctionDef,
+                ast.ClassDef,
+                ast.Assign,
+                ast.AnnAssign,
+                ast.AugAssign,
+            ),
+        ):
+            kept.append(stmt)
+        elif isinstance(stmt, ast.Expr) and isinstance(stmt.value, ast.Call):
+            # Toplevel calls are sorted out in needed_definitions, nested ones are handling a demo's result
+            if toplevel:
+                kept.append(stmt)
+        elif isinstance(stmt, ast.If):
+            marker = stmt.test.value if isinstance(stmt.test, ast.Constant) else None
+            if isinstance(marker, str) and marker.startswith("SOLUTION"):
+                kept.extend(_filter_definitions(stmt.body, toplevel))
+            elif marker == "SKIP" or "__name__" in _used_names(ast.Expr(stmt.test)):
+                continue
+            else:
+                body, orelse = _filter_definitions(stmt.body, False), _filter_definitions(stmt.orelse, False)
+                if body or orelse:
+                    kept.append(ast.copy_location(ast.If(stmt.test, body or [ast.Pass()], orelse), stmt))
+        elif isinstance(stmt, ast.Try):
+            body = _filter_definitions(stmt.body, False)
+            if body:
+                filtered = ast.Try(body, stmt.handlers, _filter_definitions(stmt.orelse, False), stmt.finalbody)
+                kept.append(ast.copy_location(filtered, stmt))
+    return kept
+
+
+def needed_definitions(tree: ast.Module, names: set[str] | None) -> list[Definition]:
+    """
+    Return the definitions that the given names depend on, in source order.
+
+    With names=None, all definitions are returned.
+    """
+    nodes = _filter_definitions(tree.body)
+    modules = {name for node in nodes if isinstance(node, ast.Import) for name in _defined_names(node)}
+    variables = {
+        name for node in nodes if isinstance(node, (ast.Assign, ast.AnnAssign)) for name in _defined_names(node)
+    }
+    definitions = []
+    for node in nodes:
+        uses = _used_names(node)
+        if not isinstance(node, ast.Expr):
+            definitions.append(Definition(node, _defined_names(node), uses))
+            continue
+        func = node.value.func  # type: ignore
+        while isinstance(func, ast.Attribute):
+            func = func.value
+        if isinstance(func, ast.Name) and func.id in modules:
+            # Configuration like sys.path.append(...) or django.setup(), always needed
+            definitions.append(Definition(node, set(), uses))
+        elif isinstance(func, ast.Name) and func.id in variables:
+            # Modifies a variable, e.g. handlers.append(...)
+            definitions.append(Definition(node, {func.id}, uses))
+        elif isinstance(func, ast.Name) and func.id in MUTATING_BUILTINS and uses & variables:
+            # Part of building a variable, e.g. exec(source, namespace)
+            definitions.append(Definition(node, uses & variables, uses))
+        # Anything else is an exercise or demo call
+    if names is None:
+        return definitions
+
+    needed = set(names)
+    defined = set().union(*(definition.defines for definition in definitions))
+    # Statements that define nothing, like sys.path changes, are always needed
+    kept = [not definition.defines for definition in definitions]
+    for definition, k in zip(definitions, kept):
+        if k:
+            needed |= definition.uses
+    changed = True
+    while changed:
+        changed = False
+        # Names that no definition provides may come from a star import
+        unresolved = needed - defined - BUILTIN_NAMES
+        for i, definition in enumerate(definitions):
+            if not kept[i] and (definition.defines & needed or ("*" in definition.defines and unresolved)):
+                kept[i] = changed = True
+                needed |= definition.uses
+    return [definition for definition, k in zip(definitions, kept) if k]
+
+
+class _TimedLoader:
+    """Wraps a loader to record how long executing the module takes, for lazily imported modules."""
+
+    def __init__(self, loader, report: LoadReport, name: str):
+        self.loader, self.report, self.name = loader, report, name
+
+    def create_module(self, spec):
+        return self.loader.create_module(spec)
+
+    def exec_module(self, module):
+        start = time.perf_counter()
+        try:
+            self.loader.exec_module(module)
+        finally:
+            self.report.imports[self.name] = time.perf_counter() - start
+
+
+def lazy_import(name: str, report: LoadReport) -> types.ModuleType:
+    """Import a module on first attribute access, see importlib.util.LazyLoader."""
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None or spec.loader is None:
+        raise ModuleNotFoundError(f"No module named {name!r}", name=name)
+    spec.loader = importlib.util.LazyLoader(_TimedLoader(spec.loader, report, name))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    report.lazy.append(name)
+    return module
+
+
+def _is_lazy_import(node: ast.stmt) -> bool:
+    """Whether node only binds third-party modules that aren't imported yet, e.g. `import numpy as np`."""
+    if not isinstance(node, ast.Import):
+        return False
+    for alias in node.names:
+        top_level = alias.name.split(".")[0]
+        if top_level in sys.stdlib_module_names or alias.name in sys.modules:
+            return False
+        if "." in alias.name and alias.asname is None:
+            return False  # `import a.b` binds a, which must be imported for a.b to be an attribute
+    return True
+
+
+def load_solution(
+    path: str, names: set[str] | None = None, module_name: str | None = None
+) -> tuple[types.ModuleType, LoadReport]:
+    """
+    Import the definitions of a file that the given names need, without running anything else.
+
+    Args:
+        path: Python file to load
+        names: Names the caller needs from the module (default: all definitions)
+        module_name: Name to register the module as in sys.modules (default: the file name)
+
+    Returns:
+        (module, report of what was executed and how long imports took)
+    """
+    start = time.perf_counter()
+    report = LoadReport(path)
+    with open(path, "r") as f:
+        tree = ast.parse(f.read(), path)
+    report.definitions = len(needed_definitions(tree, None))
+    definitions = needed_definitions(tree, names)
+
+    # Like running the file directly, so that it can import modules next to it
+    directory = os.path.dirname(os.path.abspath(path))
+    if directory not in sys.path:
+        sys.path.insert(0, directory)
+
+    module_name = module_name or os.path.splitext(os.path.basename(path))[0]
+    module = types.ModuleType(module_name)
+    module.__file__ = os.path.abspath(path)
+    sys.modules[module_name] = module
+    namespace = vars(module)
+    for definition in definitions:
+        node = definition.node
+        report.executed += 1
+        if _is_lazy_import(node):
+            for alias in node.names:  # type: ignore
+                namespace[alias.asname or alias.name] = lazy_import(alias.name, report)
+            continue
+        # Filtered if and try blocks are new nodes without line numbers
+        code = compile(ast.fix_missing_locations(ast.Module(body=[node], type_ignores=[])), path, "exec")
+        if isinstance(node, (ast.Import, ast.ImportFrom)):
+            imported = node.names[0].name if isinstance(node, ast.Import) else node.module or "."
+            import_start = time.perf_counter()
+            exec(code, namespace)  # noqa: S102 - an import statement of the repo's own solution file
+            report.imports[imported] = report.imports.get(imported, 0.0) + time.perf_counter() - import_start
+        else:
+            exec(code, namespace)  # noqa: S102 - runs a definition of the repo's own solution file, like importing it
+    report.seconds = time.perf_counter() - start
+    return module, report
@@ -2,6 +2,9 @@ from os.path import basename
 
 import libcst as cst
 import collections
+import functools
+import io
+import os
 import re
 import string
 from dataclasses import dataclass
@@ -132,6 +135,68 @@ class StripTestFunctions(cst.CSTTransformer):
         return updated_node
 
 
+class StatementsOnly:
+    """
+    Mixin for transformers that only act on statements.
+
+    Skips subtrees that can't contain statements (expressions, parameters, whitespace, ...), which are
+    the vast majority of nodes in a solution file.
+    """
+
+    NO_STATEMENTS = (
+        cst.BaseExpression,
+        cst.Parameters,
+        cst.Decorator,
+        cst.Annotation,
+        cst.EmptyLine,
+        cst.TrailingWhitespace,
+        cst.BaseParenthesizableWhitespace,
+    )
+
+    def on_visit(self, node: cst.CSTNode) -> bool:
+        if isinstance(node, self.NO_STATEMENTS):
+            return False
+        return super().on_visit(node)
+
+
+class SolutionTemplate(StatementsOnly, StripSolutions):
+    """Participant template in a single walk: StripSolutions, StripTestFunctions and CollectImports combined."""
+
+    def __init__(self, test_file_name):
+        super().__init__()
+        self.imports = []
+        self.test_extractor = StripTestFunctions(test_file_name)
+
+    @property
+    def test_functions(self):
+        return self.test_extractor.test_functions
+
+    def _collect_imports(self, node: cst.SimpleStatementLine | cst.SimpleStatementSuite) -> bool:
+        self.imports.extend(stmt for stmt in node.body if isinstance(stmt, (cst.Import, cst.ImportFrom)))
+        return False  # Small statements can't contain anything else we need
+
+    visit_SimpleStatementLine = _collect_imports
+    visit_SimpleStatementSuite = _collect_imports
+
+    def leave_FunctionDef(self, original_node: cst.FunctionDef, updated_node: cst.FunctionDef):
+        updated_node = super().leave_FunctionDef(original_node, updated_node)
+        return self.test_extractor.leave_FunctionDef(original_node, updated_node)
+
+
+class SolutionReference(StatementsOnly, ExtractSolutionBlocks):
+    """Reference solution in a single walk: ExtractSolutionBlocks and StripTestFunctions combined."""
+
+    def __init__(self, test_file_name):
+        super().__init__()
+        self.test_extractor = StripTestFunctions(test_file_name)
+
+    def visit_SimpleStatementLine(self, node: cst.SimpleStatementLine):
+        return False
+
+    def leave_FunctionDef(self, original_node: cst.FunctionDef, updated_node: cst.FunctionDef):
+        return self.test_extractor.leave_FunctionDef(original_node, updated_node)
+
+
 @dataclass
 class Snippet:
     language: str
@@ -209,6 +274,26 @@ def check_html_tags(text: str) -> list[str]:
     return warnings
 
 
+def render_markdown(raw_value: str) -> str:
+    """Markdown text of a toplevel string as InstructionMaker emits it."""
+    return "\n".join(preprocess_markdown(raw_value).splitlines()) + "\n"  # trailing newline is needed for MD031
+
+
+@dataclass(frozen=True)
+class MarkdownCell:
+    text: str
+    headings: tuple[tuple[str, str], ...]  # (pounds, header text) of each heading line
+    warnings: tuple[str, ...]
+
+
+@functools.lru_cache(maxsize=1024)
+def render_markdown_cell(raw_value: str) -> MarkdownCell:
+    """Render a toplevel string. Cached by content, so unchanged cells are only rendered once per process."""
+    text = render_markdown(raw_value)
+    headings = tuple(m.groups() for m in map(TOC_RE.match, text.splitlines()) if m is not None)
+    return MarkdownCell(text, headings, tuple(check_html_tags(text)))
+
+
 class InstructionMaker(cst.CSTVisitor):
     def __init__(self):
         super().__init__()
@@ -224,14 +309,12 @@ class InstructionMaker(cst.CSTVisitor):
             if is_toplevel_string_constant(stmt):
                 # Extract the string value
                 string_node = stmt.body[0].value  # type: ignore
-                text = string_node.raw_value
-                text = preprocess_markdown(text)
-                text = self._maybe_add_toc(text)
-                warnings = check_html_tags(text)
-                if warnings:
+                cell = render_markdown_cell(string_node.raw_value)
+                self._add_toc_entries(cell.headings)
+                if cell.warnings:
                     print(f"Bad HTML tags in statement")
-                    print("\n".join(warnings))
-                self.snippets.append(Snippet("markdown", text))
+                    print("\n".join(cell.warnings))
+                self.snippets.append(Snippet("markdown", cell.text))
 
             else:
                 # Convert back to source code
@@ -240,6 +323,8 @@ class InstructionMaker(cst.CSTVisitor):
                     self.snippets[-1].text += src
                 else:
                     self.snippets.append(Snippet("python", src))
+        # Only toplevel statements matter, don't walk the rest of the tree
+        return False
 
     def dump(self, fp, python_prefix_snippet):
         texts = []
@@ -264,27 +349,21 @@ class InstructionMaker(cst.CSTVisitor):
             last_language = snippet.language
         fp.write("\n".join(texts))
 
-    def _maybe_add_toc(self, text: str) -> str:
-        lines = text.splitlines()
-        for i, line in enumerate(lines):
-            m = TOC_RE.match(line)
-            if m is not None:
-                pounds, header_text = m.groups()
-                prefix = header_text.replace(" ", "-")
-                count = self.counters[prefix]
-                slug = f"{prefix}-{count}" if count > 0 else prefix
-                slug = slug.lower()  # VSCode only wants lowercase slugs
-                slug = "".join(c for c in slug if c in SLUG_ALLOWED_CHARS)
-                level = len(pounds) - 2
-                if level < 0:
-                    continue  # Don't need to repeat toplevel
-                if level >= len(TOC_LEVELS):
-                    raise ValueError(f"TOC doesn't yet support header level {level}: {header_text}")
-                entry = TOCEntry(title=header_text, level=level, slug=slug)
-                self.toc_entries.append(entry)
-                self.counters[prefix] = count + 1
-                # lines[i] = f'{pounds} <a id="#{slug}">{header_text}</a>'
-        return "\n".join(lines) + "\n"  # trailing newline is needed for MD031
+    def _add_toc_entries(self, headings: tuple[tuple[str, str], ...]) -> None:
+        for pounds, header_text in headings:
+            prefix = header_text.replace(" ", "-")
+            count = self.counters[prefix]
+            slug = f"{prefix}-{count}" if count > 0 else prefix
+            slug = slug.lower()  # VSCode only wants lowercase slugs
+            slug = "".join(c for c in slug if c in SLUG_ALLOWED_CHARS)
+            level = len(pounds) - 2
+            if level < 0:
+                continue  # Don't need to repeat toplevel
+            if level >= len(TOC_LEVELS):
+                raise ValueError(f"TOC doesn't yet support header level {level}: {header_text}")
+            entry = TOCEntry(title=header_text, level=level, slug=slug)
+            self.toc_entries.append(entry)
+            self.counters[prefix] = count + 1
 
     def _dump_toc(self) -> str:
         lines = ["## Table of Contents", ""]
@@ -294,6 +373,107 @@ class InstructionMaker(cst.CSTVisitor):
         return "\n".join(lines)
 
 
+def markdown_headings(text: str) -> list[str]:
+    """Lines of a markdown text that produce TOC entries, plus the TOC marker if present."""
+    headings = [line for line in text.splitlines() if TOC_RE.match(line)]
+    return headings + [TOC_MARKER] if TOC_MARKER in text else headings
+
+
+class IncrementalBuild:
+    """
+    Remembers the last build of a solution file so that an edit of a single markdown cell can be
+    applied without parsing the file again.
+
+    Only edits that stay inside one toplevel string and don't touch its headings (which would change
+    the TOC and the slugs of later sections) take the fast path. The test file can't change in that
+    case, so only the instructions are rewritten.
+    """
+
+    def __init__(self):
+        self.source = None
+        self.maker = None
+        # (start offset, end offset, snippet index) of each toplevel string in the source
+        self.markdown_spans: list[tuple[int, int, int]] = []
+
+    def record(self, source: str, module: cst.Module, maker: InstructionMaker) -> None:
+        """Remember a full build of source."""
+        self.source, self.maker, self.markdown_spans = None, None, []
+        snippet_indices = [i for i, snippet in enumerate(maker.snippets) if snippet.language == "markdown"]
+        spans = []
+        offset = len("".join(module.code_for_node(line) for line in module.header))
+        for stmt in module.body:
+            end = offset + len(module.code_for_node(stmt))
+            if is_toplevel_string_constant(stmt):
+                if len(spans) == len(snippet_indices):
+                    return
+                index = snippet_indices[len(spans)]
+                # Stripping solutions could in principle move strings around, then the spans can't be trusted
+                if maker.snippets[index].text != render_markdown_cell(stmt.body[0].value.raw_value).text:  # type: ignore
+                    return
+                spans.append((offset, end, index))
+            offset = end
+        if len(spans) == len(snippet_indices):
+            self.source, self.maker, self.markdown_spans = source, maker, spans
+
+    def update(self, source: str) -> str | None:
+        """
+        Apply an edit to the last recorded build.
+
+        Returns:
+            The new instructions, or None if the edit needs a full build
+        """
+        if self.source is None:
+            return None
+        if source == self.source:
+            return self._dump()
+
+        # The edited region is what's left after removing the common prefix and suffix
+        prefix = len(os.path.commonprefix([self.source, source]))
+        max_suffix = min(len(self.source), len(source)) - prefix
+        suffix = len(os.path.commonprefix([self.source[::-1][:max_suffix], source[::-1][:max_suffix]]))
+        old_end = len(self.source) - suffix
+        for start, end, index in self.markdown_spans:
+            if start <= prefix and old_end <= end:
+                break
+        else:
+            return None
+
+        new_end = end + len(source) - len(self.source)
+        statement = source[start:new_end]
+        if not statement.endswith("\n"):
+            return None  # The string now runs into the next statement
+        try:
+            module = cst.parse_module(statement)
+        except cst.ParserSyntaxError:
+            return None
+        if len(module.body) != 1 or module.footer or not is_toplevel_string_constant(module.body[0]):
+            return None
+        string_node = module.body[0].body[0].value  # type: ignore
+        if not isinstance(string_node, cst.SimpleString):
+            return None
+
+        cell = render_markdown_cell(string_node.raw_value)
+        if markdown_headings(cell.text) != markdown_headings(self.maker.snippets[index].text):
+            return None
+        if cell.warnings:
+            print("Bad HTML tags in statement")
+            print("\n".join(cell.warnings))
+
+        self.maker.snippets[index].text = cell.text
+        shift = new_end - end
+        self.markdown_spans = [
+            (s, e, i) if s < start else (s, new_end, i) if s == start else (s + shift, e + shift, i)
+            for s, e, i in self.markdown_spans
+        ]
+        self.source = source
+        return self._dump()
+
+    def _dump(self) -> str:
+        instructions = io.StringIO()
+        self.maker.dump(instructions, "")
+        return instructions.getvalue()
+
+
 def warn_fixme(text: str, file_name: str) -> None:
     """Emit a warning for each line that contains a FIXME comment."""
     for lineno, line in enumerate(text.splitlines(), start=1):
@@ -306,62 +486,69 @@ def warn_fixme(text: str, file_name: str) -> None:
             )
 
 
-def build(input_fd, output_instructions_fd, output_test_fd):
-    print(f"Building: {input_fd.name} -> {output_instructions_fd.name}, {output_test_fd.name}")
-    input_str = input_fd.read()
-
-    # Warn about any FIXME comments present in the original source
-    warn_fixme(input_str, input_fd.name)
+def build_outputs(
+    input_fd,
+    output_instructions_fd=None,
+    output_test_fd=None,
+    output_reference_fd=None,
+    tests_file_path: str | None = None,
+    incremental: IncrementalBuild | None = None,
+):
+    """
+    Parse a solution file once and write any combination of instructions, tests and reference.
 
+    If incremental is given, the build of the instructions is recorded in it for later updates.
+    """
+    input_str = input_fd.read()
+    tests_file_path = tests_file_path or output_test_fd.name
     module = cst.parse_module(input_str)
 
-    # Collect imports from the original file
-    import_collector = CollectImports()
-    module.visit(import_collector)
-
-    # Strip solutions for template
-    without_solutions = module.visit(StripSolutions())
-
-    # Move test functions from the solutions file to the test file
-    test_extractor = StripTestFunctions(test_file_name=output_test_fd.name)
-    without_tests = without_solutions.visit(test_extractor)
-    if test_extractor.test_functions:
-        # Write imports first
-        output_test_fd.write(
-            "\n".join(
-                [
-                    "# Allow imports from parent directory",
-                    "import sys",
-                    "import os",
-                    "sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))",
-                    "",
-                    "",
-                ]
-            )
-        )
-        import_output = [module.code_for_node(import_node) for import_node in import_collector.imports]
-        output_test_fd.write("\n".join(import_output) + "\n\n")
-        # Then write test functions
-        test_output = [module.code_for_node(test_func) for test_func in test_extractor.test_functions]
-        output_test_fd.write("\n\n".join(test_output))
-
-    # Generate the instructions markdown from the solutions (without tests)
-    sm = InstructionMaker()
-    without_tests.visit(sm)
-    sm.dump(output_instructions_fd, "")
+    if output_instructions_fd is not None:
+        # Warn about any FIXME comments present in the original source
+        warn_fixme(input_str, input_fd.name)
+
+        # Strip solutions for template and move test functions from the solutions file to the test file
+        template = SolutionTemplate(test_file_name=tests_file_path)
+        without_tests = module.visit(template)
+        if template.test_functions:
+            # Imports first, then test functions
+            header = [
+                "# Allow imports from parent directory",
+                "import sys",
+                "import os",
+                "sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))",
+                "",
+                "",
+            ]
+            import_output = [module.code_for_node(import_node) for import_node in template.imports]
+            test_output = [module.code_for_node(test_func) for test_func in template.test_functions]
+            output_test_fd.write("\n".join(header) + "\n".join(import_output) + "\n\n" + "\n\n".join(test_output))
+
+        # Generate the instructions markdown from the solutions (without tests)
+        sm = InstructionMaker()
+        without_tests.visit(sm)
+        instructions = io.StringIO()
+        sm.dump(instructions, "")
+        output_instructions_fd.write(instructions.getvalue())
+        if incremental is not None:
+            incremental.record(input_str, module, sm)
+
+    if output_reference_fd is not None:
+        # Extract only SOLUTION blocks and remove test functions
+        reference_code = module.visit(SolutionReference(test_file_name=tests_file_path))
+        output_reference_fd.write(reference_code.code)
+
+
+def build(input_fd, output_instructions_fd, output_test_fd, incremental: IncrementalBuild | None = None):
+    print(f"Building: {input_fd.name} -> {output_instructions_fd.name}, {output_test_fd.name}")
+    build_outputs(
+        input_fd,
+        output_instructions_fd=output_instructions_fd,
+        output_test_fd=output_test_fd,
+        incremental=incremental,
+    )
 
 
 def build_reference_py(input_fd, output_reference_fd, tests_file_path: str):
     print(f"Building: {input_fd.name} -> {output_reference_fd.name}")
-    input_str = input_fd.read()
-    module = cst.parse_module(input_str)
-
-    # Extract only SOLUTION blocks and remove test functions
-    solution_extractor = ExtractSolutionBlocks()
-    reference_code = module.visit(solution_extractor)
-
-    test_extractor = StripTestFunctions(test_file_name=tests_file_path)
-    without_tests = reference_code.visit(test_extractor)
-
-    # Write the reference code
-    output_reference_fd.write(without_tests.code)
+    build_outputs(input_fd, output_reference_fd=output_reference_fd, tests_file_path=tests_file_path)
@@ -44,6 +44,18 @@ You'll build a simplified AES-like cipher to understand modern block cipher desi
 > - Understand the principles of confusion and diffusion in cryptographic design
 > - Implement Electronic Codebook (ECB) mode for encrypting full messages
 > - Learn the limitations and security weaknesses of basic block cipher modes
+
+### 4️⃣ Bonus: Cryptanalysis at Scale
+
+You'll revisit the attacks from this day and make them fast enough to run against large batches of captured data.
+
+> **Learning Objectives**
+> - Parallelize brute-force searches across processes and cancel work that is no longer needed
+> - Vectorize brute-force searches and keystream generation with NumPy
+> - Precompute a cipher's full codebook and cache it on disk to turn encryption into table lookups
+> - Combine many known plaintexts to eliminate false positives in the meet-in-the-middle attack
+> - Score crib-dragging candidates with n-gram statistics and stream results from large wordlists
+> - Fuse S-boxes and P-boxes into lookup tables and process whole buffers without copying them
 """
 
 # %%
@@ -2278,6 +2290,1397 @@ def test_ecb_mode(encrypt, decrypt, SBOX, PBOX, INV_SBOX, INV_PBOX):
 # Run the test
 test_ecb_mode(aes_encrypt, aes_decrypt, SBOX, PBOX, INV_SBOX, INV_PBOX)
 
+# %%
+"""
+## 4️⃣ Bonus: Cryptanalysis at Scale
+
+The exercises above attack one message at a time, and you were told to aim for correctness, not efficiency. Real cryptanalysis rarely looks like that: an attacker who has captured a traffic dump wants to run the same attack against thousands of ciphertexts, and the difference between "minutes per message" and "milliseconds per message" decides whether an attack is practical.
+
+In this section, you'll revisit the attacks from this day and make them fast. None of these exercises change *what* is being computed - every fast version must give exactly the same answers as the version you already wrote, and the tests check precisely that.
+
+### Exercise 4.1: Parallel LCG State Recovery
+
+> **Difficulty**: 🔴🔴🔴⚪⚪  
+> **Importance**: 🔵🔵⚪⚪⚪
+> 
+> You should spend up to ~25 minutes on this exercise.
+
+`recover_lcg_state` loops over 2^24 candidates on a single core. Brute-force searches like this are *embarrassingly parallel*: the candidate space can be split into independent shards, and each shard can be searched by a different worker process. Once any worker finds the answer for a keystream, the other shards for that keystream are wasted work, so they should be cancelled.
+
+Implement:
+- `scan_lcg_shard`, which searches one shard `[start, stop)` of upper-24-bit candidates and periodically checks whether it should give up early.
+- `recover_lcg_states_parallel`, which splits the search for a whole batch of keystreams into shards, runs them in a pool of worker processes, and cancels the remaining shards of a keystream as soon as one of them finds its seed.
+
+We use processes rather than threads because of Python's Global Interpreter Lock (GIL) - threads running pure-Python loops cannot use more than one core at a time. Workers share a small array of "found" flags, which is how a shard learns that it can stop.
+
+<details>
+<summary>Vocabulary: Parallelism Terms</summary>
+
+- **Embarrassingly parallel**: A problem that splits into independent pieces that need no communication with each other
+- **Shard**: One piece of the search space, processed by a single worker
+- **GIL (Global Interpreter Lock)**: A lock in CPython that allows only one thread to execute Python bytecode at a time
+- **Fork**: Creating a worker process as a copy of the current one, including all the functions you have defined so far
+
+</details>
+"""
+import multiprocessing
+import time
+
+_shard_found = None
+
+
+def _init_shard_worker(found) -> None:
+    """Store the shared "found" flags in each worker process."""
+    global _shard_found
+    _shard_found = found
+
+
+def scan_lcg_shard(
+    keystream_bytes: list[int], start: int, stop: int, should_stop: Callable[[], bool] = lambda: False
+) -> int | None:
+    """
+    Search upper-24-bit candidates in range(start, stop) for the state that produced keystream_bytes[0].
+
+    Args:
+        keystream_bytes: At least 2 consecutive bytes from the keystream.
+        start: First upper-24-bit candidate to try.
+        stop: One past the last candidate to try.
+        should_stop: Called every few thousand candidates; the scan gives up when it returns True.
+
+    Returns:
+        The seed that generates this keystream, or None if the shard holds no match or the scan was cancelled.
+    """
+    a = 1664525
+    c = 1013904223
+    m = 2**32
+
+    if "SOLUTION":
+        for upper_24_bits in range(start, stop):
+            if (upper_24_bits - start) % 4096 == 0 and should_stop():
+                return None
+
+            state_0 = (upper_24_bits << 8) | keystream_bytes[0]
+            state = state_0
+            valid = True
+            for i in range(1, len(keystream_bytes)):
+                state = (a * state + c) % m
+                if (state & 0xFF) != keystream_bytes[i]:
+                    valid = False
+                    break
+
+            if valid:
+                a_inv = pow(a, -1, m)
+                return ((state_0 - c) * a_inv) % m
+        return None
+    else:
+        # TODO: Implement the shard scan
+        #   - Same check as recover_lcg_state, but only for candidates in range(start, stop)
+        #   - Call should_stop() every 4096 candidates and return None if it returns True
+        #   - Return the seed on a match, or None if the shard is exhausted
+        pass
+
+
+def _run_lcg_shard(task: tuple[int, list[int], int, int]) -> tuple[int, int | None]:
+    """Worker entry point: scan one shard unless its keystream was already solved."""
+    index, keystream_bytes, start, stop = task
+    if _shard_found[index]:
+        return index, None
+    seed = scan_lcg_shard(keystream_bytes, start, stop, should_stop=lambda: bool(_shard_found[index]))
+    if seed is not None:
+        _shard_found[index] = 1
+    return index, seed
+
+
+def recover_lcg_states_parallel(
+    keystreams: list[list[int]], workers: int | None = None, shard_bits: int = 16, search_bits: int = 24
+) -> list[int | None]:
+    """
+    Recover the LCG seed for every keystream in a batch, sharding the search across worker processes.
+
+    The 2^search_bits candidate space of each keystream is split into shards of 2^shard_bits candidates.
+    As soon as one shard finds the seed for a keystream, all other shards of that keystream are cancelled.
+
+    Args:
+        keystreams: List of keystreams, each at least 2 consecutive bytes long.
+        workers: Number of worker processes (defaults to the number of CPU cores).
+        shard_bits: log2 of the number of candidates per shard.
+        search_bits: log2 of the number of candidates to search (24 searches the whole space).
+
+    Returns:
+        List with the recovered seed for each keystream, or None where no seed exists.
+    """
+    for keystream_bytes in keystreams:
+        if len(keystream_bytes) < 2:
+            raise ValueError("Need at least 2 keystream bytes")
+
+    if "SOLUTION":
+        workers = workers or os.cpu_count() or 1
+        shard_size = 1 << min(shard_bits, search_bits)
+        # Interleave the keystreams so that every keystream gets its first shards scheduled early
+        tasks = [
+            (index, keystream_bytes, start, start + shard_size)
+            for start in range(0, 1 << search_bits, shard_size)
+            for index, keystream_bytes in enumerate(keystreams)
+        ]
+
+        # Fork so that workers inherit the functions defined in this file (also works in interactive windows)
+        ctx = multiprocessing.get_context("fork")
+        found = ctx.Array("b", len(keystreams), lock=False)
+        seeds: list[int | None] = [None] * len(keystreams)
+        remaining = len(keystreams)
+
+        with ctx.Pool(workers, initializer=_init_shard_worker, initargs=(found,)) as pool:
+            for index, seed in pool.imap_unordered(_run_lcg_shard, tasks):
+                if seed is not None and seeds[index] is None:
+                    seeds[index] = seed
+                    remaining -= 1
+                    if remaining == 0:
+                        break  # Leaving the with-block terminates any shards still running
+        return seeds
+    else:
+        # TODO: Implement the parallel search
+        #   - Build a list of (index, keystream_bytes, start, stop) tasks covering range(2**search_bits)
+        #   - Create a shared flag array with multiprocessing.get_context("fork").Array("b", len(keystreams))
+        #   - Run _run_lcg_shard over the tasks in a Pool initialised with _init_shard_worker
+        #   - Collect the first seed found for each keystream, stopping once all are found
+        pass
+
+
+@report
+def test_recover_lcg_states_parallel(recover_lcg_states_parallel, lcg_keystream):
+    """Test batch LCG state recovery."""
+    print("Testing parallel LCG state recovery...")
+
+    seeds = [12345678, 1, 2**32 - 1, 987654321]
+    keystreams = []
+    for seed in seeds:
+        ks = lcg_keystream(seed)
+        keystreams.append([next(ks) for _ in range(6)])
+
+    # Test 1: Every recovered seed reproduces its keystream
+    recovered = recover_lcg_states_parallel(keystreams, workers=2)
+    assert len(recovered) == len(keystreams), "Should return one result per keystream"
+    for keystream_bytes, seed in zip(keystreams, recovered):
+        assert seed is not None, f"Failed to recover seed for {keystream_bytes}"
+        ks_test = lcg_keystream(seed)
+        assert [next(ks_test) for _ in range(6)] == keystream_bytes, "Recovered seed doesn't produce same keystream"
+
+    # Test 2: A keystream that no seed produces gives None without affecting the others
+    bad = keystreams[0][:-1] + [keystreams[0][-1] ^ 1]
+    recovered = recover_lcg_states_parallel([keystreams[1], bad], workers=2, shard_bits=8, search_bits=12)
+    assert recovered[0] is not None, "Valid keystream should still be recovered"
+    assert recovered[1] is None, "Inconsistent keystream should not produce a seed"
+
+    print("✓ Parallel LCG state recovery tests passed!\n" + "=" * 60)
+
+
+test_recover_lcg_states_parallel(recover_lcg_states_parallel, lcg_keystream)
+
+# %%
+"""
+Let's measure how the search scales with the number of cores. Notice that the benchmark uses keystreams that *no* seed produces - try timing `recover_lcg_states_parallel` with valid keystreams instead and see what happens.
+
+<details>
+<summary>Why are valid keystreams recovered almost instantly?</summary>
+
+Because `m = 2^32`, the lowest 8 bits of `a * X + c mod m` depend only on the lowest 8 bits of `X`. The keystream bytes therefore form their own tiny LCG modulo 256, and the upper 24 bits of the state never influence the output. Every candidate is valid if the first one is, so the search succeeds on candidate 0 - and only inconsistent keystreams (for example, a crib at the wrong position) pay for a scan of the full space.
+
+This is a second, even more serious weakness of LCGs with a power-of-two modulus: the low bits have a tiny period. This is why real-world LCG-based generators output only the *high* bits of their state.
+</details>
+"""
+
+
+def benchmark_parallel_recovery(
+    worker_counts: list[int] | None = None, n_keystreams: int = 4, search_bits: int = 18
+) -> dict[int, float]:
+    """
+    Time recover_lcg_states_parallel for different numbers of workers.
+
+    Uses keystreams that no seed produces, so every shard is scanned to completion.
+
+    Returns:
+        Dictionary mapping number of workers to wall-clock seconds.
+    """
+    cores = os.cpu_count() or 1
+    if worker_counts is None:
+        worker_counts = sorted({1, 2, 4, 8, cores} & set(range(1, cores + 1)))
+    keystreams = []
+    for seed in range(n_keystreams):
+        ks = lcg_keystream(seed)
+        keystream_bytes = [next(ks) for _ in range(5)]
+        keystream_bytes[-1] ^= 1  # Flip one bit to make the keystream inconsistent
+        keystreams.append(keystream_bytes)
+
+    timings = {}
+    print(f"Searching 2^{search_bits} candidates for {n_keystreams} keystreams ({cores} cores available)")
+    for workers in worker_counts:
+        start = time.perf_counter()
+        recover_lcg_states_parallel(keystreams, workers=workers, search_bits=search_bits)
+        timings[workers] = time.perf_counter() - start
+        speedup = timings[worker_counts[0]] / timings[workers]
+        print(f"  {workers:3d} workers: {timings[workers]:7.2f}s  (speedup {speedup:.1f}x)")
+    return timings
+
+
+if __name__ == "__main__":
+    benchmark_parallel_recovery()
+
+# %%
+"""
+### Exercise 4.2: A Vectorized LCG Engine
+
+> **Difficulty**: 🔴🔴🔴🔴⚪  
+> **Importance**: 🔵🔵⚪⚪⚪
+> 
+> You should spend up to ~30 minutes on this exercise.
+
+Processes help, but each worker still runs a pure-Python loop over one candidate at a time. NumPy lets us do much better on a single core: we can store millions of candidate states in one `uint32` array and advance them all with a single multiply-add. Since NumPy's integer arithmetic wraps around on overflow, `uint32` arithmetic *is* arithmetic modulo `m = 2^32` - exactly what the LCG needs.
+
+The same idea lets us generate long keystreams without stepping the generator byte by byte. Applying the LCG `k` times is itself an affine map:
+```
+X_{n+k} = (A_k * X_n + C_k) mod m
+```
+and composing two affine maps gives another one: `A_{j+k} = A_j * A_k` and `C_{j+k} = A_j * C_k + C_j`. Given the coefficients for steps `1..k`, one vectorized operation gives the coefficients for steps `k+1..2k`, so all coefficients for `n` steps take only `log2(n)` NumPy operations. This is called **jump-ahead**.
+
+Implement:
+- `lcg_jump`, which computes `(A_k, C_k)` for a single `k` using square-and-multiply on the affine map.
+- `lcg_keystream_array`, which returns the first `n` keystream bytes for one or many seeds at once.
+- `lcg_encrypt_fast` / `lcg_decrypt_fast`, built on `lcg_keystream_array`.
+- `recover_lcg_state_fast`, which advances all 2^24 candidate states in lockstep and drops every candidate whose output byte doesn't match.
+
+All of them must return exactly the same values as the functions you wrote in section 1.
+"""
+import numpy as np
+
+
+def lcg_jump(steps: int) -> tuple[int, int]:
+    """
+    Compute the affine map for advancing the LCG by `steps` steps.
+
+    Args:
+        steps: Number of LCG steps (>= 0).
+
+    Returns:
+        Tuple (A, C) such that stepping `steps` times from state X gives (A * X + C) mod 2^32.
+    """
+    a = 1664525
+    c = 1013904223
+    m = 2**32
+
+    if "SOLUTION":
+        # Accumulated map starts as the identity; (step_a, step_c) is the map for 2^i steps
+        acc_a, acc_c = 1, 0
+        step_a, step_c = a, c
+        while steps:
+            if steps & 1:
+                acc_a, acc_c = (step_a * acc_a) % m, (step_a * acc_c + step_c) % m
+            step_a, step_c = (step_a * step_a) % m, (step_a * step_c + step_c) % m
+            steps >>= 1
+        return acc_a, acc_c
+    else:
+        # TODO: Implement LCG jump-ahead
+        #   - Start with the identity map (A, C) = (1, 0)
+        #   - Keep the map for 2^i steps, squaring it (composing it with itself) for each bit of `steps`
+        #   - Compose it into the result whenever the bit is set
+        pass
+
+
+def lcg_keystream_array(seeds: int | np.ndarray, n: int) -> np.ndarray:
+    """
+    Generate the first n keystream bytes for one or many seeds using jump-ahead.
+
+    Args:
+        seeds: A single seed, or a 1D array of seeds.
+        n: Number of keystream bytes per seed.
+
+    Returns:
+        uint8 array of shape (n,) for a single seed, or (len(seeds), n) for an array of seeds.
+    """
+    a = 1664525
+    c = 1013904223
+
+    if "SOLUTION":
+        # coeff_a[i], coeff_c[i] advance a state by i + 1 steps
+        coeff_a = np.array([a], dtype=np.uint32)
+        coeff_c = np.array([c], dtype=np.uint32)
+        while len(coeff_a) < n:
+            k = len(coeff_a)
+            jump_a, jump_c = coeff_a[-1], coeff_c[-1]  # map for k steps
+            coeff_a = np.concatenate([coeff_a, coeff_a * jump_a])
+            coeff_c = np.concatenate([coeff_c, coeff_a[:k] * jump_c + coeff_c])
+        coeff_a, coeff_c = coeff_a[:n], coeff_c[:n]
+
+        # Only the seeds mod 2^32 matter; reduce them first so negative and huge seeds convert to uint32
+        if isinstance(seeds, int):
+            seed_array = np.asarray(seeds % 2**32, dtype=np.uint32)
+        else:
+            seed_array = np.asarray(seeds)
+            if seed_array.dtype.kind in "iO":
+                seed_array = seed_array & 0xFFFFFFFF
+            seed_array = seed_array.astype(np.uint32)
+        states = seed_array[..., None] * coeff_a + coeff_c
+        return (states & 0xFF).astype(np.uint8)
+    else:
+        # TODO: Implement vectorized keystream generation
+        #   - Build uint32 arrays of A_i and C_i for i = 1..n by repeatedly doubling them with jump-ahead
+        #   - Reduce the seeds mod 2^32 (they may be negative or larger than 2^32) and convert them to uint32
+        #   - Compute all states as seeds[..., None] * A + C (uint32 arithmetic wraps mod 2^32)
+        #   - Return the lowest 8 bits as uint8
+        pass
+
+
+def lcg_encrypt_fast(seed: int, plaintext: bytes) -> bytes:
+    """Encrypt plaintext with the LCG keystream, using lcg_keystream_array."""
+    if "SOLUTION":
+        data = np.frombuffer(plaintext, dtype=np.uint8)
+        return (data ^ lcg_keystream_array(seed, len(data))).tobytes()
+    else:
+        # TODO: XOR the plaintext (as a uint8 array) with lcg_keystream_array(seed, len(plaintext))
+        pass
+
+
+def lcg_decrypt_fast(seed: int, ciphertext: bytes) -> bytes:
+    """Decrypt ciphertext with the LCG keystream, using lcg_keystream_array."""
+    return lcg_encrypt_fast(seed, ciphertext)
+
+
+def recover_lcg_state_fast(keystream_bytes: list[int], chunk_bits: int = 20) -> int:
+    """
+    Recover the LCG seed from consecutive keystream bytes, checking many candidates in lockstep.
+
+    Returns the same seed as recover_lcg_state: the one with the smallest matching upper 24 bits.
+
+    Args:
+        keystream_bytes: At least 2 consecutive bytes from the keystream.
+        chunk_bits: log2 of the number of candidates held in memory at once.
+
+    Returns:
+        A seed (initial state) that generates this keystream.
+    """
+    if len(keystream_bytes) < 2:
+        raise ValueError("Need at least 2 keystream bytes")
+
+    a = 1664525
+    c = 1013904223
+    m = 2**32
+
+    if "SOLUTION":
+        chunk_size = 1 << min(chunk_bits, 24)
+        for start in range(0, 2**24, chunk_size):
+            upper = np.arange(start, start + chunk_size, dtype=np.uint32)
+            candidates = (upper << np.uint32(8)) | np.uint32(keystream_bytes[0])
+            states = candidates.copy()
+            for expected in keystream_bytes[1:]:
+                states = states * np.uint32(a) + np.uint32(c)
+                mask = (states & 0xFF) == expected
+                candidates, states = candidates[mask], states[mask]
+                if len(candidates) == 0:
+                    break
+            if len(candidates):
+                a_inv = pow(a, -1, m)
+                return ((int(candidates[0]) - c) * a_inv) % m
+        raise ValueError("Could not recover state")
+    else:
+        # TODO: Implement vectorized state recovery
+        #   - For each chunk of upper-24-bit candidates, build a uint32 array of candidate states
+        #   - Advance all states at once; keep only those whose lowest byte matches the next keystream byte
+        #   - If any candidate survives all bytes, compute the seed from the first survivor
+        pass
+
+
+@report
+def test_lcg_engine(
+    lcg_jump,
+    lcg_keystream_array,
+    lcg_encrypt_fast,
+    recover_lcg_state_fast,
+    lcg_keystream,
+    lcg_encrypt,
+    recover_lcg_state,
+):
+    """Test the vectorized LCG engine against the reference implementation."""
+    import numpy as np
+
+    print("Testing vectorized LCG engine...")
+
+    # Test 1: Jump-ahead matches stepping
+    ks = lcg_keystream(12345)
+    stepped = [next(ks) for _ in range(1000)]
+    for steps in [1, 2, 7, 1000]:
+        jump_a, jump_c = lcg_jump(steps)
+        assert ((jump_a * 12345 + jump_c) % 2**32) & 0xFF == stepped[steps - 1], f"lcg_jump({steps}) is wrong"
+    assert lcg_jump(0) == (1, 0), "Jumping 0 steps should be the identity"
+
+    # Test 2: Long keystreams match the generator, for non-power-of-two lengths too
+    for seed in [0, 1, 12345, 2**32 - 1, -1, 2**70]:
+        ks = lcg_keystream(seed)
+        expected = [next(ks) for _ in range(5000)]
+        assert lcg_keystream_array(seed, 5000).tolist() == expected, f"Keystream mismatch for seed {seed}"
+
+    # Test 3: Many seeds at once
+    seeds = np.array([1, 2, 3, 12345], dtype=np.uint32)
+    batch = lcg_keystream_array(seeds, 37)
+    assert batch.shape == (4, 37), "Batch keystream should have shape (len(seeds), n)"
+    for row, seed in zip(batch, seeds):
+        assert row.tolist() == lcg_keystream_array(int(seed), 37).tolist(), "Batch row mismatch"
+    for wide_seeds in [np.array([-1, -12345, 2**40], dtype=np.int64), np.array([-1, 2**70], dtype=object)]:
+        batch = lcg_keystream_array(wide_seeds, 37)
+        for row, seed in zip(batch, wide_seeds):
+            assert row.tolist() == lcg_keystream_array(int(seed) % 2**32, 37).tolist(), f"Batch mismatch for {seed}"
+
+    # Test 4: Encryption matches byte for byte
+    plaintext = b"Hello, World!" * 100
+    assert lcg_encrypt_fast(12345, plaintext) == lcg_encrypt(12345, plaintext), "Fast encryption mismatch"
+    assert lcg_encrypt_fast(12345, b"") == b"", "Empty plaintext should encrypt to empty ciphertext"
+    for seed in [-1, 2**70]:
+        assert lcg_encrypt_fast(seed, plaintext) == lcg_encrypt(seed, plaintext), f"Fast encryption mismatch for {seed}"
+
+    # Test 5: State recovery returns the same seed as the reference
+    for seed in [12345678, 42]:
+        ks = lcg_keystream(seed)
+        observed = [next(ks) for _ in range(6)]
+        assert recover_lcg_state_fast(observed) == recover_lcg_state(observed), "Recovered seed mismatch"
+
+    # Test 6: Inconsistent keystreams are rejected after a full (vectorized) scan
+    try:
+        recover_lcg_state_fast(observed[:-1] + [observed[-1] ^ 1])
+        assert False, "Inconsistent keystream should raise ValueError"
+    except ValueError:
+        pass
+
+    print("✓ Vectorized LCG engine tests passed!\n" + "=" * 60)
+
+
+test_lcg_engine(
+    lcg_jump,
+    lcg_keystream_array,
+    lcg_encrypt_fast,
+    recover_lcg_state_fast,
+    lcg_keystream,
+    lcg_encrypt,
+    recover_lcg_state,
+)
+
+
+# %%
+"""
+Compare the speed of the two implementations:
+"""
+
+
+def benchmark_lcg_engine(n_bytes: int = 1_000_000) -> None:
+    """Time the generator-based and vectorized LCG paths."""
+    plaintext = os.urandom(n_bytes)
+    start = time.perf_counter()
+    slow = lcg_encrypt(12345, plaintext)
+    slow_time = time.perf_counter() - start
+    start = time.perf_counter()
+    fast = lcg_encrypt_fast(12345, plaintext)
+    fast_time = time.perf_counter() - start
+    assert slow == fast
+    print(f"Encrypting {n_bytes:,} bytes: {slow_time:.3f}s -> {fast_time:.3f}s ({slow_time / fast_time:.0f}x faster)")
+
+    ks = lcg_keystream(12345)
+    inconsistent = [next(ks) for _ in range(5)]
+    inconsistent[-1] ^= 1
+    start = time.perf_counter()
+    results = recover_lcg_states_parallel([inconsistent], workers=1, search_bits=20)
+    slow_time = time.perf_counter() - start
+    start = time.perf_counter()
+    try:
+        recover_lcg_state_fast(inconsistent)
+    except ValueError:
+        pass
+    fast_time = time.perf_counter() - start
+    assert results == [None]
+    print(f"Rejecting an inconsistent keystream: {slow_time * 16:.1f}s (estimated) -> {fast_time:.3f}s")
+
+
+if __name__ == "__main__":
+    benchmark_lcg_engine()
+
+# %%
+"""
+### Exercise 4.3: Trading Memory for Time - the DES Codebook
+
+> **Difficulty**: 🔴🔴🔴⚪⚪  
+> **Importance**: 🔵🔵🔵⚪⚪
+> 
+> You should spend up to ~25 minutes on this exercise.
+
+Our simplified DES has a 10-bit key and an 8-bit block. That means the *entire* cipher is described by a table of 1024 × 256 = 262,144 bytes: for each key, the ciphertext of every possible plaintext byte. Such a table is called a **codebook**. Once it exists, encryption is a single array lookup, and the meet-in-the-middle attack no longer needs to call `des_encrypt`/`des_decrypt` 2048 times - it just reads two columns of the table.
+
+Building the codebook with `encrypt_byte` would take 262,144 calls to a slow Python function. Instead, notice that the Feistel function `fk` only ever sees a 4-bit right half and an 8-bit subkey, so it can be tabulated in a 256 × 16 table first. With that table, and lookup tables for IP and IP⁻¹, one DES encryption of all bytes under all keys is a handful of NumPy indexing operations.
+
+Each row of the codebook is a permutation of 0..255 (encryption is invertible), so the decryption codebook is just the inverse permutation of each row.
+
+Since the codebook only depends on the cipher parameters, we also cache it on disk and reuse it in later runs. The cache file name contains a hash of the parameters, of a few known answers of `des_encrypt` and of the source of `build_des_codebook`, so changing a parameter or fixing a bug in `key_schedule`, `fk`, `permute_expand` or the codebook builder automatically invalidates the old cache. A cached codebook is also checked against `des_encrypt`/`des_decrypt` when it is loaded, and rebuilt if the check fails.
+
+Implement `build_des_codebook`, the table-based `des_encrypt_table`/`des_decrypt_table`, and `meet_in_the_middle_attack_table`, which must return exactly the same list of key pairs as `meet_in_the_middle_attack`.
+"""
+import hashlib
+import inspect
+
+
+def build_des_codebook() -> np.ndarray:
+    """
+    Compute the full encryption and decryption codebooks of our simplified DES.
+
+    Returns:
+        uint8 array of shape (2, 1024, 256), where [0, key, p] is the encryption of byte p under key
+        and [1, key, c] is the decryption of byte c under key.
+    """
+    if "SOLUTION":
+        # Round function: round_table[subkey, right] is the value fk XORs into the left half
+        round_table = np.array(
+            [[fk(0, right, subkey, EP, S0, S1, P4)[0] for right in range(16)] for subkey in range(256)], dtype=np.uint8
+        )
+        ip_table = np.array([permute_expand(b, IP, 8) for b in range(256)], dtype=np.uint8)
+        ip_inv_table = np.array([permute_expand(b, IP_INV, 8) for b in range(256)], dtype=np.uint8)
+        subkeys = np.array([key_schedule(key, P10, P8) for key in range(1024)], dtype=np.intp)
+        k1 = subkeys[:, 0:1]  # shape (1024, 1), broadcasts against the 256 plaintexts
+        k2 = subkeys[:, 1:2]
+
+        bits = ip_table[np.arange(256)]
+        left, right = bits >> 4, bits & 0xF
+        left = left ^ round_table[k1, right]  # first round
+        left, right = right, left  # swap
+        left = left ^ round_table[k2, right]  # second round
+        encrypt_table = ip_inv_table[(left << 4) | right]
+
+        decrypt_table = np.argsort(encrypt_table, axis=1).astype(np.uint8)
+        return np.stack([encrypt_table, decrypt_table])
+    else:
+        # TODO: Build the codebook with NumPy
+        #   - Tabulate fk: round_table[subkey, right] = fk(0, right, subkey, ...)[0]
+        #   - Tabulate IP and IP_INV for all 256 bytes, and the subkeys for all 1024 keys
+        #   - Run both Feistel rounds on arrays of shape (1024, 256) using the tables
+        #   - The decryption table is the inverse permutation of each row (np.argsort)
+        pass
+
+
+_DES_CODEBOOK = None
+_DES_CODEBOOK_KEYS = (0b1010000010, 0b0111111101)
+
+
+def _is_valid_des_codebook(codebook) -> bool:
+    """Check a codebook against des_encrypt/des_decrypt for a few keys, and that every decryption row inverts its
+    encryption row."""
+    if not isinstance(codebook, np.ndarray) or codebook.shape != (2, 1024, 256) or codebook.dtype != np.uint8:
+        return False
+    all_bytes = bytes(range(256))
+    for key in _DES_CODEBOOK_KEYS:
+        if codebook[0, key].tobytes() != des_encrypt(key, all_bytes):
+            return False
+        if codebook[1, key].tobytes() != des_decrypt(key, all_bytes):
+            return False
+    roundtrip = np.take_along_axis(codebook[1], codebook[0].astype(np.intp), axis=1)
+    return bool((roundtrip == np.arange(256)).all())
+
+
+def des_codebook(cache_dir: str | None = None) -> np.ndarray:
+    """Return the DES codebook, loading it from (or saving it to) a cache file in cache_dir."""
+    global _DES_CODEBOOK
+    if _DES_CODEBOOK is not None and cache_dir is None:
+        return _DES_CODEBOOK
+
+    # Known answers of the current implementation, so a codebook built while it had a bug isn't reused after the fix
+    known_answers = [des_encrypt(key, bytes(range(256))) for key in _DES_CODEBOOK_KEYS]
+    params = repr((P10, P8, IP, IP_INV, EP, S0, S1, P4, known_answers, inspect.getsource(build_des_codebook)))
+    cache_dir = cache_dir or os.path.dirname(os.path.realpath(__file__))
+    cache_path = os.path.join(cache_dir, f".des_codebook_{hashlib.sha256(params.encode()).hexdigest()[:16]}.npy")
+    try:
+        codebook = np.load(cache_path)
+    except (OSError, ValueError):  # missing, truncated, or an object array
+        codebook = None
+    if not _is_valid_des_codebook(codebook):
+        codebook = build_des_codebook()
+        if not isinstance(codebook, np.ndarray) or codebook.shape != (2, 1024, 256) or codebook.dtype != np.uint8:
+            raise ValueError("build_des_codebook must return a uint8 array of shape (2, 1024, 256)")
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.save(f, codebook)
+        os.replace(tmp_path, cache_path)  # atomic, so concurrent runs never see a partial file
+    _DES_CODEBOOK = codebook
+    return codebook
+
+
+def des_encrypt_table(key: int, plaintext: bytes) -> bytes:
+    """Encrypt bytes using the DES codebook."""
+    if "SOLUTION":
+        return des_codebook()[0, key][np.frombuffer(plaintext, dtype=np.uint8)].tobytes()
+    else:
+        # TODO: Look up every plaintext byte in row `key` of the encryption codebook
+        pass
+
+
+def des_decrypt_table(key: int, ciphertext: bytes) -> bytes:
+    """Decrypt bytes using the DES codebook."""
+    if "SOLUTION":
+        return des_codebook()[1, key][np.frombuffer(ciphertext, dtype=np.uint8)].tobytes()
+    else:
+        # TODO: Look up every ciphertext byte in row `key` of the decryption codebook
+        pass
+
+
+def double_encrypt_table(key1: int, key2: int, plaintext: bytes) -> bytes:
+    """Encrypt twice with different keys, using the DES codebook."""
+    return des_encrypt_table(key2, des_encrypt_table(key1, plaintext))
+
+
+def meet_in_the_middle_attack_table(plaintext: bytes, ciphertext: bytes) -> List[Tuple[int, int]]:
+    """
+    Meet-in-the-middle attack on Double DES using the codebook.
+
+    Returns the same (key1, key2) pairs, in the same order, as meet_in_the_middle_attack.
+    """
+    if "SOLUTION":
+        codebook = des_codebook()
+        # Row k1 of `forward` is des_encrypt(k1, plaintext); row k2 of `backward` is des_decrypt(k2, ciphertext)
+        forward = codebook[0][:, np.frombuffer(plaintext, dtype=np.uint8)]
+        backward = codebook[1][:, np.frombuffer(ciphertext, dtype=np.uint8)]
+
+        forward_table = {}
+        for k1, row in enumerate(forward):
+            forward_table.setdefault(row.tobytes(), []).append(k1)
+
+        valid_pairs = []
+        for k2, row in enumerate(backward):
+            for k1 in forward_table.get(row.tobytes(), []):
+                valid_pairs.append((k1, k2))
+        return valid_pairs
+    else:
+        # TODO: Implement the attack using the codebook
+        #   - Index the codebook with the plaintext/ciphertext bytes to get all intermediates at once
+        #   - Match them with a dictionary, as in meet_in_the_middle_attack
+        pass
+
+
+@report
+def test_des_codebook(
+    des_codebook,
+    build_des_codebook,
+    des_encrypt,
+    des_decrypt,
+    meet_in_the_middle_attack,
+    meet_in_the_middle_attack_table,
+    double_encrypt,
+):
+    """Test the DES codebook against the bitwise implementation."""
+    import random
+    import tempfile
+
+    import numpy as np
+
+    print("Testing DES codebook...")
+
+    codebook = build_des_codebook()
+    assert codebook.shape == (2, 1024, 256) and codebook.dtype == np.uint8, "Codebook has the wrong shape or dtype"
+
+    # Test 1: Every row matches des_encrypt / des_decrypt
+    all_bytes = bytes(range(256))
+    rng = random.Random(0)
+    for key in [0, 1023, 0b1010000010] + [rng.randrange(1024) for _ in range(20)]:
+        assert codebook[0, key].tobytes() == des_encrypt(key, all_bytes), f"Encryption table wrong for key {key}"
+        assert codebook[1, key].tobytes() == des_decrypt(key, all_bytes), f"Decryption table wrong for key {key}"
+
+    # Test 2: The cache round-trips through disk
+    with tempfile.TemporaryDirectory() as cache_dir:
+        assert np.array_equal(des_codebook(cache_dir), codebook), "Freshly cached codebook differs"
+        assert len(os.listdir(cache_dir)) == 1, "Codebook should be cached in a single file"
+        assert np.array_equal(des_codebook(cache_dir), codebook), "Codebook loaded from cache differs"
+
+        # A wrong or unreadable cache file is rebuilt and overwritten
+        (cache_file,) = os.listdir(cache_dir)
+        cache_path = os.path.join(cache_dir, cache_file)
+        for poison in [np.zeros((2, 1024, 256), dtype=np.uint8), np.array(None)]:
+            np.save(cache_path, poison, allow_pickle=True)
+            assert np.array_equal(des_codebook(cache_dir), codebook), "Codebook not rebuilt from a poisoned cache"
+            assert np.array_equal(np.load(cache_path), codebook), "Poisoned cache file not overwritten"
+
+    # Test 3: The attack gives identical results
+    plaintext = b"Attack!"
+    for key1, key2 in [(rng.randrange(1024), rng.randrange(1024)) for _ in range(3)]:
+        ciphertext = double_encrypt(key1, key2, plaintext)
+        table_result = meet_in_the_middle_attack_table(plaintext, ciphertext)
+        assert table_result == meet_in_the_middle_attack(plaintext, ciphertext), "Attack results differ"
+        assert (key1, key2) in table_result, "True keys not found"
+
+    print("✓ DES codebook tests passed!\n" + "=" * 60)
+
+
+test_des_codebook(
+    des_codebook,
+    build_des_codebook,
+    des_encrypt,
+    des_decrypt,
+    meet_in_the_middle_attack,
+    meet_in_the_middle_attack_table,
+    double_encrypt,
+)
+
+# %%
+
+
+def benchmark_des_codebook(n_bytes: int = 100_000) -> None:
+    """Time the bitwise and codebook DES paths."""
+    global _DES_CODEBOOK
+
+    start = time.perf_counter()
+    build_des_codebook()
+    build_time = time.perf_counter() - start
+    des_codebook()  # make sure the cache file exists
+    _DES_CODEBOOK = None
+    start = time.perf_counter()
+    des_codebook()
+    load_time = time.perf_counter() - start
+    print(f"Building the codebook: {build_time:.3f}s, loading it from cache: {load_time:.4f}s")
+
+    plaintext = os.urandom(n_bytes)
+    start = time.perf_counter()
+    slow = des_encrypt(0b1010000010, plaintext)
+    slow_time = time.perf_counter() - start
+    start = time.perf_counter()
+    fast = des_encrypt_table(0b1010000010, plaintext)
+    fast_time = time.perf_counter() - start
+    assert slow == fast
+    print(f"Encrypting {n_bytes:,} bytes: {slow_time:.3f}s -> {fast_time:.4f}s ({slow_time / fast_time:.0f}x faster)")
+
+    plaintext = b"Attack!"
+    ciphertext = double_encrypt(123, 456, plaintext)
+    start = time.perf_counter()
+    slow = meet_in_the_middle_attack(plaintext, ciphertext)
+    slow_time = time.perf_counter() - start
+    start = time.perf_counter()
+    fast = meet_in_the_middle_attack_table(plaintext, ciphertext)
+    fast_time = time.perf_counter() - start
+    assert slow == fast
+    print(f"Meet-in-the-middle attack: {slow_time:.3f}s -> {fast_time:.4f}s ({slow_time / fast_time:.0f}x faster)")
+
+
+if __name__ == "__main__":
+    benchmark_des_codebook()
+
+# %%
+"""
+### Exercise 4.4: Meet-in-the-Middle with Many Known Plaintexts
+
+> **Difficulty**: 🔴🔴🔴🔴⚪  
+> **Importance**: 🔵🔵🔵⚪⚪
+> 
+> You should spend up to ~30 minutes on this exercise.
+
+With an 8-bit block, a single known plaintext byte is matched by about 1024 × 1024 / 256 = 4096 key pairs, and the attack returns all of them. An attacker who captured more traffic can do much better: the true key pair has to be consistent with *every* known (plaintext, ciphertext) pair, so intersecting the candidates across pairs quickly narrows them down.
+
+Running `meet_in_the_middle_attack` once per pair and intersecting the results works, but wastes a lot of effort. Implement `meet_in_the_middle_attack_batch`, which:
+
+1. Reduces the capture to its distinct (plaintext byte, ciphertext byte) constraints - a capture of any size has at most 256 × 256 of them, so memory stays bounded no matter how much data you feed in. Each block is encrypted independently, so repeated constraints add no information.
+2. Builds a *sorted-array index* of the forward intermediates for the first constraint (`np.argsort` + `np.searchsorted`) instead of a dictionary of lists.
+3. Processes the second keys `k2` in batches: looks up the matching `k1` range for each `k2` in the index, then prunes the candidate pairs against every other constraint with vectorized comparisons.
+4. Yields the surviving pairs as it goes, sorted by `k2` and then `k1` - the same order as `meet_in_the_middle_attack`.
+"""
+from typing import Iterable
+
+
+def meet_in_the_middle_attack_batch(
+    pairs: Iterable[tuple[bytes, bytes]], k2_batch: int = 256
+) -> Generator[tuple[int, int], None, None]:
+    """
+    Find all key pairs (k1, k2) such that double_encrypt(k1, k2, plaintext) == ciphertext for every known pair.
+
+    Args:
+        pairs: Known (plaintext, ciphertext) pairs, all encrypted under the same two keys.
+        k2_batch: Number of second keys whose candidates are expanded and pruned at once.
+
+    Yields:
+        (key1, key2) pairs consistent with every known pair, sorted by key2 and then key1.
+    """
+    if "SOLUTION":
+        seen = np.zeros(256 * 256, dtype=bool)
+        for plaintext, ciphertext in pairs:
+            if len(plaintext) != len(ciphertext):
+                raise ValueError("Plaintext and ciphertext must have the same length")
+            p = np.frombuffer(plaintext, dtype=np.uint8).astype(np.intp)
+            c = np.frombuffer(ciphertext, dtype=np.uint8).astype(np.intp)
+            seen[(p << 8) | c] = True
+        constraints = np.flatnonzero(seen)
+        if len(constraints) == 0:
+            raise ValueError("Need at least one known plaintext byte")
+
+        codebook = des_codebook()
+        # forward[k1, j] = E_k1(p_j), backward[k2, j] = D_k2(c_j); a key pair is valid iff they agree for all j
+        forward = codebook[0][:, constraints >> 8]
+        backward = codebook[1][:, constraints & 0xFF]
+
+        # Sorted-array index over the first constraint: k1s in `order` have ascending intermediates `index`
+        order = np.argsort(forward[:, 0], kind="stable")
+        index = forward[order, 0]
+
+        for start in range(0, 1024, k2_batch):
+            k2s = np.arange(start, min(start + k2_batch, 1024))
+            lo = np.searchsorted(index, backward[k2s, 0], side="left")
+            hi = np.searchsorted(index, backward[k2s, 0], side="right")
+            counts = hi - lo
+
+            # Expand every k2 into its matching k1 range
+            cand_k2 = np.repeat(k2s, counts)
+            offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+            cand_k1 = order[np.repeat(lo, counts) + offsets]
+
+            # Intersect with the remaining constraints
+            for j in range(1, len(constraints)):
+                keep = forward[cand_k1, j] == backward[cand_k2, j]
+                cand_k1, cand_k2 = cand_k1[keep], cand_k2[keep]
+                if len(cand_k1) == 0:
+                    break
+
+            yield from zip(cand_k1.tolist(), cand_k2.tolist())
+    else:
+        # TODO: Implement the batch attack
+        #   - Collect the distinct (plaintext byte, ciphertext byte) constraints from all pairs
+        #   - Get forward/backward intermediates for every key and constraint from des_codebook()
+        #   - Sort the k1s by their first forward intermediate; use np.searchsorted to find matches for each k2
+        #   - Prune the candidate (k1, k2) arrays with each remaining constraint, then yield the survivors
+        pass
+
+
+@report
+def test_meet_in_the_middle_batch(meet_in_the_middle_attack_batch, meet_in_the_middle_attack, double_encrypt):
+    """Test the multi-pair meet-in-the-middle attack."""
+    import random
+
+    print("Testing multi-pair meet-in-the-middle attack...")
+
+    rng = random.Random(7)
+    key1, key2 = rng.randrange(1024), rng.randrange(1024)
+    plaintexts = [b"Attack", b"at dawn", b"!"]
+    pairs = [(p, double_encrypt(key1, key2, p)) for p in plaintexts]
+
+    # Test 1: Same results as intersecting single-pair attacks
+    expected = set(meet_in_the_middle_attack(*pairs[0]))
+    for pair in pairs[1:]:
+        expected &= set(meet_in_the_middle_attack(*pair))
+    found = list(meet_in_the_middle_attack_batch(pairs))
+    assert set(found) == expected, "Batch attack should return the intersection of single-pair attacks"
+    assert found == sorted(found, key=lambda pair: (pair[1], pair[0])), "Results should be sorted by (k2, k1)"
+
+    # Test 2: A single pair gives exactly the same list as the original attack
+    assert list(meet_in_the_middle_attack_batch(pairs[:1])) == meet_in_the_middle_attack(*pairs[0]), (
+        "Single-pair batch attack should match meet_in_the_middle_attack"
+    )
+
+    # Test 3: A large capture narrows down to key pairs equivalent to the true one
+    capture = bytes(range(256)) * 50
+    found = list(meet_in_the_middle_attack_batch([(capture, double_encrypt(key1, key2, capture))], k2_batch=100))
+    print(f"True keys: k1={key1}, k2={key2}; survivors after a {len(capture)}-byte capture: {found}")
+    assert (key1, key2) in found, "True keys not found"
+    for k1, k2 in found:
+        assert double_encrypt(k1, k2, bytes(range(256))) == double_encrypt(key1, key2, bytes(range(256)))
+
+    # Test 4: Contradictory pairs have no solution
+    assert list(meet_in_the_middle_attack_batch([(b"A", b"\x00"), (b"A", b"\x01")])) == [], "Expected no key pairs"
+
+    print("✓ Multi-pair meet-in-the-middle tests passed!\n" + "=" * 60)
+
+
+test_meet_in_the_middle_batch(meet_in_the_middle_attack_batch, meet_in_the_middle_attack, double_encrypt)
+
+# %%
+
+
+def benchmark_meet_in_the_middle_batch(n_pairs: int = 8) -> None:
+    """Compare intersecting single-pair attacks with the batch attack."""
+    rng = random.Random(0)
+    key1, key2 = rng.randrange(1024), rng.randrange(1024)
+    pairs = []
+    for _ in range(n_pairs):
+        plaintext = bytes([rng.randrange(256)])
+        pairs.append((plaintext, double_encrypt(key1, key2, plaintext)))
+
+    start = time.perf_counter()
+    survivors = set(meet_in_the_middle_attack(*pairs[0]))
+    for pair in pairs[1:]:
+        survivors &= set(meet_in_the_middle_attack(*pair))
+    slow_time = time.perf_counter() - start
+    start = time.perf_counter()
+    found = list(meet_in_the_middle_attack_batch(pairs))
+    fast_time = time.perf_counter() - start
+    assert set(found) == survivors
+    print(
+        f"{n_pairs} one-byte pairs, {len(found)} surviving key pairs: "
+        f"{slow_time:.3f}s -> {fast_time:.4f}s ({slow_time / fast_time:.0f}x faster)"
+    )
+
+
+if __name__ == "__main__":
+    benchmark_meet_in_the_middle_batch()
+
+# %%
+"""
+### Exercise 4.5: A Scored Crib-Dragging Engine
+
+> **Difficulty**: 🔴🔴🔴🔴⚪  
+> **Importance**: 🔵🔵🔵⚪⚪
+> 
+> You should spend up to ~35 minutes on this exercise.
+
+`automated_crib_drag` from the stretch exercise works for two short messages and a handful of words, but it doesn't scale: it XORs one byte at a time in Python, it stores every finding in a dictionary, and "fraction of printable characters" is a weak signal - most random bytes XORed with an English word are printable.
+
+Let's build an engine that can take **N ciphertexts** encrypted with the same keystream and a wordlist with 100,000+ cribs:
+
+- **Better scoring.** English text has very characteristic pairs of consecutive characters (bigrams): "th" and "e " are common, "qz" never happens. We precompute a 256 × 256 table of bigram log-probabilities from a sample of English text (with smoothing, so unseen bigrams get a small but non-zero probability), relative to the probability of the same bigram in uniformly random bytes. The score of a recovered fragment is the sum of these log-likelihood ratios over its bigrams: positive when the fragment looks more like English than like noise, and growing with the length of the match.
+- **More ciphertexts.** If the crib is placed in message `i` at position `p`, XORing it with `C_i ⊕ C_j` reveals a fragment of *every* other message `j`. The right placement makes all of them look like English, so we average the score over all other messages.
+- **Vectorized batches.** Cribs of the same length are stacked into a `(B, L)` array, and all positions of `C_i ⊕ C_j` into a `(P, L)` array of sliding windows (`np.lib.stride_tricks.sliding_window_view`). Broadcasting the XOR gives all `B × P` fragments at once, and the score is a lookup in the bigram table. The batch size is chosen to stay under a memory budget.
+- **Streaming.** The wordlist is consumed lazily (it can be a generator reading a file) and only the best `top_k` findings are kept in a heap (`heapq`) - we never build the full findings dictionary.
+
+To keep the arithmetic simple, positions are limited to the length of the shortest ciphertext. With exactly two ciphertexts, placing a crib in either one gives identical fragments and scores (both are `crib ⊕ C_0 ⊕ C_1`), so only message 0 is tried - the crib may really belong to either message.
+"""
+import heapq
+
+ENGLISH_SAMPLE = (
+    "The history of cryptography is a long contest between the people who design ciphers and the people who break "
+    "them. For most of that history, the breakers have had the upper hand: a cipher that looks impossible to read at "
+    "first sight usually has some structure that a patient analyst can find and exploit. The letters of a language "
+    "are not used equally often, some pairs of letters appear together far more than others, and messages tend to "
+    "start with greetings and end with signatures. Every one of these regularities leaks information. When the same "
+    "key is used for two messages, the analyst does not even need to know the key. It is enough to guess a word that "
+    "is likely to appear in one of the messages, such as a name, a date, or a common phrase, and to check whether "
+    "the text that falls out of the other message makes sense. Once a few words are known, the rest of the text "
+    "follows quickly, because each new word suggests the next one. Modern ciphers are designed so that none of these "
+    "tricks work, but only if they are used correctly. A key that is used twice, a random number generator that is "
+    "not really random, or a protocol that reveals whether a message was accepted can undo all of the careful work "
+    "that went into the design of the cipher itself. This is why security engineers spend so much of their time "
+    "thinking about how a system is used, and not only about the mathematics inside it."
+)
+
+
+def build_ngram_table(corpus: str, smoothing: float = 0.001) -> np.ndarray:
+    """
+    Build a table of bigram log-probabilities from a sample of text.
+
+    Args:
+        corpus: Sample text in the target language.
+        smoothing: Pseudo-count added to every one of the 256 * 256 possible bigrams.
+
+    Returns:
+        float32 array of shape (256, 256) where [x, y] is log(P(bigram xy in text) / P(bigram xy in random bytes)).
+    """
+    if "SOLUTION":
+        data = np.frombuffer(corpus.encode(), dtype=np.uint8)
+        counts = np.full((256, 256), smoothing, dtype=np.float64)
+        np.add.at(counts, (data[:-1], data[1:]), 1)
+        return (np.log(counts / counts.sum()) + np.log(256 * 256)).astype(np.float32)
+    else:
+        # TODO: Count all bigrams in the corpus (np.add.at is handy), add the smoothing,
+        #   normalize to probabilities, and return the log of their ratio to 1 / 256**2
+        pass
+
+
+ENGLISH_BIGRAMS = build_ngram_table(ENGLISH_SAMPLE)
+
+
+def crib_drag_engine(
+    ciphertexts: list[bytes],
+    wordlist: Iterable[str],
+    top_k: int = 10,
+    ngram_table: np.ndarray | None = None,
+    max_batch_bytes: int = 2**24,
+) -> Generator[dict, None, None]:
+    """
+    Crib-drag every word of a wordlist at every position of N ciphertexts that share one keystream.
+
+    Args:
+        ciphertexts: At least two ciphertexts encrypted with the same keystream.
+        wordlist: Iterable of candidate cribs; consumed lazily. Cribs shorter than 2 bytes are ignored.
+        top_k: Number of findings to keep, at least 1.
+        ngram_table: Bigram log-probability table (defaults to ENGLISH_BIGRAMS).
+        max_batch_bytes: Upper bound on the intermediate arrays built for one batch of cribs: the uint8 fragments,
+            the intp indices NumPy converts them to for the table lookup, and the looked-up scores.
+
+    Returns:
+        A generator of the top_k findings, best first, as dictionaries with keys "crib", "message" (index of the
+        ciphertext the crib is placed in; always 0 for two ciphertexts), "position", "score" and "recovered" (dict
+        mapping every other message index to the recovered fragment of that message). The arguments are checked
+        when crib_drag_engine is called; the wordlist is only consumed once the generator is iterated.
+    """
+    if len(ciphertexts) < 2:
+        raise ValueError("Need at least 2 ciphertexts")
+    if top_k < 1:
+        raise ValueError("top_k must be at least 1")
+
+    if "SOLUTION":
+        table = ENGLISH_BIGRAMS if ngram_table is None else ngram_table
+        length = min(len(ct) for ct in ciphertexts)
+        cts = [np.frombuffer(ct[:length], dtype=np.uint8) for ct in ciphertexts]
+        n = len(cts)
+        heap: list[tuple[float, bytes, int, int]] = []  # min-heap of (score, crib, message, position)
+
+        def batch_bytes(crib_len: int) -> int:
+            """Peak intermediate bytes per crib and position: fragments, two intp index arrays and the scores."""
+            return crib_len + (crib_len - 1) * (2 * np.dtype(np.intp).itemsize + table.itemsize)
+
+        def process(cribs: list[bytes]) -> None:
+            crib_len = len(cribs[0])
+            positions = length - crib_len + 1
+            batch = max(1, max_batch_bytes // (positions * batch_bytes(crib_len)))
+            for start in range(0, len(cribs), batch):
+                chunk = cribs[start : start + batch]
+                crib_array = np.frombuffer(b"".join(chunk), dtype=np.uint8).reshape(len(chunk), crib_len)
+                for i in range(1 if n == 2 else n):
+                    scores = np.zeros((len(chunk), positions), dtype=np.float32)
+                    for j in range(n):
+                        if j == i:
+                            continue
+                        windows = np.lib.stride_tricks.sliding_window_view(cts[i] ^ cts[j], crib_len)
+                        fragments = crib_array[:, None, :] ^ windows[None, :, :]
+                        scores += table[fragments[..., :-1], fragments[..., 1:]].sum(axis=-1)
+                    scores /= n - 1
+
+                    # Only the best top_k of this batch can possibly enter the overall top_k
+                    flat = scores.ravel()
+                    best = np.argpartition(flat, -min(top_k, flat.size))[-top_k:]
+                    for idx in best.tolist():
+                        c, p = divmod(idx, positions)
+                        item = (float(flat[idx]), chunk[c], i, p)
+                        if len(heap) < top_k:
+                            heapq.heappush(heap, item)
+                        elif item > heap[0]:
+                            heapq.heapreplace(heap, item)
+
+        def findings() -> Generator[dict, None, None]:
+            # A generator, so the wordlist is only consumed once the caller iterates
+            pending: dict[int, list[bytes]] = {}
+            for word in wordlist:
+                crib = word.encode()
+                if not 2 <= len(crib) <= length:
+                    continue
+                group = pending.setdefault(len(crib), [])
+                group.append(crib)
+                if len(group) * (length - len(crib) + 1) * batch_bytes(len(crib)) >= max_batch_bytes:
+                    process(pending.pop(len(crib)))
+            for group in pending.values():
+                process(group)
+
+            for score, crib, i, p in sorted(heap, reverse=True):
+                yield {
+                    "crib": crib.decode(),
+                    "message": i,
+                    "position": p,
+                    "score": score,
+                    "recovered": {
+                        j: bytes(a ^ b ^ k for a, b, k in zip(ciphertexts[i][p:], ciphertexts[j][p:], crib)).decode(
+                            "ascii", errors="replace"
+                        )
+                        for j in range(n)
+                        if j != i
+                    },
+                }
+
+        return findings()
+    else:
+        # TODO: Implement the crib-dragging engine
+        #   - Truncate the ciphertexts to the shortest one and convert them to uint8 arrays
+        #   - Group cribs by length; process a group once its intermediates reach the memory budget (and at the end)
+        #   - For each message i, score crib_array[:, None, :] ^ windows(C_i ^ C_j)[None] for all j != i
+        #   - Keep the best top_k (score, crib, message, position) tuples in a heap
+        #   - Return an inner generator that consumes the wordlist and yields the findings, best first
+        pass
+
+
+@report
+def test_crib_drag_engine(crib_drag_engine, build_ngram_table, crib_drag, encrypt, ciphertext1, ciphertext2):
+    """Test the crib-dragging engine."""
+    import random
+
+    print("Testing crib-dragging engine...")
+
+    # Test 1: The bigram table prefers English
+    table = build_ngram_table("the quick brown fox jumps over the lazy dog " * 10)
+    assert table.shape == (256, 256), "Bigram table should have shape (256, 256)"
+    assert table[ord("t"), ord("h")] > table[ord("q"), ord("z")], "'th' should be more likely than 'qz'"
+
+    # Test 2: The right placement wins among thousands of random decoys
+    rng = random.Random(0)
+    decoys = [
+        "".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randrange(4, 12))) for _ in range(3000)
+    ]
+    wordlist = iter(decoys + ["linear congruential generator"])  # a generator is fine, too
+    findings = list(crib_drag_engine([ciphertext1, ciphertext2], wordlist, top_k=5))
+    assert len(findings) == 5, "Should yield exactly top_k findings"
+    assert [f["score"] for f in findings] == sorted([f["score"] for f in findings], reverse=True), "Not sorted"
+    best = findings[0]
+    print(f"Best finding: {best['crib']!r} in message {best['message']} at {best['position']}: {best['recovered']}")
+    assert (best["crib"], best["message"], best["position"]) == ("linear congruential generator", 0, 2)
+
+    # Test 3: Recovered fragments agree with crib_drag
+    expected = dict(crib_drag(ciphertext1, ciphertext2, b"linear congruential generator"))[2]
+    assert best["recovered"][1] == expected.decode(), "Recovered fragment should match crib_drag"
+
+    # Test 4: More than two ciphertexts
+    messages = [
+        b"Meet me at the usual place at noon.",
+        b"Bring the documents and the money.",
+        b"Do not be late, and come alone.",
+    ]
+    cts = [encrypt(31337, m) for m in messages]
+    findings = list(crib_drag_engine(cts, decoys[:500] + ["documents", "the usual"], top_k=3))
+    assert any(f["crib"] == "documents" and f["message"] == 1 for f in findings), "Failed to place 'documents'"
+
+    # Test 5: Bad arguments are rejected at the call site, before iterating
+    for args, kwargs in [((cts, ["documents"]), {"top_k": 0}), ((cts[:1], ["documents"]), {})]:
+        try:
+            crib_drag_engine(*args, **kwargs)
+            assert False, "Bad arguments should raise ValueError when crib_drag_engine is called"
+        except ValueError:
+            pass
+
+    print("✓ Crib-dragging engine tests passed!\n" + "=" * 60)
+
+
+test_crib_drag_engine(crib_drag_engine, build_ngram_table, crib_drag, lcg_encrypt, ciphertext1, ciphertext2)
+
+# %%
+
+
+def benchmark_crib_drag_engine(n_words: int = 20_000) -> None:
+    """Compare automated_crib_drag with the engine on a synthetic wordlist."""
+    rng = random.Random(0)
+    wordlist = [
+        "".join(rng.choice("abcdefghijklmnopqrstuvwxyz ") for _ in range(rng.randrange(3, 12))) for _ in range(n_words)
+    ]
+    sample = wordlist[:500]
+
+    start = time.perf_counter()
+    automated_crib_drag(ciphertext1, ciphertext2, sample)
+    slow_time = (time.perf_counter() - start) * n_words / len(sample)
+    start = time.perf_counter()
+    list(crib_drag_engine([ciphertext1, ciphertext2], iter(wordlist)))
+    fast_time = time.perf_counter() - start
+    print(
+        f"Crib-dragging {n_words:,} words: {slow_time:.1f}s (estimated) -> {fast_time:.2f}s ({slow_time / fast_time:.0f}x faster)"
+    )
+
+
+if __name__ == "__main__":
+    benchmark_crib_drag_engine()
+
+# %%
+"""
+### Exercise 4.6: A Table-Driven ECB Engine
+
+> **Difficulty**: 🔴🔴🔴⚪⚪  
+> **Importance**: 🔵🔵🔵⚪⚪
+> 
+> You should spend up to ~30 minutes on this exercise.
+
+Our SPN cipher processes one 16-bit block at a time, with Python loops over every nibble and every bit. Real AES implementations avoid this with two tricks that we can reproduce:
+
+1. **Fused S-box and P-box tables ("T-tables").** A P-box only moves bits around, so permuting a value is the same as permuting each of its nibbles separately and ORing the results. That means we can precompute, for each of the four nibble positions `i` and each nibble value `v`, the result of substituting *and* permuting `v << 4i`. One round then becomes four table lookups ORed together, instead of 4 S-box lookups and 16 bit moves.
+2. **A full codebook per key.** A 16-bit block has only 65,536 possible values. Once we know the round keys, we can encrypt *all* of them at once with NumPy and the T-tables, and encrypting a message in ECB mode becomes a single array lookup per block. Like the DES codebook, the decryption codebook is the inverse permutation of the encryption codebook.
+
+The engine should work on large buffers without copying them: `np.frombuffer` can wrap any object that supports the buffer protocol (`bytes`, `bytearray`, `memoryview`, `mmap`, ...) without copying it, and the caller can pass a writable buffer to receive the output.
+
+Implement `build_sp_tables`, `spn_codebook`, `ecb_encrypt_fast` and `ecb_decrypt_fast`. The outputs must match `aes_encrypt` and `aes_decrypt` exactly, including the zero-byte padding of odd-length messages.
+"""
+import functools
+
+
+def build_sp_tables(sbox: List[int], pbox: List[int]) -> np.ndarray:
+    """
+    Precompute fused substitution-permutation tables.
+
+    Returns:
+        uint16 array of shape (4, 16) where [i, v] = permute(substitute(v << (4 * i), sbox), pbox).
+        Substituting and permuting x is then the OR of tables[i, (x >> 4 * i) & 0xF] over i.
+    """
+    if "SOLUTION":
+        return np.array([[permute(sbox[v] << (4 * i), pbox) for v in range(16)] for i in range(4)], dtype=np.uint16)
+    else:
+        # TODO: For each nibble position i and nibble value v, substitute v and permute it from position i
+        pass
+
+
+@functools.lru_cache(maxsize=16)
+def _spn_codebook(key: int, sbox: tuple[int, ...], pbox: tuple[int, ...]) -> np.ndarray:
+    return spn_codebook(key, list(sbox), list(pbox))
+
+
+def spn_codebook(key: int, sbox: List[int], pbox: List[int]) -> np.ndarray:
+    """
+    Encrypt every possible 16-bit block under `key`.
+
+    Returns:
+        uint16 array of 65536 entries, where entry x is encrypt_block(x, round_keys(key), sbox, pbox).
+    """
+    if "SOLUTION":
+        tables = build_sp_tables(sbox, pbox)
+        keys = [np.uint16(k) for k in round_keys(key)]
+        x = np.arange(1 << 16, dtype=np.uint16)
+        for round_key in keys[:2]:
+            x = x ^ round_key
+            x = tables[0][x & 0xF] | tables[1][(x >> 4) & 0xF] | tables[2][(x >> 8) & 0xF] | tables[3][x >> 12]
+        return x ^ keys[2]
+    else:
+        # TODO: Run the whole cipher on np.arange(65536) at once, using the tables from build_sp_tables
+        pass
+
+
+def ecb_encrypt_fast(
+    key: int, plaintext: bytes | bytearray | memoryview, sbox: List[int], pbox: List[int], out=None
+) -> bytes | None:
+    """
+    Encrypt a message in ECB mode using the codebook for `key`.
+
+    Args:
+        key: Encryption key (used as seed for round key generation)
+        plaintext: Any object supporting the buffer protocol; it is not copied.
+        sbox: S-box for substitution
+        pbox: P-box for permutation
+        out: Optional writable buffer of len(plaintext) rounded up to even, which receives the ciphertext.
+
+    Returns:
+        The ciphertext (same as aes_encrypt), or None if it was written to `out`.
+    """
+    if "SOLUTION":
+        codebook = _spn_codebook(key, tuple(sbox), tuple(pbox))
+        data = memoryview(plaintext).cast("B")
+        n_full = len(data) // 2
+        padded_len = len(data) + len(data) % 2
+
+        if out is None:
+            result = np.empty(padded_len, dtype=np.uint8)
+        else:
+            result = np.frombuffer(out, dtype=np.uint8)
+            if len(result) != padded_len:
+                raise ValueError(f"Output buffer must have {padded_len} bytes")
+        # Big-endian view of the full blocks - no copies of the input
+        blocks = np.frombuffer(data, dtype=">u2", count=n_full)
+        result[: 2 * n_full].view(">u2")[:] = codebook[blocks]
+        if len(data) % 2:
+            last = int(codebook[data[-1] << 8])  # the odd byte is padded with a zero byte
+            result[-2:] = [last >> 8, last & 0xFF]
+        return result.tobytes() if out is None else None
+    else:
+        # TODO: Implement fast ECB encryption
+        #   - Get the (cached) codebook for this key
+        #   - View the full blocks of the input as big-endian uint16 with np.frombuffer (dtype=">u2")
+        #   - Look them up in the codebook; handle the last odd byte by padding it with a zero byte
+        pass
+
+
+def ecb_decrypt_fast(
+    key: int, ciphertext: bytes | bytearray | memoryview, inv_sbox: List[int], inv_pbox: List[int]
+) -> bytes:
+    """
+    Decrypt a message in ECB mode using the inverse codebook for `key`.
+
+    Returns:
+        The plaintext, same as aes_decrypt (including stripping a single trailing zero byte).
+    """
+    if "SOLUTION":
+        sbox = [inv_sbox.index(v) for v in range(16)]
+        pbox = [inv_pbox.index(p) for p in range(16)]
+        codebook = _spn_codebook(key, tuple(sbox), tuple(pbox))
+        inverse = np.argsort(codebook).astype(np.uint16)
+        blocks = np.frombuffer(memoryview(ciphertext).cast("B"), dtype=">u2")
+        out = inverse[blocks].astype(">u2").tobytes()
+        if out[-1] == 0:
+            return out[:-1]
+        return out
+    else:
+        # TODO: Implement fast ECB decryption
+        #   - Recover sbox and pbox by inverting inv_sbox and inv_pbox, and get the encryption codebook
+        #   - The decryption codebook is its inverse permutation (np.argsort)
+        #   - Strip a single trailing zero byte, like aes_decrypt
+        pass
+
+
+@report
+def test_ecb_fast(
+    build_sp_tables,
+    ecb_encrypt_fast,
+    ecb_decrypt_fast,
+    encrypt,
+    decrypt,
+    substitute,
+    permute,
+    SBOX,
+    PBOX,
+    INV_SBOX,
+    INV_PBOX,
+):
+    """Test the table-driven ECB engine against the reference implementation."""
+    import random
+
+    print("Testing table-driven ECB engine...")
+
+    # Test 1: Fused tables reproduce substitute + permute
+    tables = build_sp_tables(SBOX, PBOX)
+    for x in [0x0000, 0xFFFF, 0x1234, 0xBEEF, 0x5A5A]:
+        fused = tables[0][x & 0xF] | tables[1][(x >> 4) & 0xF] | tables[2][(x >> 8) & 0xF] | tables[3][x >> 12]
+        assert int(fused) == permute(substitute(x, SBOX), PBOX), f"Fused tables wrong for 0x{x:04X}"
+
+    # Test 2: Same output as aes_encrypt / aes_decrypt, for even and odd lengths
+    rng = random.Random(0)
+    for length in [1, 2, 3, 12, 101, 1000]:
+        key = rng.randrange(1 << 16)
+        message = bytes(rng.randrange(1, 256) for _ in range(length))
+        ciphertext = encrypt(key, message, SBOX, PBOX)
+        assert ecb_encrypt_fast(key, message, SBOX, PBOX) == ciphertext, f"Encryption mismatch for length {length}"
+        assert ecb_decrypt_fast(key, ciphertext, INV_SBOX, INV_PBOX) == decrypt(key, ciphertext, INV_SBOX, INV_PBOX), (
+            f"Decryption mismatch for length {length}"
+        )
+
+    # Test 3: Zero-copy input and output buffers
+    message = bytearray(b"ABCDABCD" * 1000 + b"!")
+    out = bytearray(len(message) + 1)
+    assert ecb_encrypt_fast(0xCAFE, memoryview(message), SBOX, PBOX, out=out) is None, "Should write into `out`"
+    assert bytes(out) == encrypt(0xCAFE, bytes(message), SBOX, PBOX), "Output buffer has the wrong ciphertext"
+    assert ecb_decrypt_fast(0xCAFE, memoryview(out), INV_SBOX, INV_PBOX) == bytes(message), "Round trip failed"
+
+    # Test 4: ECB still leaks patterns, of course
+    assert out[0:4] == out[8:12], "ECB should preserve patterns"
+
+    print("✓ Table-driven ECB engine tests passed!\n" + "=" * 60)
+
+
+test_ecb_fast(
+    build_sp_tables,
+    ecb_encrypt_fast,
+    ecb_decrypt_fast,
+    aes_encrypt,
+    aes_decrypt,
+    substitute,
+    permute,
+    SBOX,
+    PBOX,
+    INV_SBOX,
+    INV_PBOX,
+)
+
+# %%
+
+
+def benchmark_ecb_fast(n_bytes: int = 4_000_000) -> None:
+    """Compare aes_encrypt with the table-driven engine on a multi-MB buffer."""
+    plaintext = os.urandom(n_bytes)
+    sample = plaintext[:20_000]
+
+    start = time.perf_counter()
+    aes_encrypt(0xCAFE, sample, SBOX, PBOX)
+    slow_time = (time.perf_counter() - start) * n_bytes / len(sample)
+    _spn_codebook.cache_clear()
+    start = time.perf_counter()
+    ecb_encrypt_fast(0xCAFE, plaintext, SBOX, PBOX)
+    fast_time = time.perf_counter() - start
+    print(
+        f"ECB-encrypting {n_bytes:,} bytes: {slow_time:.1f}s (estimated) -> {fast_time * 1000:.1f}ms (incl. codebook)"
+    )
+
+
+if __name__ == "__main__":
+    benchmark_ecb_fast()
+
 # %%
 """
 ## Further reading
@@ -7,15 +7,28 @@ import os
 import sys
 from typing import Generator, List, Tuple, Callable
 from aisb_utils import report
-from typing import Generator
 from w1d1_stream_cipher_secrets import intercept_messages
 import random
-from typing import List, Tuple
 import random
 import time
 from typing import List
 import random
 import random
+import multiprocessing
+import time
+import numpy as np
+import numpy as np
+import hashlib
+import inspect
+import random
+import tempfile
+import numpy as np
+from typing import Iterable
+import random
+import heapq
+import random
+import functools
+import random
 
 
 
@@ -552,3 +565,297 @@ def test_ecb_mode(encrypt, decrypt, SBOX, PBOX, INV_SBOX, INV_PBOX):
     assert pattern_ct[2:4] == pattern_ct[6:8], "ECB should preserve patterns"
 
     print("✓ ECB mode tests passed!\n" + "=" * 60)
+
+
+
+
+@report
+def test_recover_lcg_states_parallel(recover_lcg_states_parallel, lcg_keystream):
+    """Test batch LCG state recovery."""
+    print("Testing parallel LCG state recovery...")
+
+    seeds = [12345678, 1, 2**32 - 1, 987654321]
+    keystreams = []
+    for seed in seeds:
+        ks = lcg_keystream(seed)
+        keystreams.append([next(ks) for _ in range(6)])
+
+    # Test 1: Every recovered seed reproduces its keystream
+    recovered = recover_lcg_states_parallel(keystreams, workers=2)
+    assert len(recovered) == len(keystreams), "Should return one result per keystream"
+    for keystream_bytes, seed in zip(keystreams, recovered):
+        assert seed is not None, f"Failed to recover seed for {keystream_bytes}"
+        ks_test = lcg_keystream(seed)
+        assert [next(ks_test) for _ in range(6)] == keystream_bytes, "Recovered seed doesn't produce same keystream"
+
+    # Test 2: A keystream that no seed produces gives None without affecting the others
+    bad = keystreams[0][:-1] + [keystreams[0][-1] ^ 1]
+    recovered = recover_lcg_states_parallel([keystreams[1], bad], workers=2, shard_bits=8, search_bits=12)
+    assert recovered[0] is not None, "Valid keystream should still be recovered"
+    assert recovered[1] is None, "Inconsistent keystream should not produce a seed"
+
+    print("✓ Parallel LCG state recovery tests passed!\n" + "=" * 60)
+
+
+
+
+@report
+def test_lcg_engine(
+    lcg_jump,
+    lcg_keystream_array,
+    lcg_encrypt_fast,
+    recover_lcg_state_fast,
+    lcg_keystream,
+    lcg_encrypt,
+    recover_lcg_state,
+):
+    """Test the vectorized LCG engine against the reference implementation."""
+    import numpy as np
+
+    print("Testing vectorized LCG engine...")
+
+    # Test 1: Jump-ahead matches stepping
+    ks = lcg_keystream(12345)
+    stepped = [next(ks) for _ in range(1000)]
+    for steps in [1, 2, 7, 1000]:
+        jump_a, jump_c = lcg_jump(steps)
+        assert ((jump_a * 12345 + jump_c) % 2**32) & 0xFF == stepped[steps - 1], f"lcg_jump({steps}) is wrong"
+    assert lcg_jump(0) == (1, 0), "Jumping 0 steps should be the identity"
+
+    # Test 2: Long keystreams match the generator, for non-power-of-two lengths too
+    for seed in [0, 1, 12345, 2**32 - 1, -1, 2**70]:
+        ks = lcg_keystream(seed)
+        expected = [next(ks) for _ in range(5000)]
+        assert lcg_keystream_array(seed, 5000).tolist() == expected, f"Keystream mismatch for seed {seed}"
+
+    # Test 3: Many seeds at once
+    seeds = np.array([1, 2, 3, 12345], dtype=np.uint32)
+    batch = lcg_keystream_array(seeds, 37)
+    assert batch.shape == (4, 37), "Batch keystream should have shape (len(seeds), n)"
+    for row, seed in zip(batch, seeds):
+        assert row.tolist() == lcg_keystream_array(int(seed), 37).tolist(), "Batch row mismatch"
+    for wide_seeds in [np.array([-1, -12345, 2**40], dtype=np.int64), np.array([-1, 2**70], dtype=object)]:
+        batch = lcg_keystream_array(wide_seeds, 37)
+        for row, seed in zip(batch, wide_seeds):
+            assert row.tolist() == lcg_keystream_array(int(seed) % 2**32, 37).tolist(), f"Batch mismatch for {seed}"
+
+    # Test 4: Encryption matches byte for byte
+    plaintext = b"Hello, World!" * 100
+    assert lcg_encrypt_fast(12345, plaintext) == lcg_encrypt(12345, plaintext), "Fast encryption mismatch"
+    assert lcg_encrypt_fast(12345, b"") == b"", "Empty plaintext should encrypt to empty ciphertext"
+    for seed in [-1, 2**70]:
+        assert lcg_encrypt_fast(seed, plaintext) == lcg_encrypt(seed, plaintext), f"Fast encryption mismatch for {seed}"
+
+    # Test 5: State recovery returns the same seed as the reference
+    for seed in [12345678, 42]:
+        ks = lcg_keystream(seed)
+        observed = [next(ks) for _ in range(6)]
+        assert recover_lcg_state_fast(observed) == recover_lcg_state(observed), "Recovered seed mismatch"
+
+    # Test 6: Inconsistent keystreams are rejected after a full (vectorized) scan
+    try:
+        recover_lcg_state_fast(observed[:-1] + [observed[-1] ^ 1])
+        assert False, "Inconsistent keystream should raise ValueError"
+    except ValueError:
+        pass
+
+    print("✓ Vectorized LCG engine tests passed!\n" + "=" * 60)
+
+
+
+
+@report
+def test_des_codebook(
+    des_codebook,
+    build_des_codebook,
+    des_encrypt,
+    des_decrypt,
+    meet_in_the_middle_attack,
+    meet_in_the_middle_attack_table,
+    double_encrypt,
+):
+    """Test the DES codebook against the bitwise implementation."""
+    import random
+    import tempfile
+
+    import numpy as np
+
+    print("Testing DES codebook...")
+
+    codebook = build_des_codebook()
+    assert codebook.shape == (2, 1024, 256) and codebook.dtype == np.uint8, "Codebook has the wrong shape or dtype"
+
+    # Test 1: Every row matches des_encrypt / des_decrypt
+    all_bytes = bytes(range(256))
+    rng = random.Random(0)
+    for key in [0, 1023, 0b1010000010] + [rng.randrange(1024) for _ in range(20)]:
+        assert codebook[0, key].tobytes() == des_encrypt(key, all_bytes), f"Encryption table wrong for key {key}"
+        assert codebook[1, key].tobytes() == des_decrypt(key, all_bytes), f"Decryption table wrong for key {key}"
+
+    # Test 2: The cache round-trips through disk
+    with tempfile.TemporaryDirectory() as cache_dir:
+        assert np.array_equal(des_codebook(cache_dir), codebook), "Freshly cached codebook differs"
+        assert len(os.listdir(cache_dir)) == 1, "Codebook should be cached in a single file"
+        assert np.array_equal(des_codebook(cache_dir), codebook), "Codebook loaded from cache differs"
+
+        # A wrong or unreadable cache file is rebuilt and overwritten
+        (cache_file,) = os.listdir(cache_dir)
+        cache_path = os.path.join(cache_dir, cache_file)
+        for poison in [np.zeros((2, 1024, 256), dtype=np.uint8), np.array(None)]:
+            np.save(cache_path, poison, allow_pickle=True)
+            assert np.array_equal(des_codebook(cache_dir), codebook), "Codebook not rebuilt from a poisoned cache"
+            assert np.array_equal(np.load(cache_path), codebook), "Poisoned cache file not overwritten"
+
+    # Test 3: The attack gives identical results
+    plaintext = b"Attack!"
+    for key1, key2 in [(rng.randrange(1024), rng.randrange(1024)) for _ in range(3)]:
+        ciphertext = double_encrypt(key1, key2, plaintext)
+        table_result = meet_in_the_middle_attack_table(plaintext, ciphertext)
+        assert table_result == meet_in_the_middle_attack(plaintext, ciphertext), "Attack results differ"
+        assert (key1, key2) in table_result, "True keys not found"
+
+    print("✓ DES codebook tests passed!\n" + "=" * 60)
+
+
+
+
+@report
+def test_meet_in_the_middle_batch(meet_in_the_middle_attack_batch, meet_in_the_middle_attack, double_encrypt):
+    """Test the multi-pair meet-in-the-middle attack."""
+    import random
+
+    print("Testing multi-pair meet-in-the-middle attack...")
+
+    rng = random.Random(7)
+    key1, key2 = rng.randrange(1024), rng.randrange(1024)
+    plaintexts = [b"Attack", b"at dawn", b"!"]
+    pairs = [(p, double_encrypt(key1, key2, p)) for p in plaintexts]
+
+    # Test 1: Same results as intersecting single-pair attacks
+    expected = set(meet_in_the_middle_attack(*pairs[0]))
+    for pair in pairs[1:]:
+        expected &= set(meet_in_the_middle_attack(*pair))
+    found = list(meet_in_the_middle_attack_batch(pairs))
+    assert set(found) == expected, "Batch attack should return the intersection of single-pair attacks"
+    assert found == sorted(found, key=lambda pair: (pair[1], pair[0])), "Results should be sorted by (k2, k1)"
+
+    # Test 2: A single pair gives exactly the same list as the original attack
+    assert list(meet_in_the_middle_attack_batch(pairs[:1])) == meet_in_the_middle_attack(*pairs[0]), (
+        "Single-pair batch attack should match meet_in_the_middle_attack"
+    )
+
+    # Test 3: A large capture narrows down to key pairs equivalent to the true one
+    capture = bytes(range(256)) * 50
+    found = list(meet_in_the_middle_attack_batch([(capture, double_encrypt(key1, key2, capture))], k2_batch=100))
+    print(f"True keys: k1={key1}, k2={key2}; survivors after a {len(capture)}-byte capture: {found}")
+    assert (key1, key2) in found, "True keys not found"
+    for k1, k2 in found:
+        assert double_encrypt(k1, k2, bytes(range(256))) == double_encrypt(key1, key2, bytes(range(256)))
+
+    # Test 4: Contradictory pairs have no solution
+    assert list(meet_in_the_middle_attack_batch([(b"A", b"\x00"), (b"A", b"\x01")])) == [], "Expected no key pairs"
+
+    print("✓ Multi-pair meet-in-the-middle tests passed!\n" + "=" * 60)
+
+
+
+
+@report
+def test_crib_drag_engine(crib_drag_engine, build_ngram_table, crib_drag, encrypt, ciphertext1, ciphertext2):
+    """Test the crib-dragging engine."""
+    import random
+
+    print("Testing crib-dragging engine...")
+
+    # Test 1: The bigram table prefers English
+    table = build_ngram_table("the quick brown fox jumps over the lazy dog " * 10)
+    assert table.shape == (256, 256), "Bigram table should have shape (256, 256)"
+    assert table[ord("t"), ord("h")] > table[ord("q"), ord("z")], "'th' should be more likely than 'qz'"
+
+    # Test 2: The right placement wins among thousands of random decoys
+    rng = random.Random(0)
+    decoys = [
+        "".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randrange(4, 12))) for _ in range(3000)
+    ]
+    wordlist = iter(decoys + ["linear congruential generator"])  # a generator is fine, too
+    findings = list(crib_drag_engine([ciphertext1, ciphertext2], wordlist, top_k=5))
+    assert len(findings) == 5, "Should yield exactly top_k findings"
+    assert [f["score"] for f in findings] == sorted([f["score"] for f in findings], reverse=True), "Not sorted"
+    best = findings[0]
+    print(f"Best finding: {best['crib']!r} in message {best['message']} at {best['position']}: {best['recovered']}")
+    assert (best["crib"], best["message"], best["position"]) == ("linear congruential generator", 0, 2)
+
+    # Test 3: Recovered fragments agree with crib_drag
+    expected = dict(crib_drag(ciphertext1, ciphertext2, b"linear congruential generator"))[2]
+    assert best["recovered"][1] == expected.decode(), "Recovered fragment should match crib_drag"
+
+    # Test 4: More than two ciphertexts
+    messages = [
+        b"Meet me at the usual place at noon.",
+        b"Bring the documents and the money.",
+        b"Do not be late, and come alone.",
+    ]
+    cts = [encrypt(31337, m) for m in messages]
+    findings = list(crib_drag_engine(cts, decoys[:500] + ["documents", "the usual"], top_k=3))
+    assert any(f["crib"] == "documents" and f["message"] == 1 for f in findings), "Failed to place 'documents'"
+
+    # Test 5: Bad arguments are rejected at the call site, before iterating
+    for args, kwargs in [((cts, ["documents"]), {"top_k": 0}), ((cts[:1], ["documents"]), {})]:
+        try:
+            crib_drag_engine(*args, **kwargs)
+            assert False, "Bad arguments should raise ValueError when crib_drag_engine is called"
+        except ValueError:
+            pass
+
+    print("✓ Crib-dragging engine tests passed!\n" + "=" * 60)
+
+
+
+
+@report
+def test_ecb_fast(
+    build_sp_tables,
+    ecb_encrypt_fast,
+    ecb_decrypt_fast,
+    encrypt,
+    decrypt,
+    substitute,
+    permute,
+    SBOX,
+    PBOX,
+    INV_SBOX,
+    INV_PBOX,
+):
+    """Test the table-driven ECB engine against the reference implementation."""
+    import random
+
+    print("Testing table-driven ECB engine...")
+
+    # Test 1: Fused tables reproduce substitute + permute
+    tables = build_sp_tables(SBOX, PBOX)
+    for x in [0x0000, 0xFFFF, 0x1234, 0xBEEF, 0x5A5A]:
+        fused = tables[0][x & 0xF] | tables[1][(x >> 4) & 0xF] | tables[2][(x >> 8) & 0xF] | tables[3][x >> 12]
+        assert int(fused) == permute(substitute(x, SBOX), PBOX), f"Fused tables wrong for 0x{x:04X}"
+
+    # Test 2: Same output as aes_encrypt / aes_decrypt, for even and odd lengths
+    rng = random.Random(0)
+    for length in [1, 2, 3, 12, 101, 1000]:
+        key = rng.randrange(1 << 16)
+        message = bytes(rng.randrange(1, 256) for _ in range(length))
+        ciphertext = encrypt(key, message, SBOX, PBOX)
+        assert ecb_encrypt_fast(key, message, SBOX, PBOX) == ciphertext, f"Encryption mismatch for length {length}"
+        assert ecb_decrypt_fast(key, ciphertext, INV_SBOX, INV_PBOX) == decrypt(key, ciphertext, INV_SBOX, INV_PBOX), (
+            f"Decryption mismatch for length {length}"
+        )
+
+    # Test 3: Zero-copy input and output buffers
+    message = bytearray(b"ABCDABCD" * 1000 + b"!")
+    out = bytearray(len(message) + 1)
+    assert ecb_encrypt_fast(0xCAFE, memoryview(message), SBOX, PBOX, out=out) is None, "Should write into `out`"
+    assert bytes(out) == encrypt(0xCAFE, bytes(message), SBOX, PBOX), "Output buffer has the wrong ciphertext"
+    assert ecb_decrypt_fast(0xCAFE, memoryview(out), INV_SBOX, INV_PBOX) == bytes(message), "Round trip failed"
+
+    # Test 4: ECB still leaks patterns, of course
+    assert out[0:4] == out[8:12], "ECB should preserve patterns"
+
+    print("✓ Table-driven ECB engine tests passed!\n" + "=" * 60)
@@ -34,6 +34,18 @@ You'll implement CBC mode encryption and execute the famous padding oracle attac
 > - Create and exploit padding oracle vulnerabilities
 > - Learn about real-world attacks like POODLE
 
+### 4️⃣ Bonus: Cryptography at Scale
+You'll revisit the primitives and attacks from this day and make them fast enough for real workloads.
+
+> **Learning Objectives**
+> - Build an incremental, constant-memory hash object with the `hashlib` interface
+> - Reuse hash state to sweep length extension forgeries in bulk and check them against a batch oracle
+> - Cache HMAC key states and verify batches of tags in constant time
+> - Speed up the padding oracle attack with concurrency, batched queries and frequency-ordered guesses
+> - Reuse cipher objects, decrypt CBC in one ECB call and handle padding without copies
+> - Speed up RSA with block packing and CRT decryption and signing
+> - Generate primes quickly with sieving, deterministic Miller-Rabin bases and worker processes
+
 """
 
 # %%
@@ -3403,6 +3415,1795 @@ The server can also request the browser to use stricter security settings called
 <!-- FIXME: forging ciphertext as a bonus exercise -->
 
 """
+# %%
+"""
+## 4️⃣ Bonus: Cryptography at Scale
+
+Every implementation in this day was written for clarity: MD5 builds its result with `+=`, RSA encrypts one character at a time, and the padding oracle attack makes one request after another. That is the right way to learn how the primitives work, but an attacker (or a defender) who wants to hash a disk image, sweep thousands of forged MACs or decrypt a whole cookie jar needs the same algorithms to run orders of magnitude faster.
+
+In this section, you'll revisit the primitives and attacks from this day and make them fast. None of these exercises change *what* is being computed - every fast version must give exactly the same answers as the version you already wrote, and the tests check precisely that.
+
+### Exercise 4.1: A Streaming MD5 Object
+
+> **Difficulty**: 🔴🔴🔴⚪⚪
+> **Importance**: 🔵🔵⚪⚪⚪
+>
+> You should spend up to ~25 minutes on this exercise.
+
+`md5_hash` needs the whole message in memory, pads it by repeated concatenation, and decodes every word of every block with four index operations and three shifts. To hash a multi-GB file we need the interface that `hashlib` offers instead:
+
+```python
+h = MD5()
+for chunk in chunks:
+    h.update(chunk)
+h.hexdigest()
+```
+
+The object keeps only the 16-byte state, a buffer of fewer than 64 pending bytes and the total message length, so memory use is constant no matter how much data passes through it. `copy()` clones the object, which lets you hash a common prefix once and then finish it in several different ways.
+
+Two tricks make the per-block work much cheaper in pure Python:
+- **Decode a block in one call**: `struct.unpack("<16I", block)` turns 64 bytes into 16 little-endian words at C speed, and `struct.iter_unpack` does the same for a whole run of blocks.
+- **Unroll the rounds**: the loop in `md5_process_block` recomputes the round function, the message index `k` and the rotation amount on every iteration. All of these are fixed, so we precompute them into tables and *generate* a compression function with the 64 rounds written out one after another - this is how many fast hash implementations are written, just with a code generator instead of a C preprocessor.
+
+The unrolled compression function is provided below. Your task is to implement the `MD5` class on top of it:
+- `update()` fills the pending buffer up to a full block, then compresses as many whole blocks as possible directly from the input without copying them, and stores the remainder.
+- `digest()` applies the padding to a *copy* of the pending bytes, so that calling it does not change the object and more data can be added afterwards.
+"""
+import struct
+
+# Message word index used by each of the 64 rounds
+MD5_K = (
+    list(range(16))
+    + [(5 * i + 1) % 16 for i in range(16, 32)]
+    + [(3 * i + 5) % 16 for i in range(32, 48)]
+    + [(7 * i) % 16 for i in range(48, 64)]
+)
+
+MD5_IV = (0x67452301, 0xEFCDAB89, 0x98BADCFE, 0x10325476)
+
+# Round functions F, G, H, I written in terms of the variables b, c, d
+# (F and G are rewritten to use fewer operations than in md5_f and md5_g)
+_MD5_ROUND_EXPRESSIONS = [
+    "d ^ (b & (c ^ d))",
+    "c ^ (d & (b ^ c))",
+    "b ^ c ^ d",
+    "c ^ (b | ~d)",
+]
+
+
+def _md5_compress_source() -> str:
+    """Generate the source of an MD5 compression function with all 64 rounds unrolled."""
+    names = "abcd"
+    lines = ["def md5_compress(state, X):", "    a, b, c, d = state"]
+    for i, (k, s, t) in enumerate(zip(MD5_K, MD5_S, MD5_T)):
+        # Instead of shuffling A, B, C, D = D, A, B, C after every round,
+        # rotate which variable plays which role
+        a, b, c, d = (names[(j - i) % 4] for j in range(4))
+        f = _MD5_ROUND_EXPRESSIONS[i // 16].translate(str.maketrans("bcd", b + c + d))
+        lines.append(f"    {a} = ({a} + ({f}) + X[{k}] + {t:#010x}) & 0xFFFFFFFF")
+        lines.append(
+            f"    {a} = ({b} + (({a} << {s}) | ({a} >> {32 - s}))) & 0xFFFFFFFF"
+        )
+    lines.append(
+        "    return ((state[0] + a) & 0xFFFFFFFF, (state[1] + b) & 0xFFFFFFFF,"
+        " (state[2] + c) & 0xFFFFFFFF, (state[3] + d) & 0xFFFFFFFF)"
+    )
+    return "\n".join(lines)
+
+
+_md5_namespace = {}
+exec(compile(_md5_compress_source(), "<md5_compress>", "exec"), _md5_namespace)  # noqa: S102 - code generated above
+md5_compress = _md5_namespace["md5_compress"]
+md5_compress.__doc__ = """
+    Process one block, given as 16 decoded words, with all 64 MD5 rounds unrolled.
+
+    Args:
+        state: Current MD5 state (A, B, C, D)
+        X: The 16 little-endian message words of the block
+
+    Returns:
+        Updated MD5 state as a new tuple
+    """
+
+
+class MD5:
+    """Incremental MD5 with the same interface as hashlib.md5."""
+
+    name = "md5"
+    digest_size = 16
+    block_size = 64
+
+    def __init__(self, data: bytes = b""):
+        self._state = MD5_IV
+        self._buffer = b""  # Pending bytes, always shorter than one block
+        self._length = 0  # Total number of bytes passed to update()
+        if data:
+            self.update(data)
+
+    def update(self, data: bytes) -> None:
+        """Add more data to the message being hashed."""
+        if "SOLUTION":
+            data = memoryview(data).cast("B")
+            self._length += len(data)
+            state = self._state
+            offset = 0
+            if self._buffer:
+                offset = min(64 - len(self._buffer), len(data))
+                self._buffer += data[:offset]
+                if len(self._buffer) < 64:
+                    return
+                state = md5_compress(state, struct.unpack("<16I", self._buffer))
+            end = offset + (len(data) - offset) // 64 * 64
+            for X in struct.iter_unpack("<16I", data[offset:end]):
+                state = md5_compress(state, X)
+            self._state = state
+            self._buffer = bytes(data[end:])
+        else:
+            # TODO: Implement update
+            # - Top up self._buffer to a full block first, compress it if it is full
+            # - Compress all whole blocks of the remaining data (struct.iter_unpack)
+            # - Keep the leftover (< 64 bytes) in self._buffer
+            # - Don't forget to update self._length
+            pass
+
+    def copy(self) -> "MD5":
+        """Return an independent copy of this hash object."""
+        if "SOLUTION":
+            clone = MD5.__new__(MD5)
+            clone._state = self._state
+            clone._buffer = self._buffer
+            clone._length = self._length
+            return clone
+        else:
+            # TODO: Implement copy
+            # - State and buffer are immutable, so a shallow copy of the attributes is enough
+            pass
+
+    def digest(self) -> bytes:
+        """Return the MD5 digest of all data passed to update() so far."""
+        if "SOLUTION":
+            tail = md5_padding(self._buffer)
+            # md5_padding only knows the length of the pending bytes; fix the length field
+            tail = tail[:-8] + struct.pack(
+                "<Q", (self._length * 8) & 0xFFFFFFFFFFFFFFFF
+            )
+            state = self._state
+            for X in struct.iter_unpack("<16I", tail):
+                state = md5_compress(state, X)
+            return struct.pack("<4I", *state)
+        else:
+            # TODO: Implement digest
+            # - Pad the pending bytes; the length field must contain the total message length
+            # - Compress the padded tail starting from the current state, without modifying self
+            # - Pack the state into 16 little-endian bytes
+            pass
+
+    def hexdigest(self) -> str:
+        """Return the digest as a hex string."""
+        return self.digest().hex()
+
+
+def md5_file(path: str, chunk_size: int = 1 << 20) -> str:
+    """
+    Hash a file of any size in constant memory.
+
+    Args:
+        path: File to hash
+        chunk_size: Size of the reusable read buffer in bytes (a multiple of 64)
+
+    Returns:
+        MD5 digest as a hex string
+    """
+    if "SOLUTION":
+        h = MD5()
+        buffer = bytearray(chunk_size)
+        view = memoryview(buffer)
+        with open(path, "rb") as f:
+            while n := f.readinto(buffer):
+                h.update(view[:n])
+        return h.hexdigest()
+    else:
+        # TODO: Implement md5_file
+        # - Read the file into one preallocated bytearray with f.readinto()
+        # - Pass a memoryview of the filled part to update() to avoid copies
+        pass
+
+
+@report
+def test_md5_streaming(MD5, md5_file, md5_hash):
+    """Compare the streaming MD5 against hashlib and the reference implementation."""
+    import random
+    import tempfile
+
+    rng = random.Random(0)
+    for length in [0, 1, 3, 55, 56, 63, 64, 65, 127, 128, 1000, 4097]:
+        message = rng.randbytes(length)
+        expected = hashlib.md5(message).digest()
+        assert MD5(message).digest() == expected, f"MD5 of {length} bytes is wrong"
+        assert md5_hash(message) == expected
+
+        # Feed the same message in chunks of random size
+        h = MD5()
+        position = 0
+        while position < length:
+            step = rng.randint(1, 100)
+            h.update(message[position : position + step])
+            position += step
+        assert h.digest() == expected, f"Chunked MD5 of {length} bytes is wrong"
+
+    h = MD5(b"The quick brown fox ")
+    assert h.digest() == h.digest(), "digest() must not change the object"
+    clone = h.copy()
+    h.update(b"jumps over the lazy dog")
+    clone.update(bytearray(b"sleeps"))
+    assert h.hexdigest() == "9e107d9d372bb6826bd81d3542a419d6"
+    assert clone.hexdigest() == hashlib.md5(b"The quick brown fox sleeps").hexdigest()
+    assert MD5(memoryview(b"abc")).hexdigest() == "900150983cd24fb0d6963f7d28e17f72"
+
+    data = rng.randbytes(10_000)
+    with tempfile.NamedTemporaryFile() as f:
+        f.write(data)
+        f.flush()
+        assert md5_file(f.name, chunk_size=192) == hashlib.md5(data).hexdigest()
+
+
+test_md5_streaming(MD5, md5_file, md5_hash)
+
+# %%
+"""
+Let's see how much faster the streaming object is than `md5_hash`, and how it compares to the C implementation in `hashlib`:
+"""
+import time
+
+
+def benchmark_md5_throughput(n_bytes: int = 1 << 18) -> None:
+    """Compare the throughput of md5_hash, MD5 and hashlib.md5."""
+    data = os.urandom(n_bytes)
+    implementations = [
+        ("md5_hash", lambda: md5_hash(data)),
+        ("MD5", lambda: MD5(data).digest()),
+        ("hashlib.md5", lambda: hashlib.md5(data).digest()),
+    ]
+    expected = hashlib.md5(data).digest()
+    for name, run in implementations:
+        start = time.perf_counter()
+        assert run() == expected
+        elapsed = time.perf_counter() - start
+        print(f"{name:>12}: {n_bytes / elapsed / 1e6:8.2f} MB/s")
+
+
+if __name__ == "__main__":
+    benchmark_md5_throughput()
+
+# %%
+"""
+### Exercise 4.2: Sweeping Secret Lengths for Length Extension
+
+> **Difficulty**: 🔴🔴🔴⚪⚪
+> **Importance**: 🔵🔵⚪⚪⚪
+>
+> You should spend up to ~25 minutes on this exercise.
+
+`length_extension_attack` needs the secret length, which the attacker usually has to guess. Guessing means calling it once per candidate length, and each call builds a dummy secret, pads it with repeated concatenation and hashes the tail block by block. Against a real service you would want to try every length from 1 to 256 for every (message, tag) pair you captured, and ask the server about many candidates at once instead of one request per guess.
+
+Most of that work is redundant:
+- The internal MD5 state is the same for every guess - it is just the tag. Only the number of bytes already processed differs, and the digest only needs that number for the length field of the final padding.
+- The glue padding for a guess depends only on `secret_length + len(original_message)`, so it can be computed directly instead of padding a dummy message.
+- Bytes processed so far are always a multiple of 64, so the up to 64 secret lengths that round up to the same number of blocks share *the same forged tag* for a given suffix - only the forged messages differ. Cache the tails by the number of processed bytes and each one is computed once.
+
+Implement:
+- `md5_resume`, which turns a tag back into an `MD5` object that has already processed `length` bytes, so that you can simply `update()` it with the data to append.
+- `forge_length_extensions`, which produces the forgery for every combination of candidate secret length and suffix.
+- `length_extension_sweep`, which finds the secret length for many captured pairs by sending candidates to a batch oracle (a function that checks a list of `(message, tag)` pairs and returns a list of booleans), and then forges all suffixes for the pairs whose secret length was confirmed.
+"""
+from typing import Iterable
+
+
+def md5_glue_padding(length: int) -> bytes:
+    """Return the padding MD5 appends to a message of the given length."""
+    return (
+        b"\x80"
+        + b"\x00" * ((55 - length) % 64)
+        + struct.pack("<Q", (length * 8) & 0xFFFFFFFFFFFFFFFF)
+    )
+
+
+def md5_resume(tag: bytes, length: int) -> MD5:
+    """
+    Create an MD5 object in the state described by a digest.
+
+    Args:
+        tag: MD5 digest of some unknown data
+        length: Number of bytes hashed to produce the tag, including padding (a multiple of 64)
+
+    Returns:
+        MD5 object that continues hashing right after those bytes
+    """
+    assert length % 64 == 0, "The resumed state must be at a block boundary"
+    if "SOLUTION":
+        h = MD5()
+        h._state = struct.unpack("<4I", tag)
+        h._length = length
+        return h
+    else:
+        # TODO: Implement md5_resume
+        # - Decode the tag into 4 little-endian words and use them as the state
+        # - Set the processed length so that the final padding is right
+        pass
+
+
+def forge_length_extensions(
+    original_message: bytes,
+    original_tag: bytes,
+    secret_lengths: Iterable[int],
+    suffixes: list[bytes],
+) -> list[tuple[int, bytes, bytes]]:
+    """
+    Run the length extension attack for many secret lengths and suffixes at once.
+
+    Args:
+        original_message: Message with known valid naive MAC
+        original_tag: Valid naive MAC for original_message
+        secret_lengths: Candidate secret lengths
+        suffixes: Data to append
+
+    Returns:
+        (secret_length, forged_message, forged_tag) for every secret length and suffix,
+        ordered by secret length and then by suffix
+    """
+    if "SOLUTION":
+        tails = {}  # (processed bytes, suffix index) -> forged tag
+        forgeries = []
+        for secret_length in secret_lengths:
+            known_length = secret_length + len(original_message)
+            glue_padding = md5_glue_padding(known_length)
+            processed = known_length + len(glue_padding)
+            prefix = original_message + glue_padding
+            for i, suffix in enumerate(suffixes):
+                if (processed, i) not in tails:
+                    h = md5_resume(original_tag, processed)
+                    h.update(suffix)
+                    tails[processed, i] = h.digest()
+                forgeries.append((secret_length, prefix + suffix, tails[processed, i]))
+        return forgeries
+    else:
+        # TODO: Implement forge_length_extensions
+        # - For each secret length, compute the glue padding and the number of processed bytes
+        # - Compute the forged tag for (processed bytes, suffix) only once, using md5_resume
+        # - The forged message is original_message + glue_padding + suffix
+        pass
+
+
+def length_extension_sweep(
+    pairs: list[tuple[bytes, bytes]],
+    secret_lengths: Iterable[int],
+    suffixes: list[bytes],
+    oracle: Callable[[list[tuple[bytes, bytes]]], list[bool]],
+    batch_size: int = 1024,
+) -> dict[int, list[tuple[int, bytes, bytes]]]:
+    """
+    Find the secret length for captured (message, tag) pairs and forge all suffixes.
+
+    Args:
+        pairs: Captured (message, naive MAC) pairs
+        secret_lengths: Candidate secret lengths to try
+        suffixes: Data to append; the first one is used to probe the oracle
+        oracle: Checks a batch of (message, tag) pairs, returns one boolean per pair
+        batch_size: Maximum number of candidates sent to the oracle at once
+
+    Returns:
+        For each pair whose secret length was confirmed, its index mapped to the
+        (secret_length, forged_message, forged_tag) forgeries for all suffixes
+    """
+    secret_lengths = list(secret_lengths)
+    if "SOLUTION":
+        found = {}  # pair index -> confirmed secret length
+        pending = []  # (pair index, secret length, forged message, forged tag)
+
+        def flush():
+            accepted = oracle([(message, tag) for _, _, message, tag in pending])
+            for (index, secret_length, _, _), ok in zip(pending, accepted):
+                if ok:
+                    found.setdefault(index, secret_length)
+            pending.clear()
+
+        for index, (message, tag) in enumerate(pairs):
+            candidates = forge_length_extensions(
+                message, tag, secret_lengths, suffixes[:1]
+            )
+            for secret_length, forged_message, forged_tag in candidates:
+                pending.append((index, secret_length, forged_message, forged_tag))
+                if len(pending) >= batch_size:
+                    flush()
+        if pending:
+            flush()
+
+        return {
+            index: forge_length_extensions(*pairs[index], [secret_length], suffixes)
+            for index, secret_length in sorted(found.items())
+        }
+    else:
+        # TODO: Implement length_extension_sweep
+        # - Generate the candidates for suffixes[0] for every pair and every secret length
+        # - Send them to the oracle in batches of at most batch_size
+        # - Remember the confirmed secret length of each pair
+        # - Forge all suffixes with the confirmed secret length
+        pass
+
+
+@report
+def test_length_extension_sweep(
+    md5_resume,
+    forge_length_extensions,
+    length_extension_sweep,
+    length_extension_attack,
+    naive_mac,
+):
+    """Check the batched attack against length_extension_attack and a batch oracle."""
+    import random
+
+    rng = random.Random(1)
+    message = b"user=alice&action=view"
+    suffixes = [b"&action=admin", b"&user=root" * 10]
+    secret = b"k" * 21
+    tag = naive_mac(message, secret)
+
+    h = md5_resume(hashlib.md5(b"x" * 55).digest(), 64)
+    h.update(b"abc")
+    _, expected_tag = length_extension_attack(
+        b"", hashlib.md5(b"x" * 55).digest(), 55, b"abc"
+    )
+    assert h.digest() == expected_tag, "md5_resume does not continue from the tag"
+
+    forgeries = forge_length_extensions(message, tag, range(1, 70), suffixes)
+    assert len(forgeries) == 69 * len(suffixes)
+    for secret_length, forged_message, forged_tag in forgeries[::7]:
+        suffix = suffixes[forged_message.endswith(suffixes[1])]
+        assert (forged_message, forged_tag) == length_extension_attack(
+            message, tag, secret_length, suffix
+        ), (
+            f"Forgery for secret length {secret_length} differs from length_extension_attack"
+        )
+
+    oracle_calls = []
+    secrets_by_pair = [rng.randbytes(rng.randint(1, 40)) for _ in range(10)]
+    secrets_by_pair[3] = b"s" * 100  # Outside of the swept lengths
+    pairs = []
+    for pair_secret in secrets_by_pair:
+        pair_message = rng.randbytes(rng.randint(0, 80))
+        pairs.append((pair_message, hashlib.md5(pair_secret + pair_message).digest()))
+
+    def oracle(batch):
+        oracle_calls.append(len(batch))
+        return [
+            any(hashlib.md5(s + m).digest() == t for s in secrets_by_pair)
+            for m, t in batch
+        ]
+
+    results = length_extension_sweep(
+        pairs, range(1, 65), suffixes, oracle, batch_size=100
+    )
+    assert max(oracle_calls) <= 100, "Batches must not exceed batch_size"
+    assert sum(oracle_calls) == len(pairs) * 64, (
+        "Every candidate should be checked exactly once"
+    )
+    assert sorted(results) == [i for i in range(len(pairs)) if i != 3]
+    for index, pair_forgeries in results.items():
+        pair_secret = secrets_by_pair[index]
+        assert len(pair_forgeries) == len(suffixes)
+        for (secret_length, forged_message, forged_tag), suffix in zip(
+            pair_forgeries, suffixes
+        ):
+            assert secret_length == len(pair_secret)
+            assert forged_message.startswith(
+                pairs[index][0]
+            ) and forged_message.endswith(suffix)
+            assert hashlib.md5(pair_secret + forged_message).digest() == forged_tag
+
+
+test_length_extension_sweep(
+    md5_resume,
+    forge_length_extensions,
+    length_extension_sweep,
+    length_extension_attack,
+    naive_mac,
+)
+
+# %%
+"""
+Compare the sweep with calling `length_extension_attack` once per guess:
+"""
+
+
+def benchmark_length_extension_sweep(
+    n_pairs: int = 200, max_secret_length: int = 256
+) -> None:
+    """Time a full secret length sweep with and without the batched attack."""
+    secret = os.urandom(37)
+    pairs = []
+    for i in range(n_pairs):
+        message = f"user={i}&action=view".encode()
+        pairs.append((message, hashlib.md5(secret + message).digest()))
+
+    def oracle(batch):
+        return [
+            hmac.compare_digest(hashlib.md5(secret + m).digest(), t) for m, t in batch
+        ]
+
+    lengths = range(1, max_secret_length + 1)
+    start = time.perf_counter()
+    results = length_extension_sweep(pairs, lengths, [b"&action=admin"], oracle)
+    fast_time = time.perf_counter() - start
+    assert len(results) == n_pairs
+
+    sample = pairs[: max(1, n_pairs // 20)]
+    start = time.perf_counter()
+    for message, tag in sample:
+        for secret_length in lengths:
+            length_extension_attack(message, tag, secret_length, b"&action=admin")
+    slow_time = (time.perf_counter() - start) * n_pairs / len(sample)
+    print(
+        f"Sweeping {max_secret_length} secret lengths over {n_pairs} pairs: "
+        f"{slow_time:.2f}s (estimated) -> {fast_time:.2f}s ({slow_time / fast_time:.0f}x faster)"
+    )
+
+
+if __name__ == "__main__":
+    benchmark_length_extension_sweep()
+
+# %%
+"""
+### Exercise 4.3: HMAC with Cached Key States
+
+> **Difficulty**: 🔴🔴⚪⚪⚪
+> **Importance**: 🔵🔵🔵⚪⚪
+>
+> You should spend up to ~20 minutes on this exercise.
+
+`hmac_md5` normalizes the key, XORs it with `ipad` and `opad` and hashes both 64-byte key blocks again on every call, although they only depend on the key. A server that verifies thousands of tags per second with the same key wastes half of its hashing on them.
+
+The key blocks are exactly one MD5 block each, so we can hash them once and keep the two resulting states. This is what `hmac.new(...).copy()` does internally, and what the streaming `MD5` object from Exercise 4.1 makes easy: `copy()` the cached inner and outer objects and only feed them the message and the inner digest.
+
+Implement the `HMACMD5` class:
+- `__init__` precomputes the inner and outer `MD5` objects for the key.
+- `mac` and `mac_many` compute tags from copies of the cached objects.
+- `verify` and `verify_many` compare tags with `hmac.compare_digest`. The comparison must take the same time no matter where the tags differ, and `verify_many` must treat every message the same way - it computes and compares every tag even when some of them were already rejected, so the timing of a batch reveals nothing about which tags were valid.
+"""
+
+
+class HMACMD5:
+    """HMAC-MD5 context that hashes the key blocks once and MACs many messages."""
+
+    def __init__(self, key: bytes):
+        block_size = 64
+        if "SOLUTION":
+            if len(key) > block_size:
+                key = md5_hash(key)
+            key = key.ljust(block_size, b"\x00")
+            self._inner = MD5(bytes(k ^ 0x36 for k in key))
+            self._outer = MD5(bytes(k ^ 0x5C for k in key))
+        else:
+            # TODO: Precompute the keyed states
+            # - Normalize the key as in hmac_md5
+            # - Store MD5 objects that have processed (key ⊕ ipad) and (key ⊕ opad)
+            pass
+
+    def mac(self, message: bytes) -> bytes:
+        """Compute the HMAC-MD5 tag of a message."""
+        if "SOLUTION":
+            inner = self._inner.copy()
+            inner.update(message)
+            outer = self._outer.copy()
+            outer.update(inner.digest())
+            return outer.digest()
+        else:
+            # TODO: Implement mac using copies of the cached MD5 objects
+            pass
+
+    def mac_many(self, messages: Iterable[bytes]) -> list[bytes]:
+        """Compute the tags of many messages."""
+        return [self.mac(message) for message in messages]
+
+    def verify(self, message: bytes, tag: bytes) -> bool:
+        """Check a tag in constant time."""
+        if "SOLUTION":
+            return hmac.compare_digest(self.mac(message), tag)
+        else:
+            # TODO: Compare with hmac.compare_digest
+            pass
+
+    def verify_many(self, messages: list[bytes], tags: list[bytes]) -> list[bool]:
+        """
+        Check many tags, doing the same work for every message.
+
+        Args:
+            messages: Messages to verify
+            tags: Claimed tags, one per message
+
+        Returns:
+            One boolean per message
+        """
+        assert len(messages) == len(tags), "Need exactly one tag per message"
+        if "SOLUTION":
+            return [
+                hmac.compare_digest(expected, tag)
+                for expected, tag in zip(self.mac_many(messages), tags)
+            ]
+        else:
+            # TODO: Implement verify_many
+            # - Compute all tags first, then compare each with hmac.compare_digest
+            # - Don't stop early on the first invalid tag
+            pass
+
+
+@report
+def test_hmac_md5_context(HMACMD5, hmac_md5):
+    """Compare HMACMD5 against hmac.new and the reference hmac_md5."""
+    import random
+
+    rng = random.Random(2)
+    for key in [
+        b"",
+        b"Jefe",
+        b"\x0b" * 16,
+        b"k" * 64,
+        rng.randbytes(65),
+        rng.randbytes(200),
+    ]:
+        context = HMACMD5(key)
+        messages = [rng.randbytes(n) for n in [0, 1, 50, 64, 100, 1000]]
+        expected = [hmac.new(key, m, hashlib.md5).digest() for m in messages]
+        assert context.mac_many(messages) == expected, f"Wrong tags for key {key!r}"
+        assert context.mac(messages[2]) == hmac_md5(key, messages[2])
+
+        tags = list(expected)
+        tags[1] = bytes(16)
+        tags[3] = expected[3][:-1] + bytes([expected[3][-1] ^ 1])
+        tags[4] = expected[4][:8]  # Truncated tag
+        assert context.verify_many(messages, tags) == [
+            True,
+            False,
+            True,
+            False,
+            False,
+            True,
+        ]
+        assert context.verify(messages[0], expected[0])
+        assert not context.verify(messages[0], expected[1])
+
+    context = HMACMD5(b"Jefe")
+    assert (
+        context.mac(b"what do ya want for nothing?").hex()
+        == "750c783e6ab0b503eaa86e310a5db738"
+    )
+    # Computing tags must not change the cached key states
+    assert (
+        context.mac(b"what do ya want for nothing?").hex()
+        == "750c783e6ab0b503eaa86e310a5db738"
+    )
+
+
+test_hmac_md5_context(HMACMD5, hmac_md5)
+
+# %%
+"""
+How much does caching the key states save for a server that verifies many short tags?
+"""
+
+
+def benchmark_hmac_md5_context(n_messages: int = 2000) -> None:
+    """Time verifying many tags with hmac_verify and HMACMD5.verify_many."""
+    key = os.urandom(16)
+    messages = [f"user={i}&action=view".encode() for i in range(n_messages)]
+    tags = [hmac.new(key, m, hashlib.md5).digest() for m in messages]
+
+    start = time.perf_counter()
+    slow = [hmac_verify(key, m, t) for m, t in zip(messages, tags)]
+    slow_time = time.perf_counter() - start
+    start = time.perf_counter()
+    fast = HMACMD5(key).verify_many(messages, tags)
+    fast_time = time.perf_counter() - start
+    assert slow == fast
+    print(
+        f"Verifying {n_messages} tags: {n_messages / slow_time:,.0f}/s -> "
+        f"{n_messages / fast_time:,.0f}/s ({slow_time / fast_time:.1f}x faster)"
+    )
+
+
+if __name__ == "__main__":
+    benchmark_hmac_md5_context()
+
+# %%
+"""
+### Exercise 4.4: A Parallel, Adaptive Padding Oracle Attack
+
+> **Difficulty**: 🔴🔴🔴🔴⚪
+> **Importance**: 🔵🔵🔵⚪⚪
+>
+> You should spend up to ~40 minutes on this exercise.
+
+Against a real server, every oracle query is an HTTP request, and the attack from Exercise 4 spends almost all of its time waiting for responses: it tries candidate bytes 0, 1, 2, ... one request at a time, and decrypts the blocks strictly one after another. Three observations make it much faster:
+
+- **Blocks are independent.** Decrypting block `i` only needs ciphertext blocks `i - 1` and `i`, which we already have. All blocks can be attacked at the same time. The work is waiting for the network rather than computing, so threads are enough even with the GIL - a thread that is blocked on I/O (or `time.sleep`) releases it.
+- **Batch the queries.** Many servers (and any oracle that we control, like a script on a compromised host) can check several ciphertexts per round trip. Sending `batch_size` candidates at once trades a few wasted queries for far fewer round trips.
+- **Guess likely bytes first.** The candidate IV byte `c` at a position is valid when `c ⊕ iv[position] ⊕ padding_value` is the plaintext byte. Instead of scanning `c = 0..255`, scan the plaintext bytes in order of how common they are: letters, spaces and JSON punctuation for cookies, and padding bytes first in the last block. Most bytes are found within the first batch.
+
+One subtlety becomes important once candidates are not tried in a fixed order: when attacking the last byte of a block, a valid padding does not necessarily mean the plaintext ends in `\x01`. If the second-to-last plaintext byte happens to be `\x02`, a guess that makes the last byte `\x02` is also valid. Confirm a hit at the last position by changing the second-to-last IV byte and asking again - a real `\x01` padding stays valid.
+
+Implement:
+- `plaintext_byte_order`, the order in which plaintext bytes are guessed.
+- `padding_oracle_attack_block_batched`, the single-block attack using a batch oracle and the frequency order.
+- `padding_oracle_attack_parallel`, which attacks all blocks in a thread pool and reports how many queries, round trips and how much time waiting for the oracle the attack needed.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Bytes that typically appear in cookies and text, most common first
+COMMON_PLAINTEXT_BYTES = (
+    b' etaoinsrhldcumfpgwybvkxjqz"ETAOINSRHLDCUMFPGWYBVKXJQZ:,{}0123456789_-.@=&/'
+)
+
+
+class OracleStats:
+    """Thread-safe counters describing how an attack used the oracle."""
+
+    def __init__(self):
+        self.queries = 0  # Ciphertexts checked
+        self.batches = 0  # Calls to the batch oracle (round trips)
+        self.latency = 0.0  # Total seconds spent waiting for the oracle
+        self._lock = threading.Lock()
+
+    def record(self, queries: int, latency: float) -> None:
+        with self._lock:
+            self.queries += queries
+            self.batches += 1
+            self.latency += latency
+
+    def __str__(self) -> str:
+        mean = self.latency / self.batches if self.batches else 0.0
+        return (
+            f"{self.queries} queries in {self.batches} batches, "
+            f"{self.latency:.3f}s waiting for the oracle ({mean * 1000:.2f}ms per batch)"
+        )
+
+
+def plaintext_byte_order(last_block: bool) -> list[int]:
+    """
+    Return all 256 byte values in the order in which they should be guessed.
+
+    Args:
+        last_block: Whether the block contains the PKCS#7 padding
+
+    Returns:
+        Permutation of range(256), most likely plaintext bytes first
+    """
+    if "SOLUTION":
+        preferred = list(COMMON_PLAINTEXT_BYTES)
+        if last_block:
+            preferred = list(range(1, 17)) + preferred
+        order = list(dict.fromkeys(preferred))
+        seen = set(order)
+        return order + [b for b in range(256) if b not in seen]
+    else:
+        # TODO: Implement plaintext_byte_order
+        # - Start with COMMON_PLAINTEXT_BYTES, preceded by the padding values 1..16 for the last block
+        # - Append all remaining byte values so that every value appears exactly once
+        pass
+
+
+def padding_oracle_attack_block_batched(
+    batch_oracle: Callable[[list[bytes]], list[bool]],
+    iv: bytes,
+    block: bytes,
+    last_block: bool = False,
+    batch_size: int = 16,
+) -> bytes:
+    """
+    Decrypt a single block, querying candidates in batches and in order of likelihood.
+
+    Args:
+        batch_oracle: Checks a list of IV||block ciphertexts, returns one boolean per ciphertext
+        iv: The IV or previous ciphertext block (16 bytes)
+        block: The ciphertext block to decrypt (16 bytes)
+        last_block: Whether the block contains the PKCS#7 padding
+        batch_size: Number of candidates sent to the oracle at once
+
+    Returns:
+        Decrypted plaintext block (16 bytes)
+    """
+    order = plaintext_byte_order(last_block)
+    if "SOLUTION":
+        intermediate = bytearray(16)
+        for position in range(15, -1, -1):
+            padding_value = 16 - position
+            modified_iv = bytearray(16)
+            for j in range(position + 1, 16):
+                modified_iv[j] = intermediate[j] ^ padding_value
+
+            # Guessing plaintext byte p means trying IV byte p ⊕ iv[position] ⊕ padding_value
+            candidates = [p ^ iv[position] ^ padding_value for p in order]
+            found = None
+            for start in range(0, 256, batch_size):
+                batch = candidates[start : start + batch_size]
+                queries = []
+                for candidate in batch:
+                    modified_iv[position] = candidate
+                    queries.append(bytes(modified_iv) + block)
+                hits = [c for c, ok in zip(batch, batch_oracle(queries)) if ok]
+                if position == 15 and hits:
+                    # Rule out plaintexts ending in \x02\x02, \x03\x03\x03, ...
+                    confirm = []
+                    for candidate in hits:
+                        modified_iv[15] = candidate
+                        modified_iv[14] ^= 0xFF
+                        confirm.append(bytes(modified_iv) + block)
+                        modified_iv[14] ^= 0xFF
+                    hits = [c for c, ok in zip(hits, batch_oracle(confirm)) if ok]
+                if hits:
+                    found = hits[0]
+                    break
+
+            if found is None:
+                raise ValueError(
+                    f"Failed to find valid padding for position {position}"
+                )
+            intermediate[position] = found ^ padding_value
+
+        return bytes(x ^ y for x, y in zip(intermediate, iv))
+    else:
+        # TODO: Implement the batched single-block attack
+        # - Same structure as padding_oracle_attack_block
+        # - Turn the guessed plaintext bytes into candidate IV bytes, query them batch_size at a time
+        # - For position 15, confirm each hit by changing modified_iv[14] and querying again
+        pass
+
+
+def padding_oracle_attack_parallel(
+    batch_oracle: Callable[[list[bytes]], list[bool]],
+    ciphertext: bytes,
+    workers: int = 8,
+    batch_size: int = 16,
+) -> tuple[bytes, OracleStats]:
+    """
+    Decrypt a CBC-encrypted message, attacking all blocks concurrently.
+
+    Args:
+        batch_oracle: Checks a list of ciphertexts, returns one boolean per ciphertext
+        ciphertext: IV || Ciphertext (at least 32 bytes)
+        workers: Number of blocks attacked at the same time
+        batch_size: Number of candidates sent to the oracle at once
+
+    Returns:
+        (plaintext with padding removed, statistics about the oracle usage)
+    """
+    stats = OracleStats()
+
+    def timed_oracle(queries: list[bytes]) -> list[bool]:
+        start = time.perf_counter()
+        result = batch_oracle(queries)
+        stats.record(len(queries), time.perf_counter() - start)
+        return result
+
+    if "SOLUTION":
+        blocks = [ciphertext[i : i + 16] for i in range(0, len(ciphertext), 16)]
+
+        def attack(i: int) -> bytes:
+            return padding_oracle_attack_block_batched(
+                timed_oracle, blocks[i - 1], blocks[i], i == len(blocks) - 1, batch_size
+            )
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            plaintext = b"".join(pool.map(attack, range(1, len(blocks))))
+        return remove_pkcs7_padding(plaintext), stats
+    else:
+        # TODO: Implement the parallel attack
+        # - Split the ciphertext into blocks
+        # - Attack blocks 1..n-1 in a ThreadPoolExecutor, passing timed_oracle so that stats are collected
+        # - Join the plaintext blocks in order and remove the padding
+        pass
+
+
+@report
+def test_padding_oracle_attack_parallel(
+    padding_oracle_attack_parallel, plaintext_byte_order, cbc_encrypt
+):
+    """Recover messages through a batch oracle and compare the number of queries."""
+    secret_key = b"YELLOW SUBMARINE"
+    cipher = AES.new(secret_key, AES.MODE_ECB)
+
+    def batch_oracle(ciphertexts):
+        results = []
+        for ciphertext in ciphertexts:
+            intermediary = cipher.decrypt(ciphertext[16:])
+            plaintext = bytes(x ^ y for x, y in zip(intermediary, ciphertext[:16]))
+            n = plaintext[-1]
+            results.append(1 <= n <= 16 and plaintext[-n:] == bytes([n]) * n)
+        return results
+
+    for last_block in [False, True]:
+        assert sorted(plaintext_byte_order(last_block)) == list(range(256))
+    assert plaintext_byte_order(True)[0] == 1
+
+    iv = b"\x01\xf0\x00\x03\x02\x30\x04\x50\x06\x70\x08\x09\x10\x11\x23\x48"
+    for original in [
+        b"The magic words are squeamish ossifrage",
+        b"A" * 14 + b"\x02\x7f" + b'{"admin": "true"}',  # Invites a false positive
+        b"exactly 16 bytes",
+    ]:
+        ciphertext = iv + cbc_encrypt(original, secret_key, iv)
+        recovered, stats = padding_oracle_attack_parallel(
+            batch_oracle, ciphertext, workers=4
+        )
+        assert recovered == original, f"Failed to recover {original!r}: {recovered!r}"
+        print(f"Recovered {recovered!r} with {stats}")
+
+    # The sequential attack needs 5810 queries for the first message
+    ciphertext = iv + cbc_encrypt(
+        b"The magic words are squeamish ossifrage", secret_key, iv
+    )
+    _, stats = padding_oracle_attack_parallel(batch_oracle, ciphertext, batch_size=8)
+    assert stats.queries < 2000, (
+        f"Frequency ordering should need far fewer queries, got {stats.queries}"
+    )
+    assert stats.batches < stats.queries / 4, "Queries should be sent in batches"
+
+
+test_padding_oracle_attack_parallel(
+    padding_oracle_attack_parallel, plaintext_byte_order, cbc_encrypt
+)
+
+# %%
+"""
+To see the effect of concurrency, let's simulate a server with a fixed round-trip time:
+"""
+
+
+def benchmark_padding_oracle_attack(round_trip: float = 0.0002) -> None:
+    """Compare the sequential and the parallel attack against a slow oracle."""
+    key = secrets.token_bytes(16)
+    iv = secrets.token_bytes(16)
+    ciphertext = iv + cbc_encrypt(
+        json.dumps({"admin": "false"}).encode(),
+        key,
+        iv,
+    )
+
+    def check(ciphertext: bytes) -> bool:
+        try:
+            cbc_decrypt(ciphertext[16:], key, ciphertext[:16])
+            return True
+        except InvalidPaddingError:
+            return False
+
+    def slow_oracle(ciphertext: bytes) -> bool:
+        time.sleep(round_trip)
+        return check(ciphertext)
+
+    def slow_batch_oracle(ciphertexts: list[bytes]) -> list[bool]:
+        time.sleep(round_trip)
+        return [check(c) for c in ciphertexts]
+
+    start = time.perf_counter()
+    expected = padding_oracle_attack(slow_oracle, ciphertext)
+    slow_time = time.perf_counter() - start
+    start = time.perf_counter()
+    recovered, stats = padding_oracle_attack_parallel(slow_batch_oracle, ciphertext)
+    fast_time = time.perf_counter() - start
+    assert recovered == expected
+    print(f"Sequential attack: {slow_time:.2f}s")
+    print(f"Parallel attack:   {fast_time:.2f}s, {stats}")
+
+
+if __name__ == "__main__":
+    benchmark_padding_oracle_attack()
+
+# %%
+"""
+### Exercise 4.5: A Reusable CBC Context
+
+> **Difficulty**: 🔴🔴🔴⚪⚪
+> **Importance**: 🔵🔵⚪⚪⚪
+>
+> You should spend up to ~25 minutes on this exercise.
+
+The padding oracle attack hammers the server with thousands of requests, and every one of them goes through `cbc_decrypt`. It creates a new `AES` object for every block (expanding the key each time), XORs through a Python generator byte by byte, and grows the plaintext with `+=`. The padding functions copy the whole message once more.
+
+Notice in the CBC diagram that decryption, unlike encryption, does not have to go block by block: `P[i] = D(C[i]) ⊕ C[i-1]`, and all the `C[i]` are known in advance. So we can:
+- Create the cipher object once per key and keep it.
+- Decrypt all blocks with a **single ECB call** - the C library loops over the blocks for us.
+- XOR the result with `IV || C[0] || ... || C[n-2]` in one go by converting both to (very large) Python integers with `int.from_bytes`, instead of one byte at a time.
+- Pad and unpad **in place**: padding extends a `bytearray`, and unpadding returns a `memoryview` of the data without the padding instead of copying it.
+
+Encryption remains sequential because each block needs the previous ciphertext block, but it still benefits from the cached cipher object and integer XOR.
+
+Implement the in-place padding functions and the `CBCContext` class. They must accept and reject exactly the same inputs as the functions you wrote earlier. `FastVulnerableServer` then uses the context for its cookies.
+"""
+
+
+def add_pkcs7_padding_inplace(buffer: bytearray, block_size: int = 16) -> bytearray:
+    """Append PKCS#7 padding to buffer and return it."""
+    if "SOLUTION":
+        padding_length = block_size - (len(buffer) % block_size)
+        buffer += bytes([padding_length]) * padding_length
+        return buffer
+    else:
+        # TODO: Extend buffer with the padding (no new buffer for the data)
+        pass
+
+
+def remove_pkcs7_padding_inplace(
+    buffer: bytearray | memoryview, block_size: int = 16
+) -> memoryview:
+    """
+    Validate PKCS#7 padding without copying the data.
+
+    Args:
+        buffer: The padded data
+        block_size: The cipher block size
+
+    Returns:
+        A memoryview of buffer without the padding
+
+    Raises:
+        InvalidPaddingError: If padding is invalid
+    """
+    if "SOLUTION":
+        view = memoryview(buffer)
+        if len(view) == 0:
+            raise InvalidPaddingError("Empty input")
+        padding_length = view[-1]
+        if padding_length < 1 or padding_length > block_size:
+            raise InvalidPaddingError(f"Invalid padding length: {padding_length}")
+        if len(view) < padding_length:
+            raise InvalidPaddingError("Padding length exceeds data length")
+        if view[-padding_length:] != bytes([padding_length]) * padding_length:
+            raise InvalidPaddingError("Inconsistent padding bytes")
+        return view[:-padding_length]
+    else:
+        # TODO: Implement the same checks as remove_pkcs7_padding
+        # - Compare all padding bytes at once with a slice
+        # - Return a slice of a memoryview instead of a copy
+        pass
+
+
+class CBCContext:
+    """AES-CBC with PKCS#7 padding, reusing one cipher object for a key."""
+
+    def __init__(self, key: bytes):
+        if "SOLUTION":
+            self._ecb = AES.new(key, AES.MODE_ECB)
+        else:
+            # TODO: Create the AES object once
+            pass
+
+    def encrypt(self, plaintext: bytes, iv: bytes) -> bytes:
+        """Pad and encrypt plaintext, like cbc_encrypt."""
+        if "SOLUTION":
+            padded = add_pkcs7_padding_inplace(bytearray(plaintext))
+            previous = int.from_bytes(iv, "big")
+            for i in range(0, len(padded), 16):
+                block = int.from_bytes(padded[i : i + 16], "big") ^ previous
+                encrypted = self._ecb.encrypt(block.to_bytes(16, "big"))
+                padded[i : i + 16] = encrypted  # Same size, so this does not reallocate
+                previous = int.from_bytes(encrypted, "big")
+            return bytes(padded)
+        else:
+            # TODO: Implement encrypt
+            # - Pad a bytearray copy of the plaintext in place
+            # - Chain the blocks, XORing them as 128-bit integers
+            pass
+
+    def decrypt(self, ciphertext: bytes, iv: bytes) -> memoryview:
+        """
+        Decrypt ciphertext and remove the padding, like cbc_decrypt.
+
+        Returns:
+            A memoryview of the plaintext without padding
+
+        Raises:
+            InvalidPaddingError: If padding is invalid
+        """
+        if "SOLUTION":
+            if not ciphertext or len(ciphertext) % 16:
+                raise InvalidPaddingError("Ciphertext is not a whole number of blocks")
+            intermediate = self._ecb.decrypt(ciphertext)
+            previous = iv + ciphertext[:-16]
+            plaintext = int.from_bytes(intermediate, "big") ^ int.from_bytes(
+                previous, "big"
+            )
+            return remove_pkcs7_padding_inplace(
+                bytearray(plaintext.to_bytes(len(ciphertext), "big"))
+            )
+        else:
+            # TODO: Implement decrypt
+            # - Raise InvalidPaddingError unless the ciphertext is a non-empty whole number of blocks
+            # - Decrypt all blocks with a single ECB call
+            # - XOR with IV || all ciphertext blocks but the last one, as integers
+            # - Remove the padding in place
+            pass
+
+
+class FastVulnerableServer(VulnerableServer):
+    """VulnerableServer that keeps one CBCContext for its key."""
+
+    def __init__(self, key: bytes = None):
+        super().__init__(key)
+        self.cbc = CBCContext(self.key)
+
+    def encrypt_cookie(self, cookie_content: dict[str, str]) -> bytes:
+        """Encrypt a cookie value."""
+        iv = secrets.token_bytes(16)
+        return iv + self.cbc.encrypt(json.dumps(cookie_content).encode(), iv)
+
+    def decrypt_cookie(
+        self, cookie: bytes
+    ) -> Tuple[Literal[False], str] | Tuple[Literal[True], dict[str, str]]:
+        """Decrypt and validate a cookie, with the same results as VulnerableServer."""
+        if len(cookie) < 32 or len(cookie) % 16:
+            return False, "INVALID_COOKIE"  # cbc_decrypt fails on partial blocks before checking the padding
+        try:
+            plaintext = self.cbc.decrypt(cookie[16:], cookie[:16])
+            return True, json.loads(str(plaintext, "utf-8"))
+        except InvalidPaddingError:
+            return False, "PADDING_ERROR"
+        except Exception:
+            return False, "INVALID_COOKIE"
+
+
+@report
+def test_cbc_context(
+    CBCContext,
+    VulnerableServer,
+    FastVulnerableServer,
+    add_pkcs7_padding_inplace,
+    remove_pkcs7_padding_inplace,
+    cbc_encrypt,
+    cbc_decrypt,
+    InvalidPaddingError,
+):
+    """Compare CBCContext and the in-place padding with the reference functions."""
+    key = b"YELLOW SUBMARINE"
+    iv = bytes(range(16))
+    context = CBCContext(key)
+    for length in [0, 1, 15, 16, 17, 100, 1000]:
+        plaintext = os.urandom(length)
+        ciphertext = context.encrypt(plaintext, iv)
+        assert ciphertext == cbc_encrypt(plaintext, key, iv), (
+            f"Wrong ciphertext for {length} bytes"
+        )
+        assert context.decrypt(ciphertext, iv) == plaintext
+        assert cbc_decrypt(ciphertext, key, iv) == plaintext
+
+        buffer = bytearray(plaintext)
+        assert add_pkcs7_padding_inplace(buffer) is buffer, (
+            "Padding should extend the buffer"
+        )
+        assert (
+            len(buffer) % 16 == 0 and remove_pkcs7_padding_inplace(buffer) == plaintext
+        )
+
+    padded = bytearray(b"hello" + b"\x0b" * 11)
+    view = remove_pkcs7_padding_inplace(memoryview(padded))
+    assert isinstance(view, memoryview) and view.obj is padded, (
+        "Unpadding should not copy"
+    )
+    for bad in [
+        b"",
+        b"hello" + b"\x00",
+        b"hello" + b"\x11" * 17,
+        b"\x03" * 2,
+        b"hello" + b"\x01\x03\x03",
+    ]:
+        try:
+            remove_pkcs7_padding_inplace(bytearray(bad))
+            assert False, f"Should reject padding of {bad!r}"
+        except InvalidPaddingError:
+            pass
+    for bad in [b"", b"x" * 15, b"x" * 17]:
+        for error_iv in [iv, bytes(16)]:
+            try:
+                context.decrypt(bad, error_iv)
+                assert False, f"Should reject a {len(bad)}-byte ciphertext"
+            except InvalidPaddingError:
+                pass
+
+    reference = VulnerableServer(key)
+    server = FastVulnerableServer(key)
+    cookie = reference.encrypt_cookie(
+        {"admin": "false", "user_email": "bob@example.com"}
+    )
+    for tampered in [
+        cookie,
+        server.encrypt_cookie({"admin": "true"}),
+        cookie[:-1] + bytes([cookie[-1] ^ 1]),  # Padding error
+        cookie[:20],  # Too short
+        cookie[:-5],  # Not a whole number of blocks
+        cookie[:16] + cbc_encrypt(b"not json", key, cookie[:16]),
+    ]:
+        assert server.decrypt_cookie(tampered) == reference.decrypt_cookie(tampered)
+
+
+test_cbc_context(
+    CBCContext,
+    VulnerableServer,
+    FastVulnerableServer,
+    add_pkcs7_padding_inplace,
+    remove_pkcs7_padding_inplace,
+    cbc_encrypt,
+    cbc_decrypt,
+    InvalidPaddingError,
+)
+
+# %%
+"""
+How many cookies per second can each server check, and how fast is bulk decryption?
+"""
+
+
+def benchmark_cbc_context(n_cookies: int = 2000, n_bytes: int = 1 << 20) -> None:
+    """Compare VulnerableServer with FastVulnerableServer and cbc_decrypt with CBCContext."""
+    key = secrets.token_bytes(16)
+    cookie = VulnerableServer(key).encrypt_cookie(
+        {"admin": "false", "user_email": "bob@example.com"}
+    )
+    for server in [VulnerableServer(key), FastVulnerableServer(key)]:
+        start = time.perf_counter()
+        for _ in range(n_cookies):
+            server.decrypt_cookie(cookie)
+        elapsed = time.perf_counter() - start
+        print(f"{type(server).__name__:>20}: {n_cookies / elapsed:10,.0f} cookies/s")
+
+    iv = secrets.token_bytes(16)
+    plaintext = os.urandom(n_bytes)
+    context = CBCContext(key)
+    ciphertext = context.encrypt(plaintext, iv)
+    sample = ciphertext[: len(ciphertext) // 64 // 16 * 16]
+    start = time.perf_counter()
+    try:
+        cbc_decrypt(sample, key, iv)
+    except InvalidPaddingError:
+        pass  # The sample is cut in the middle of the message
+    slow_time = (time.perf_counter() - start) * len(ciphertext) / len(sample)
+    start = time.perf_counter()
+    assert context.decrypt(ciphertext, iv) == plaintext
+    fast_time = time.perf_counter() - start
+    print(
+        f"Decrypting {n_bytes:,} bytes: {slow_time:.2f}s (estimated) -> "
+        f"{fast_time:.4f}s ({slow_time / fast_time:.0f}x faster)"
+    )
+
+
+if __name__ == "__main__":
+    benchmark_cbc_context()
+
+# %%
+"""
+### Exercise 4.6: Fast RSA with Block Packing and the Chinese Remainder Theorem
+
+> **Difficulty**: 🔴🔴🔴⚪⚪
+> **Importance**: 🔵🔵🔵⚪⚪
+>
+> You should spend up to ~30 minutes on this exercise.
+
+Our RSA functions perform one full modular exponentiation per byte of the message. That was convenient with 16-bit keys, but with a 2048-bit modulus each byte becomes a 2048-bit number, and a 100-character message needs 100 expensive exponentiations to carry 100 bytes. Two standard techniques fix this:
+
+**Block packing.** A modulus of `k` bits can hold `(k - 1) // 8` whole bytes in one integer smaller than `n`. We split the message into blocks of that size, so a 2048-bit key encrypts 255 bytes per exponentiation. To be able to tell where the message ends, we append a `0x80` byte and fill the last block with zero bytes (this is called ISO/IEC 7816-4 padding); unpacking strips the zeros and the marker.
+
+**The Chinese Remainder Theorem (CRT).** Decryption and signing use the large private exponent `d`. Because the key owner knows `p` and `q`, they can instead compute the result modulo each prime with exponents half the size, and combine the two halves:
+```
+dP = d mod (p - 1),   dQ = d mod (q - 1),   qInv = q⁻¹ mod p
+
+m1 = c^dP mod p
+m2 = c^dQ mod q
+h  = qInv × (m1 - m2) mod p
+m  = m2 + h × q
+```
+Exponentiation cost grows roughly with the cube of the number size, so two half-size exponentiations are about 4 times cheaper than one full-size exponentiation. That's why real RSA private keys (for example in the PKCS#1 format) store `p`, `q`, `dP`, `dQ` and `qInv` next to `n` and `d`.
+
+<details>
+<summary>Why does this not make textbook RSA secure?</summary>
+
+Packing removes the worst problem of the per-byte scheme - that every byte value always encrypts to the same ciphertext, which makes it a simple substitution cipher - but the scheme is still deterministic: the same message always gives the same ciphertext, and RSA's multiplicative structure is still exposed. Real systems use randomized padding like OAEP for encryption and PSS for signatures.
+
+</details>
+
+Implement the block packing functions and the CRT private operation of `RSAKey`. The remaining methods, including the bulk methods that process lists of messages, are provided.
+"""
+
+
+def pack_blocks(data: bytes, block_size: int) -> List[int]:
+    """
+    Split data into integers of block_size bytes, after ISO/IEC 7816-4 padding.
+
+    Args:
+        data: Message bytes
+        block_size: Number of bytes per block
+
+    Returns:
+        List of integers, each smaller than 256**block_size
+    """
+    if "SOLUTION":
+        padded = data + b"\x80"
+        padded += b"\x00" * (-len(padded) % block_size)
+        return [
+            int.from_bytes(padded[i : i + block_size], "big")
+            for i in range(0, len(padded), block_size)
+        ]
+    else:
+        # TODO: Implement pack_blocks
+        # - Append 0x80 and zero bytes up to a multiple of block_size
+        # - Convert each block with int.from_bytes(..., "big")
+        pass
+
+
+def unpack_blocks(blocks: List[int], block_size: int) -> bytes:
+    """
+    Inverse of pack_blocks.
+
+    Raises:
+        ValueError: If a block does not fit in block_size bytes or the padding is invalid
+    """
+    if "SOLUTION":
+        if any(not 0 <= block < 256**block_size for block in blocks):
+            raise ValueError("Block does not fit in block_size bytes")
+        padded = b"".join(block.to_bytes(block_size, "big") for block in blocks)
+        data = padded.rstrip(b"\x00")
+        if not data.endswith(b"\x80") or len(padded) - len(data) >= block_size:
+            raise ValueError("Invalid block padding")
+        return data[:-1]
+    else:
+        # TODO: Implement unpack_blocks
+        # - Check that every block fits in block_size bytes
+        # - Convert each block back with to_bytes(block_size, "big")
+        # - Strip the zero bytes and check for the 0x80 marker
+        pass
+
+
+class RSAKey:
+    """RSA key pair that keeps the CRT parameters of the private key."""
+
+    def __init__(self, p: int, q: int, e: int = 65537):
+        assert p != q, "The primes must be distinct"
+        phi = (p - 1) * (q - 1)
+        if math.gcd(e, phi) != 1:
+            e = 3
+            while math.gcd(e, phi) != 1:
+                e += 2
+        self.p, self.q, self.e = p, q, e
+        self.n = p * q
+        self.d = pow(e, -1, phi)
+        self.dP = self.d % (p - 1)
+        self.dQ = self.d % (q - 1)
+        self.qInv = pow(q, -1, p)
+        self.block_size = (self.n.bit_length() - 1) // 8
+        assert self.block_size > 0, "The modulus is too small to hold a byte"
+
+    @classmethod
+    def generate(
+        cls,
+        bits: int = 1024,
+        rng: random.Random | None = None,
+        prime_generator: Callable[[int, random.Random], int] = get_prime,
+    ) -> "RSAKey":
+        """Generate a key with a modulus of about the given bit length."""
+        rng = rng or random.Random()
+        p = prime_generator(bits // 2, rng)
+        q = prime_generator(bits // 2, rng)
+        while p == q:
+            q = prime_generator(bits // 2, rng)
+        return cls(p, q)
+
+    @property
+    def public_key(self) -> Tuple[int, int]:
+        return self.n, self.e
+
+    @property
+    def private_key(self) -> Tuple[int, int]:
+        return self.n, self.d
+
+    def private_op(self, c: int) -> int:
+        """Compute c^d mod n using the CRT parameters."""
+        if "SOLUTION":
+            m1 = pow(c, self.dP, self.p)
+            m2 = pow(c, self.dQ, self.q)
+            h = self.qInv * (m1 - m2) % self.p
+            return m2 + h * self.q
+        else:
+            # TODO: Implement the CRT private operation using the formulas above
+            pass
+
+    def encrypt(self, message: str) -> List[int]:
+        """Encrypt a UTF-8 string, one block per exponentiation."""
+        n, e = self.n, self.e
+        return [
+            pow(m, e, n) for m in pack_blocks(message.encode("utf-8"), self.block_size)
+        ]
+
+    def decrypt(self, ciphertext: List[int]) -> str:
+        """Decrypt a list of blocks produced by encrypt."""
+        blocks = [self.private_op(c) for c in ciphertext]
+        return unpack_blocks(blocks, self.block_size).decode("utf-8")
+
+    def sign(self, message: str) -> List[int]:
+        """Sign a UTF-8 message, one block per exponentiation."""
+        return [
+            self.private_op(m)
+            for m in pack_blocks(message.encode("utf-8"), self.block_size)
+        ]
+
+    def verify(self, message: str, signature: List[int]) -> bool:
+        """Verify a signature produced by sign."""
+        n, e = self.n, self.e
+        if any(not 0 <= s < n for s in signature):
+            return False
+        try:
+            recovered = unpack_blocks(
+                [pow(s, e, n) for s in signature], self.block_size
+            )
+        except ValueError:
+            return False
+        return recovered == message.encode("utf-8")
+
+    def encrypt_many(self, messages: List[str]) -> List[List[int]]:
+        return [self.encrypt(message) for message in messages]
+
+    def decrypt_many(self, ciphertexts: List[List[int]]) -> List[str]:
+        return [self.decrypt(ciphertext) for ciphertext in ciphertexts]
+
+    def sign_many(self, messages: List[str]) -> List[List[int]]:
+        return [self.sign(message) for message in messages]
+
+    def verify_many(
+        self, messages: List[str], signatures: List[List[int]]
+    ) -> List[bool]:
+        return [self.verify(m, s) for m, s in zip(messages, signatures, strict=True)]
+
+
+@report
+def test_rsa_key(RSAKey, pack_blocks, unpack_blocks, decrypt_rsa):
+    """Check packing, CRT decryption and signatures of RSAKey."""
+    for block_size in [1, 2, 7, 16]:
+        for data in [b"", b"\x00", b"\x00\x80\x00", b"x" * block_size, os.urandom(50)]:
+            blocks = pack_blocks(data, block_size)
+            assert all(0 <= b < 256**block_size for b in blocks)
+            assert unpack_blocks(blocks, block_size) == data, (
+                f"Roundtrip failed for {data!r}"
+            )
+    for bad in [[0], [256], [0x80, 0]]:
+        try:
+            unpack_blocks(bad, 1)
+            assert False, f"Should reject {bad}"
+        except ValueError:
+            pass
+
+    rng = random.Random(3)
+    for bits in [16, 64, 512]:
+        key = RSAKey.generate(bits, rng)
+        for c in [0, 1, 2, 12345 % key.n, key.n - 1]:
+            assert key.private_op(c) == pow(c, key.d, key.n), (
+                "CRT result differs from c^d mod n"
+            )
+
+        messages = [
+            "",
+            "Hi",
+            "RSA 🔐 with CRT",
+            "A longer message that spans several blocks. " * 3,
+        ]
+        ciphertexts = key.encrypt_many(messages)
+        assert key.decrypt_many(ciphertexts) == messages
+        signatures = key.sign_many(messages)
+        assert key.verify_many(messages, signatures) == [True] * len(messages)
+        tampered = [signatures[1][:-1] + [(signatures[1][-1] + 1) % key.n]]
+        assert key.verify_many([messages[1]], tampered) == [False]
+        assert not key.verify(messages[2], signatures[3])
+
+    # The private exponent is a regular RSA private key
+    key = RSAKey(61, 53)
+    assert key.private_key == (3233, pow(key.e, -1, 60 * 52))
+    encrypted = [pow(b, key.e, key.n) for b in b"textbook"]
+    assert decrypt_rsa(key.private_key, encrypted) == "textbook"
+
+    # e must be coprime to phi, not just not divide it: 3 divides phi = 100 * 102, 9 doesn't
+    key = RSAKey(101, 103, e=9)
+    assert math.gcd(key.e, 100 * 102) == 1, f"e={key.e} is not coprime to phi"
+    assert key.decrypt(key.encrypt("ok")) == "ok"
+
+
+test_rsa_key(RSAKey, pack_blocks, unpack_blocks, decrypt_rsa)
+
+# %%
+"""
+Let's compare the per-byte functions with `RSAKey` for increasing key sizes:
+"""
+
+
+def benchmark_rsa_key(
+    bit_sizes: List[int] | None = None, message_length: int = 64
+) -> None:
+    """Time decrypting a message per byte and with RSAKey."""
+    bit_sizes = bit_sizes or [16, 64, 256, 1024, 2048]
+    message = "".join(random.choices("abcdefghijklmnopqrstuvwxyz ", k=message_length))
+    for bits in bit_sizes:
+        key = RSAKey.generate(bits)
+        ciphertext = encrypt_rsa(key.public_key, message)
+        start = time.perf_counter()
+        assert decrypt_rsa(key.private_key, ciphertext) == message
+        slow_time = time.perf_counter() - start
+
+        ciphertext = key.encrypt(message)
+        start = time.perf_counter()
+        assert key.decrypt(ciphertext) == message
+        fast_time = time.perf_counter() - start
+        print(
+            f"{bits:>5}-bit modulus: {slow_time * 1000:9.2f}ms -> {fast_time * 1000:7.2f}ms "
+            f"({slow_time / fast_time:.0f}x faster)"
+        )
+
+
+if __name__ == "__main__":
+    benchmark_rsa_key()
+
+# %%
+"""
+### Exercise 4.7: Fast Prime Generation
+
+> **Difficulty**: 🔴🔴🔴⚪⚪
+> **Importance**: 🔵🔵⚪⚪⚪
+>
+> You should spend up to ~30 minutes on this exercise.
+
+After the previous exercise, generating the key is the slowest part of RSA. `get_prime` draws a fresh random odd number and runs Miller-Rabin on it until one passes. By the prime number theorem, only about one in `ln(2^bits) / 2` odd numbers is prime - for 1024-bit primes that's one in ~355 - and each rejected candidate costs at least one full modular exponentiation.
+
+Most candidates have a small factor: about 88% of odd numbers are divisible by a prime below 2048. Finding that out should cost a few machine operations, not an exponentiation. We use three techniques:
+
+- **Incremental search with a sieve.** Instead of drawing a new random number each time, pick a random odd `start` and scan `start, start + 2, start + 4, ...`. For each small prime `p`, the offsets `k` with `p | start + 2k` form an arithmetic progression: `k ≡ -start × 2⁻¹ (mod p)`, then every `p`-th offset. So we can cross out all multiples of `p` in a window of offsets with a single slice assignment to a `bytearray`, just like the sieve of Eratosthenes, and only run Miller-Rabin on the survivors. (This makes primes that follow long gaps between primes slightly more likely to be chosen; that small bias is considered harmless and real libraries have used this approach for a long time.)
+- **Deterministic witnesses for small numbers.** Miller-Rabin with random bases is probabilistic, but for numbers below 3,317,044,064,679,887,385,961,981 (about 2^81) it's known that testing the bases 2, 3, 5, ..., 41 gives an exact answer. There's no need for randomness - or for the global `random` module - in that range.
+- **Parallel pools.** Prime search is embarrassingly parallel. When many primes are needed (for example to pre-generate keys for a test suite), worker processes can each search independently with their own random generator.
+
+Implement `is_probable_prime_fast` and `get_prime_fast`. `generate_prime_pool` and the small-prime table are provided.
+"""
+import itertools
+import multiprocessing
+
+
+def small_primes(limit: int) -> List[int]:
+    """Return all primes below limit using the sieve of Eratosthenes."""
+    sieve = bytearray([1]) * limit
+    sieve[:2] = b"\x00\x00"
+    for i in range(2, int(limit**0.5) + 1):
+        if sieve[i]:
+            sieve[i * i :: i] = bytes(len(range(i * i, limit, i)))
+    return list(itertools.compress(range(limit), sieve))
+
+
+SMALL_PRIMES = small_primes(2048)
+
+# Testing these bases is exact for all n below MILLER_RABIN_DETERMINISTIC_LIMIT
+MILLER_RABIN_DETERMINISTIC_BASES = (2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37, 41)
+MILLER_RABIN_DETERMINISTIC_LIMIT = 3_317_044_064_679_887_385_961_981
+
+
+def is_probable_prime_fast(
+    n: int, rng: random.Random | None = None, rounds: int = 5
+) -> bool:
+    """
+    Miller-Rabin test with trial division and deterministic bases for small n.
+
+    Args:
+        n: Number to test
+        rng: Source of random bases for large n
+        rounds: Number of random bases for large n
+
+    Returns:
+        True if n is (probably) prime; exact for n < MILLER_RABIN_DETERMINISTIC_LIMIT
+    """
+    if "SOLUTION":
+        if n < 2:
+            return False
+        for p in SMALL_PRIMES:
+            if n % p == 0:
+                return n == p
+        if n < SMALL_PRIMES[-1] ** 2:
+            return True
+
+        s = 0
+        d = n - 1
+        while d % 2 == 0:
+            d //= 2
+            s += 1
+
+        if n < MILLER_RABIN_DETERMINISTIC_LIMIT:
+            bases = MILLER_RABIN_DETERMINISTIC_BASES
+        else:
+            rng = rng or random.Random()
+            bases = [rng.randrange(2, n - 1) for _ in range(rounds)]
+
+        for a in bases:
+            x = pow(a, d, n)
+            if x in (1, n - 1):
+                continue
+            for _ in range(s - 1):
+                x = pow(x, 2, n)
+                if x == n - 1:
+                    break
+            else:
+                return False
+        return True
+    else:
+        # TODO: Implement is_probable_prime_fast
+        # - Trial divide by SMALL_PRIMES (careful: n itself may be one of them)
+        # - Use MILLER_RABIN_DETERMINISTIC_BASES below the limit, random bases from rng above it
+        # - The Miller-Rabin loop itself is the same as in _is_probable_prime
+        pass
+
+
+def get_prime_fast(
+    bits: int, rng: random.Random | None = None, window: int = 2048
+) -> int:
+    """
+    Find a random prime with exactly the given number of bits.
+
+    Args:
+        bits: Bit length of the prime (at least 2)
+        rng: Source of randomness
+        window: Number of consecutive odd candidates sieved at once
+
+    Returns:
+        A (probable) prime p with p.bit_length() == bits
+    """
+    assert bits >= 2, "There are no 1-bit primes"
+    rng = rng or random.Random()
+    if "SOLUTION":
+        limit = 1 << bits
+        while True:
+            start = rng.getrandbits(bits) | (1 << (bits - 1)) | 1
+            count = min(window, (limit - 1 - start) // 2 + 1)
+
+            # sieve[k] == 0 means start + 2k has a small factor
+            sieve = bytearray([1]) * count
+            for p in SMALL_PRIMES[1:]:
+                if p >= start:
+                    break
+                first = (
+                    -start * ((p + 1) // 2) % p
+                )  # (p + 1) // 2 is the inverse of 2 mod p
+                sieve[first::p] = bytes(len(range(first, count, p)))
+
+            for k in itertools.compress(range(count), sieve):
+                candidate = start + 2 * k
+                if is_probable_prime_fast(candidate, rng):
+                    return candidate
+            # No prime in this window (or we reached 2^bits), start somewhere else
+    else:
+        # TODO: Implement get_prime_fast
+        # - Pick a random odd start with the top bit set
+        # - Sieve a window of odd offsets: for each odd small prime p < start,
+        #   zero sieve[first::p] where first = -start * inverse_of_2_mod_p % p
+        # - Test the survivors in order with is_probable_prime_fast
+        # - Don't let candidates exceed `bits` bits
+        pass
+
+
+def _prime_pool_worker(task: tuple[int, int]) -> int:
+    bits, seed = task
+    return get_prime_fast(bits, random.Random(seed))
+
+
+def generate_prime_pool(bits: int, count: int, workers: int | None = None) -> List[int]:
+    """
+    Generate count distinct primes of the given size in parallel worker processes.
+
+    Args:
+        bits: Bit length of each prime
+        count: Number of distinct primes
+        workers: Number of processes (default: number of CPUs)
+
+    Returns:
+        List of count distinct primes
+    """
+    primes = set()
+    ctx = multiprocessing.get_context("fork")
+    with ctx.Pool(workers) as pool:
+        while len(primes) < count:
+            # Each task gets its own seed so that workers don't find the same primes
+            tasks = [(bits, secrets.randbits(128)) for _ in range(count - len(primes))]
+            primes.update(pool.map(_prime_pool_worker, tasks))
+    return list(primes)
+
+
+@report
+def test_prime_generation(
+    is_probable_prime_fast,
+    get_prime_fast,
+    generate_prime_pool,
+    small_primes,
+    is_probable_prime,
+):
+    """Compare the fast prime functions with trial division and known (pseudo)primes."""
+    limit = 20_000
+    primes = set(small_primes(limit))
+    assert all(n in primes for n in [2, 3, 5, 2039, 2053, 19997])
+    for n in range(-2, limit):
+        assert is_probable_prime_fast(n) == (n in primes), (
+            f"is_probable_prime_fast({n}) is wrong"
+        )
+
+    known_primes = [2**61 - 1, 2**89 - 1, 2**127 - 1, 4_294_967_291]
+    composites = [
+        561,  # Carmichael number
+        3_215_031_751,  # Strong pseudoprime to bases 2, 3, 5 and 7
+        3_825_123_056_546_413_051,  # Strong pseudoprime to bases 2 to 23
+        (2**61 - 1) * (2**31 - 1),
+        (2**89 - 1) * (2**61 - 1),
+        2**128 + 1,
+    ]
+    for n in known_primes:
+        assert is_probable_prime_fast(n), f"{n} is prime"
+    for n in composites:
+        assert not is_probable_prime_fast(n), f"{n} is composite"
+
+    rng = random.Random(4)
+    for bits in [2, 3, 8, 12, 32, 64, 128, 512]:
+        for _ in range(5):
+            p = get_prime_fast(bits, rng)
+            assert p.bit_length() == bits, (
+                f"get_prime_fast({bits}) returned {p.bit_length()} bits"
+            )
+            assert is_probable_prime(p), (
+                f"get_prime_fast({bits}) returned composite {p}"
+            )
+    assert {get_prime_fast(3, rng, window=1) for _ in range(50)} == {5, 7}
+
+    pool = generate_prime_pool(64, 8, workers=2)
+    assert len(set(pool)) == 8 and all(
+        p.bit_length() == 64 and is_probable_prime(p) for p in pool
+    )
+
+
+test_prime_generation(
+    is_probable_prime_fast,
+    get_prime_fast,
+    generate_prime_pool,
+    small_primes,
+    _is_probable_prime,
+)
+
+# %%
+"""
+Let's see how much time the sieve saves when generating RSA keys:
+"""
+
+
+def benchmark_prime_generation(
+    bit_sizes: List[int] | None = None, repeats: int = 3
+) -> None:
+    """Time RSAKey.generate with get_prime and get_prime_fast."""
+    bit_sizes = bit_sizes or [256, 512, 1024]
+    for bits in bit_sizes:
+        times = []
+        for prime_generator in [get_prime, get_prime_fast]:
+            start = time.perf_counter()
+            for _ in range(repeats):
+                RSAKey.generate(bits, prime_generator=prime_generator)
+            times.append((time.perf_counter() - start) / repeats)
+        print(
+            f"{bits:>5}-bit key: {times[0] * 1000:8.1f}ms -> {times[1] * 1000:7.1f}ms "
+            f"({times[0] / times[1]:.1f}x faster)"
+        )
+
+    workers = os.cpu_count() or 1
+    start = time.perf_counter()
+    generate_prime_pool(512, 4 * workers, workers=workers)
+    elapsed = time.perf_counter() - start
+    print(
+        f"Pool of {4 * workers} 512-bit primes on {workers} processes: {elapsed:.2f}s"
+    )
+
+
+if __name__ == "__main__":
+    benchmark_prime_generation()
+
 # %%
 """
 ## Summary: Lessons from Cryptographic Implementation
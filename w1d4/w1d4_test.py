@@ -17,6 +17,17 @@ from Crypto.Cipher import AES
 from aisb_utils import report
 import random
 from typing import Tuple, List
+import struct
+import random
+import tempfile
+import time
+from typing import Iterable
+import random
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import itertools
+import multiprocessing
 
 
 
@@ -824,3 +835,390 @@ def test_padding_oracle_attack(
     assert recovered == original, (
         f"Failed to recover original ({original!r}): {recovered!r}"
     )
+
+
+
+
+@report
+def test_md5_streaming(MD5, md5_file, md5_hash):
+    """Compare the streaming MD5 against hashlib and the reference implementation."""
+    import random
+    import tempfile
+
+    rng = random.Random(0)
+    for length in [0, 1, 3, 55, 56, 63, 64, 65, 127, 128, 1000, 4097]:
+        message = rng.randbytes(length)
+        expected = hashlib.md5(message).digest()
+        assert MD5(message).digest() == expected, f"MD5 of {length} bytes is wrong"
+        assert md5_hash(message) == expected
+
+        # Feed the same message in chunks of random size
+        h = MD5()
+        position = 0
+        while position < length:
+            step = rng.randint(1, 100)
+            h.update(message[position : position + step])
+            position += step
+        assert h.digest() == expected, f"Chunked MD5 of {length} bytes is wrong"
+
+    h = MD5(b"The quick brown fox ")
+    assert h.digest() == h.digest(), "digest() must not change the object"
+    clone = h.copy()
+    h.update(b"jumps over the lazy dog")
+    clone.update(bytearray(b"sleeps"))
+    assert h.hexdigest() == "9e107d9d372bb6826bd81d3542a419d6"
+    assert clone.hexdigest() == hashlib.md5(b"The quick brown fox sleeps").hexdigest()
+    assert MD5(memoryview(b"abc")).hexdigest() == "900150983cd24fb0d6963f7d28e17f72"
+
+    data = rng.randbytes(10_000)
+    with tempfile.NamedTemporaryFile() as f:
+        f.write(data)
+        f.flush()
+        assert md5_file(f.name, chunk_size=192) == hashlib.md5(data).hexdigest()
+
+
+
+
+@report
+def test_length_extension_sweep(
+    md5_resume,
+    forge_length_extensions,
+    length_extension_sweep,
+    length_extension_attack,
+    naive_mac,
+):
+    """Check the batched attack against length_extension_attack and a batch oracle."""
+    import random
+
+    rng = random.Random(1)
+    message = b"user=alice&action=view"
+    suffixes = [b"&action=admin", b"&user=root" * 10]
+    secret = b"k" * 21
+    tag = naive_mac(message, secret)
+
+    h = md5_resume(hashlib.md5(b"x" * 55).digest(), 64)
+    h.update(b"abc")
+    _, expected_tag = length_extension_attack(
+        b"", hashlib.md5(b"x" * 55).digest(), 55, b"abc"
+    )
+    assert h.digest() == expected_tag, "md5_resume does not continue from the tag"
+
+    forgeries = forge_length_extensions(message, tag, range(1, 70), suffixes)
+    assert len(forgeries) == 69 * len(suffixes)
+    for secret_length, forged_message, forged_tag in forgeries[::7]:
+        suffix = suffixes[forged_message.endswith(suffixes[1])]
+        assert (forged_message, forged_tag) == length_extension_attack(
+            message, tag, secret_length, suffix
+        ), (
+            f"Forgery for secret length {secret_length} differs from length_extension_attack"
+        )
+
+    oracle_calls = []
+    secrets_by_pair = [rng.randbytes(rng.randint(1, 40)) for _ in range(10)]
+    secrets_by_pair[3] = b"s" * 100  # Outside of the swept lengths
+    pairs = []
+    for pair_secret in secrets_by_pair:
+        pair_message = rng.randbytes(rng.randint(0, 80))
+        pairs.append((pair_message, hashlib.md5(pair_secret + pair_message).digest()))
+
+    def oracle(batch):
+        oracle_calls.append(len(batch))
+        return [
+            any(hashlib.md5(s + m).digest() == t for s in secrets_by_pair)
+            for m, t in batch
+        ]
+
+    results = length_extension_sweep(
+        pairs, range(1, 65), suffixes, oracle, batch_size=100
+    )
+    assert max(oracle_calls) <= 100, "Batches must not exceed batch_size"
+    assert sum(oracle_calls) == len(pairs) * 64, (
+        "Every candidate should be checked exactly once"
+    )
+    assert sorted(results) == [i for i in range(len(pairs)) if i != 3]
+    for index, pair_forgeries in results.items():
+        pair_secret = secrets_by_pair[index]
+        assert len(pair_forgeries) == len(suffixes)
+        for (secret_length, forged_message, forged_tag), suffix in zip(
+            pair_forgeries, suffixes
+        ):
+            assert secret_length == len(pair_secret)
+            assert forged_message.startswith(
+                pairs[index][0]
+            ) and forged_message.endswith(suffix)
+            assert hashlib.md5(pair_secret + forged_message).digest() == forged_tag
+
+
+
+
+@report
+def test_hmac_md5_context(HMACMD5, hmac_md5):
+    """Compare HMACMD5 against hmac.new and the reference hmac_md5."""
+    import random
+
+    rng = random.Random(2)
+    for key in [
+        b"",
+        b"Jefe",
+        b"\x0b" * 16,
+        b"k" * 64,
+        rng.randbytes(65),
+        rng.randbytes(200),
+    ]:
+        context = HMACMD5(key)
+        messages = [rng.randbytes(n) for n in [0, 1, 50, 64, 100, 1000]]
+        expected = [hmac.new(key, m, hashlib.md5).digest() for m in messages]
+        assert context.mac_many(messages) == expected, f"Wrong tags for key {key!r}"
+        assert context.mac(messages[2]) == hmac_md5(key, messages[2])
+
+        tags = list(expected)
+        tags[1] = bytes(16)
+        tags[3] = expected[3][:-1] + bytes([expected[3][-1] ^ 1])
+        tags[4] = expected[4][:8]  # Truncated tag
+        assert context.verify_many(messages, tags) == [
+            True,
+            False,
+            True,
+            False,
+            False,
+            True,
+        ]
+        assert context.verify(messages[0], expected[0])
+        assert not context.verify(messages[0], expected[1])
+
+    context = HMACMD5(b"Jefe")
+    assert (
+        context.mac(b"what do ya want for nothing?").hex()
+        == "750c783e6ab0b503eaa86e310a5db738"
+    )
+    # Computing tags must not change the cached key states
+    assert (
+        context.mac(b"what do ya want for nothing?").hex()
+        == "750c783e6ab0b503eaa86e310a5db738"
+    )
+
+
+
+
+@report
+def test_padding_oracle_attack_parallel(
+    padding_oracle_attack_parallel, plaintext_byte_order, cbc_encrypt
+):
+    """Recover messages through a batch oracle and compare the number of queries."""
+    secret_key = b"YELLOW SUBMARINE"
+    cipher = AES.new(secret_key, AES.MODE_ECB)
+
+    def batch_oracle(ciphertexts):
+        results = []
+        for ciphertext in ciphertexts:
+            intermediary = cipher.decrypt(ciphertext[16:])
+            plaintext = bytes(x ^ y for x, y in zip(intermediary, ciphertext[:16]))
+            n = plaintext[-1]
+            results.append(1 <= n <= 16 and plaintext[-n:] == bytes([n]) * n)
+        return results
+
+    for last_block in [False, True]:
+        assert sorted(plaintext_byte_order(last_block)) == list(range(256))
+    assert plaintext_byte_order(True)[0] == 1
+
+    iv = b"\x01\xf0\x00\x03\x02\x30\x04\x50\x06\x70\x08\x09\x10\x11\x23\x48"
+    for original in [
+        b"The magic words are squeamish ossifrage",
+        b"A" * 14 + b"\x02\x7f" + b'{"admin": "true"}',  # Invites a false positive
+        b"exactly 16 bytes",
+    ]:
+        ciphertext = iv + cbc_encrypt(original, secret_key, iv)
+        recovered, stats = padding_oracle_attack_parallel(
+            batch_oracle, ciphertext, workers=4
+        )
+        assert recovered == original, f"Failed to recover {original!r}: {recovered!r}"
+        print(f"Recovered {recovered!r} with {stats}")
+
+    # The sequential attack needs 5810 queries for the first message
+    ciphertext = iv + cbc_encrypt(
+        b"The magic words are squeamish ossifrage", secret_key, iv
+    )
+    _, stats = padding_oracle_attack_parallel(batch_oracle, ciphertext, batch_size=8)
+    assert stats.queries < 2000, (
+        f"Frequency ordering should need far fewer queries, got {stats.queries}"
+    )
+    assert stats.batches < stats.queries / 4, "Queries should be sent in batches"
+
+
+
+
+@report
+def test_cbc_context(
+    CBCContext,
+    VulnerableServer,
+    FastVulnerableServer,
+    add_pkcs7_padding_inplace,
+    remove_pkcs7_padding_inplace,
+    cbc_encrypt,
+    cbc_decrypt,
+    InvalidPaddingError,
+):
+    """Compare CBCContext and the in-place padding with the reference functions."""
+    key = b"YELLOW SUBMARINE"
+    iv = bytes(range(16))
+    context = CBCContext(key)
+    for length in [0, 1, 15, 16, 17, 100, 1000]:
+        plaintext = os.urandom(length)
+        ciphertext = context.encrypt(plaintext, iv)
+        assert ciphertext == cbc_encrypt(plaintext, key, iv), (
+            f"Wrong ciphertext for {length} bytes"
+        )
+        assert context.decrypt(ciphertext, iv) == plaintext
+        assert cbc_decrypt(ciphertext, key, iv) == plaintext
+
+        buffer = bytearray(plaintext)
+        assert add_pkcs7_padding_inplace(buffer) is buffer, (
+            "Padding should extend the buffer"
+        )
+        assert (
+            len(buffer) % 16 == 0 and remove_pkcs7_padding_inplace(buffer) == plaintext
+        )
+
+    padded = bytearray(b"hello" + b"\x0b" * 11)
+    view = remove_pkcs7_padding_inplace(memoryview(padded))
+    assert isinstance(view, memoryview) and view.obj is padded, (
+        "Unpadding should not copy"
+    )
+    for bad in [
+        b"",
+        b"hello" + b"\x00",
+        b"hello" + b"\x11" * 17,
+        b"\x03" * 2,
+        b"hello" + b"\x01\x03\x03",
+    ]:
+        try:
+            remove_pkcs7_padding_inplace(bytearray(bad))
+            assert False, f"Should reject padding of {bad!r}"
+        except InvalidPaddingError:
+            pass
+    for bad in [b"", b"x" * 15, b"x" * 17]:
+        for error_iv in [iv, bytes(16)]:
+            try:
+                context.decrypt(bad, error_iv)
+                assert False, f"Should reject a {len(bad)}-byte ciphertext"
+            except InvalidPaddingError:
+                pass
+
+    reference = VulnerableServer(key)
+    server = FastVulnerableServer(key)
+    cookie = reference.encrypt_cookie(
+        {"admin": "false", "user_email": "bob@example.com"}
+    )
+    for tampered in [
+        cookie,
+        server.encrypt_cookie({"admin": "true"}),
+        cookie[:-1] + bytes([cookie[-1] ^ 1]),  # Padding error
+        cookie[:20],  # Too short
+        cookie[:-5],  # Not a whole number of blocks
+        cookie[:16] + cbc_encrypt(b"not json", key, cookie[:16]),
+    ]:
+        assert server.decrypt_cookie(tampered) == reference.decrypt_cookie(tampered)
+
+
+
+
+@report
+def test_rsa_key(RSAKey, pack_blocks, unpack_blocks, decrypt_rsa):
+    """Check packing, CRT decryption and signatures of RSAKey."""
+    for block_size in [1, 2, 7, 16]:
+        for data in [b"", b"\x00", b"\x00\x80\x00", b"x" * block_size, os.urandom(50)]:
+            blocks = pack_blocks(data, block_size)
+            assert all(0 <= b < 256**block_size for b in blocks)
+            assert unpack_blocks(blocks, block_size) == data, (
+                f"Roundtrip failed for {data!r}"
+            )
+    for bad in [[0], [256], [0x80, 0]]:
+        try:
+            unpack_blocks(bad, 1)
+            assert False, f"Should reject {bad}"
+        except ValueError:
+            pass
+
+    rng = random.Random(3)
+    for bits in [16, 64, 512]:
+        key = RSAKey.generate(bits, rng)
+        for c in [0, 1, 2, 12345 % key.n, key.n - 1]:
+            assert key.private_op(c) == pow(c, key.d, key.n), (
+                "CRT result differs from c^d mod n"
+            )
+
+        messages = [
+            "",
+            "Hi",
+            "RSA 🔐 with CRT",
+            "A longer message that spans several blocks. " * 3,
+        ]
+        ciphertexts = key.encrypt_many(messages)
+        assert key.decrypt_many(ciphertexts) == messages
+        signatures = key.sign_many(messages)
+        assert key.verify_many(messages, signatures) == [True] * len(messages)
+        tampered = [signatures[1][:-1] + [(signatures[1][-1] + 1) % key.n]]
+        assert key.verify_many([messages[1]], tampered) == [False]
+        assert not key.verify(messages[2], signatures[3])
+
+    # The private exponent is a regular RSA private key
+    key = RSAKey(61, 53)
+    assert key.private_key == (3233, pow(key.e, -1, 60 * 52))
+    encrypted = [pow(b, key.e, key.n) for b in b"textbook"]
+    assert decrypt_rsa(key.private_key, encrypted) == "textbook"
+
+    # e must be coprime to phi, not just not divide it: 3 divides phi = 100 * 102, 9 doesn't
+    key = RSAKey(101, 103, e=9)
+    assert math.gcd(key.e, 100 * 102) == 1, f"e={key.e} is not coprime to phi"
+    assert key.decrypt(key.encrypt("ok")) == "ok"
+
+
+
+
+@report
+def test_prime_generation(
+    is_probable_prime_fast,
+    get_prime_fast,
+    generate_prime_pool,
+    small_primes,
+    is_probable_prime,
+):
+    """Compare the fast prime functions with trial division and known (pseudo)primes."""
+    limit = 20_000
+    primes = set(small_primes(limit))
+    assert all(n in primes for n in [2, 3, 5, 2039, 2053, 19997])
+    for n in range(-2, limit):
+        assert is_probable_prime_fast(n) == (n in primes), (
+            f"is_probable_prime_fast({n}) is wrong"
+        )
+
+    known_primes = [2**61 - 1, 2**89 - 1, 2**127 - 1, 4_294_967_291]
+    composites = [
+        561,  # Carmichael number
+        3_215_031_751,  # Strong pseudoprime to bases 2, 3, 5 and 7
+        3_825_123_056_546_413_051,  # Strong pseudoprime to bases 2 to 23
+        (2**61 - 1) * (2**31 - 1),
+        (2**89 - 1) * (2**61 - 1),
+        2**128 + 1,
+    ]
+    for n in known_primes:
+        assert is_probable_prime_fast(n), f"{n} is prime"
+    for n in composites:
+        assert not is_probable_prime_fast(n), f"{n} is composite"
+
+    rng = random.Random(4)
+    for bits in [2, 3, 8, 12, 32, 64, 128, 512]:
+        for _ in range(5):
+            p = get_prime_fast(bits, rng)
+            assert p.bit_length() == bits, (
+                f"get_prime_fast({bits}) returned {p.bit_length()} bits"
+            )
+            assert is_probable_prime(p), (
+                f"get_prime_fast({bits}) returned composite {p}"
+            )
+    assert {get_prime_fast(3, rng, window=1) for _ in range(50)} == {5, 7}
+
+    pool = generate_prime_pool(64, 8, workers=2)
+    assert len(set(pool)) == 8 and all(
+        p.bit_length() == 64 and is_probable_prime(p) for p in pool
+    )
@@ -24,6 +24,11 @@ Implement a custom image layer extraction tool by interacting directly with Dock
 > - Understand Docker image structure and layering
 > - Implement registry authentication and manifest processing
 > - Download and extract compressed layer archives
+> - Cache layers by digest so that repeated pulls are served from disk
+> - Download layers concurrently while applying them in order
+> - Extract layers while they download, with bounded memory
+> - Apply whiteouts and write each file of the final filesystem once
+> - Reuse connections, tokens and manifests across pulls in a registry client
 
 ### 2️⃣ Container Isolation with Chroot
 Create isolated filesystem environments using chroot, one of the fundamental isolation mechanisms.
@@ -1200,6 +1205,1470 @@ test_pull_layers_complete(pull_layers)
 pull_layers("alpine:latest", "./extracted_alpine")
 pull_layers("python:3.12-alpine", "./extracted_python") 
 
+# %%
+"""
+### Exercise 1.7: A Content-Addressed Layer Cache
+
+> **Difficulty**: 🔴🔴🔴⚪⚪
+> **Importance**: 🔵🔵🔵⚪⚪
+>
+> You should spend up to ~25 minutes on this exercise.
+
+`pull_layers` downloads every blob again on every pull, even when another image already fetched the same layer. Images share a lot: `python:3.12-alpine` is built on top of `alpine`, so pulling both downloads the Alpine base layer twice.
+
+Layers are **content-addressed**: the digest `sha256:<hex>` is the SHA-256 hash of the blob's bytes. That gives us a cache for free:
+- Blobs can be stored on disk under their digest (`blobs/sha256/<hex>`, like the [OCI image layout](https://github.com/opencontainers/image-spec/blob/main/image-layout.md)). If the file exists, the layer doesn't need to be downloaded.
+- A blob never changes, so a cached blob never goes stale. We only need to check that what we store really has the digest it claims: hash the bytes while writing them to a temporary file, and only move the file into place (with the atomic `os.replace`) if the hash matches.
+- Manifests fetched by digest are just as immutable. Manifests fetched by tag (`alpine:latest`) can change when the image is updated, so we keep them for a limited time (a *TTL*, time to live). Auth tokens expire too, so they get a TTL as well.
+
+Implement `BlobStore` and `TTLCache`, then `pull_layers_cached`, which does the same as `pull_layers` but goes through a `LayerCache`. Both caches count their hits and misses, so that we can see how much a cache helps.
+
+For testing without the internet, `LocalRegistry` is a small registry that serves images from memory on `127.0.0.1`. Like Docker, we talk plain HTTP to registries on the local machine (see `registry_url`).
+"""
+
+import hashlib
+import re
+import tempfile
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+from urllib.parse import parse_qs, urlparse
+
+DIGEST_PATTERN = re.compile(r'sha256:[0-9a-f]{64}')
+MANIFEST_ACCEPT = ','.join([
+    'application/vnd.oci.image.index.v1+json',
+    'application/vnd.docker.distribution.manifest.list.v2+json',
+    'application/vnd.oci.image.manifest.v1+json',
+    'application/vnd.docker.distribution.manifest.v2+json',
+])
+
+
+def registry_url(registry: str) -> str:
+    """Base URL of a registry, using plain HTTP for registries on this machine like Docker does."""
+    host = registry.rsplit(':', 1)[0]
+    scheme = 'http' if host in ('localhost', '127.0.0.1') else 'https'
+    return f"{scheme}://{registry}"
+
+
+def make_layer(files: Dict[str, bytes]) -> bytes:
+    """Build a gzipped tar layer containing the given files."""
+    buffer = BytesIO()
+    with tarfile.open(fileobj=buffer, mode='w:gz') as tar:
+        for name, data in files.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            info.mode = 0o644
+            tar.addfile(info, BytesIO(data))
+    return buffer.getvalue()
+
+
+class LocalRegistry:
+    """
+    A minimal registry serving images from memory over HTTP, for pulling without the network.
+
+    Use it as a context manager, and pull e.g. f"{registry.address}/library/demo:latest".
+    Every request path is recorded in `requests`, and `connections` counts the TCP connections. To simulate
+    slow downloads, set `delays[digest]` to the seconds that sending a blob takes; `max_active` is the most
+    requests that were served at the same time. Set `failures[path]` to answer the next requests of a path
+    with 503 Service Unavailable.
+
+    With token_expires_in, the registry requires bearer tokens like Docker Hub: requests without a valid
+    token get a 401 response whose WWW-Authenticate header says where to get one.
+    """
+
+    def __init__(self, token_expires_in: Optional[int] = None):
+        self.blobs: Dict[str, bytes] = {}
+        self.manifests: Dict[Tuple[str, str], Tuple[str, bytes]] = {}  # (image, reference) -> (media type, body)
+        self.requests: List[str] = []
+        self.delays: Dict[str, float] = {}
+        self.failures: Dict[str, int] = {}
+        self.token_expires_in = token_expires_in
+        self.tokens: Dict[str, str] = {}  # Issued token -> scope
+        self.connections = 0
+        self.active = 0
+        self.max_active = 0
+        self.lock = Lock()
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'  # Keep connections open between requests
+            disable_nagle_algorithm = True  # Headers and body are separate writes, don't delay the body
+
+            def setup(self):
+                super().setup()
+                with registry.lock:
+                    registry.connections += 1
+
+            def do_GET(self):
+                registry.handle(self)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.address = f"127.0.0.1:{self.server.server_address[1]}"
+
+    def add_blob(self, data: bytes) -> str:
+        digest = 'sha256:' + hashlib.sha256(data).hexdigest()
+        self.blobs[digest] = data
+        return digest
+
+    def add_image(self, image: str, tag: str, layers: List[bytes],
+                  arch: str = TARGET_ARCH, variant: Optional[str] = TARGET_VARIANT, index: bool = True) -> str:
+        """Add a single-platform image, behind an image index unless index=False, and return the manifest digest."""
+        config = json.dumps({'architecture': arch, 'os': 'linux'}).encode()
+        manifest = json.dumps({
+            'schemaVersion': 2,
+            'mediaType': 'application/vnd.oci.image.manifest.v1+json',
+            'config': {'mediaType': 'application/vnd.oci.image.config.v1+json',
+                       'digest': self.add_blob(config), 'size': len(config)},
+            'layers': [{'mediaType': 'application/vnd.oci.image.layer.v1.tar+gzip',
+                        'digest': self.add_blob(layer), 'size': len(layer)} for layer in layers],
+        }).encode()
+        manifest_digest = 'sha256:' + hashlib.sha256(manifest).hexdigest()
+        platform = {'architecture': arch, 'os': 'linux'}
+        if variant:
+            platform['variant'] = variant
+        index_body = json.dumps({
+            'schemaVersion': 2,
+            'mediaType': 'application/vnd.oci.image.index.v1+json',
+            'manifests': [{'mediaType': 'application/vnd.oci.image.manifest.v1+json',
+                           'digest': manifest_digest, 'size': len(manifest), 'platform': platform}],
+        }).encode()
+        self.manifests[image, manifest_digest] = ('application/vnd.oci.image.manifest.v1+json', manifest)
+        if index:
+            self.manifests[image, tag] = ('application/vnd.oci.image.index.v1+json', index_body)
+        else:
+            self.manifests[image, tag] = self.manifests[image, manifest_digest]
+        return manifest_digest
+
+    def handle(self, request: BaseHTTPRequestHandler) -> None:
+        with self.lock:
+            self.requests.append(request.path)
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        try:
+            self.respond(request)
+        finally:
+            with self.lock:
+                self.active -= 1
+
+    def respond(self, request: BaseHTTPRequestHandler) -> None:
+        with self.lock:
+            failing = self.failures.get(request.path, 0) > 0
+            if failing:
+                self.failures[request.path] -= 1
+        if failing:
+            self.send(request, 503, b'Service Unavailable')
+            return
+
+        url = urlparse(request.path)
+        if url.path == '/token':
+            query = parse_qs(url.query)
+            token = os.urandom(16).hex()
+            self.tokens[token] = query['scope'][0]
+            self.send(request, 200, json.dumps({'token': token, 'expires_in': self.token_expires_in}).encode())
+            return
+
+        parts = url.path.removeprefix('/v2/').rsplit('/', 2)
+        name, kind, reference = parts if len(parts) == 3 else ('', '', '')
+        scope = f"repository:{name}:pull"
+        if self.token_expires_in is not None and \
+                self.tokens.get(request.headers.get('Authorization', '').removeprefix('Bearer ')) != scope:
+            challenge = f'Bearer realm="http://{self.address}/token",service="local",scope="{scope}"'
+            self.send(request, 401, b'Unauthorized', {'WWW-Authenticate': challenge})
+            return
+        if kind == 'manifests' and (name, reference) in self.manifests:
+            media_type, body = self.manifests[name, reference]
+        elif kind == 'blobs' and reference in self.blobs:
+            media_type, body = 'application/octet-stream', self.blobs[reference]
+        else:
+            self.send(request, 404, b'Not Found')
+            return
+        digest = 'sha256:' + hashlib.sha256(body).hexdigest()
+        if kind == 'manifests' and request.headers.get('If-None-Match') == f'"{digest}"':
+            self.send(request, 304, b'', {'ETag': f'"{digest}"'})
+            return
+        headers = {'Content-Type': media_type, 'Docker-Content-Digest': digest}
+        if kind == 'manifests':
+            headers['ETag'] = f'"{digest}"'
+        self.send(request, 200, body, headers, delay=self.delays.get(reference, 0))
+
+    @staticmethod
+    def send(request: BaseHTTPRequestHandler, status: int, body: bytes, headers: Optional[Dict[str, str]] = None,
+             delay: float = 0) -> None:
+        request.send_response(status)
+        for key, value in (headers or {}).items():
+            request.send_header(key, value)
+        if status != 304:
+            request.send_header('Content-Length', str(len(body)))
+        request.end_headers()
+        time.sleep(delay)
+        request.wfile.write(body)
+
+    def __enter__(self):
+        Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class BlobStore:
+    """Blobs on disk at <root>/sha256/<hex>, verified against their digest when stored."""
+
+    def __init__(self, root: str):
+        self.root = root
+        self.hits = 0
+        self.misses = 0
+
+    def path(self, digest: str) -> str:
+        """
+        Path of a blob in the store.
+
+        Raises:
+            ValueError: If the digest isn't a sha256 digest. Digests come from the registry, so without this check
+                a digest like 'sha256:../../etc/passwd' would point outside the store.
+        """
+        if not DIGEST_PATTERN.fullmatch(digest):
+            raise ValueError(f"Invalid digest: {digest!r}")
+        algorithm, hex_digest = digest.split(':', 1)
+        return os.path.join(self.root, algorithm, hex_digest)
+
+    def get(self, digest: str) -> Optional[str]:
+        """Return the path of a stored blob, or None if it isn't stored."""
+        if "SOLUTION":
+            path = self.path(digest)
+            if os.path.exists(path):
+                self.hits += 1
+                return path
+            self.misses += 1
+            return None
+        else:
+            # TODO: Return the path if the blob exists, and count a hit or a miss
+            pass
+
+    def put(self, digest: str, chunks) -> str:
+        """
+        Store a blob from an iterable of byte chunks, e.g. a streamed response.
+
+        Returns:
+            The path of the stored blob
+
+        Raises:
+            ValueError: If the data doesn't match the digest (nothing is stored then)
+        """
+        if "SOLUTION":
+            path = self.path(digest)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            sha256 = hashlib.sha256()
+            # In the same directory, so that os.replace is an atomic rename
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    for chunk in chunks:
+                        sha256.update(chunk)
+                        f.write(chunk)
+                actual = 'sha256:' + sha256.hexdigest()
+                if actual != digest:
+                    raise ValueError(f"Digest mismatch: expected {digest}, got {actual}")
+                os.replace(tmp_path, path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+            return path
+        else:
+            # TODO: Store the blob atomically
+            # - Write the chunks to a temporary file next to the final path, hashing them as you go
+            # - Raise ValueError and remove the temporary file if the digest doesn't match
+            # - Otherwise move the file into place with os.replace
+            pass
+
+
+class TTLCache:
+    """A dictionary whose entries expire after a number of seconds, counting hits and misses. Thread-safe."""
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.entries: Dict[Any, Tuple[float, Any]] = {}  # key -> (expiry time, value)
+        self.hits = 0
+        self.misses = 0
+        self.lock = Lock()  # RegistryClient looks up tokens from several threads
+
+    def get(self, key) -> Optional[Any]:
+        """Return the value for key, or None if it is missing or expired."""
+        if "SOLUTION":
+            with self.lock:
+                entry = self.entries.get(key)
+                if entry is not None and entry[0] > self.clock():
+                    self.hits += 1
+                    return entry[1]
+                self.entries.pop(key, None)
+                self.misses += 1
+                return None
+        else:
+            # TODO: Return unexpired values, count a hit or a miss (holding self.lock)
+            pass
+
+    def set(self, key, value, ttl: Optional[float]) -> None:
+        """Store value for ttl seconds, or forever if ttl is None."""
+        if "SOLUTION":
+            expiry = float('inf') if ttl is None else self.clock() + ttl
+            with self.lock:
+                self.entries[key] = (expiry, value)
+        else:
+            # TODO: Store the value with its expiry time (holding self.lock)
+            pass
+
+
+class LayerCache:
+    """Blob store plus manifest and token caches for pulling images."""
+
+    def __init__(self, root: str, manifest_ttl: float = 300, token_ttl: float = 240, clock=time.monotonic):
+        self.blobs = BlobStore(os.path.join(root, 'blobs'))
+        self.manifests = TTLCache(clock)
+        self.tokens = TTLCache(clock)
+        self.manifest_ttl = manifest_ttl  # For manifests fetched by tag, manifests fetched by digest never expire
+        self.token_ttl = token_ttl  # Docker Hub tokens are valid for 300 seconds
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        return {name: {'hits': cache.hits, 'misses': cache.misses}
+                for name, cache in [('blobs', self.blobs), ('manifests', self.manifests), ('tokens', self.tokens)]}
+
+
+def pull_layers_cached(image_ref: str, output_dir: str, cache: LayerCache, target_arch: str = TARGET_ARCH,
+                       target_variant: Optional[str] = TARGET_VARIANT) -> None:
+    """
+    Like pull_layers, but reuse cached tokens, manifests and blobs.
+
+    Args:
+        image_ref: Docker image reference
+        output_dir: Directory to extract layers to
+        cache: Cache to look things up in and store them to
+        target_arch: Target architecture
+        target_variant: Target architecture variant
+    """
+    if "SOLUTION":
+        registry, image, tag = parse_image_reference(image_ref)
+        base_url = registry_url(registry)
+
+        headers = cache.tokens.get((registry, image))
+        if headers is None:
+            headers = get_auth_token(registry, image)
+            cache.tokens.set((registry, image), headers, cache.token_ttl)
+
+        def get_manifest(reference: str) -> Dict[str, Any]:
+            manifest = cache.manifests.get((registry, image, reference))
+            if manifest is None:
+                resp = requests.get(f"{base_url}/v2/{image}/manifests/{reference}",
+                                    headers={**headers, 'Accept': MANIFEST_ACCEPT})
+                resp.raise_for_status()
+                manifest = resp.json()
+                ttl = None if reference.startswith('sha256:') else cache.manifest_ttl
+                cache.manifests.set((registry, image, reference), manifest, ttl)
+            return manifest
+
+        manifest = get_manifest(tag)
+        if 'manifests' in manifest:
+            # An image index, select the manifest for our platform
+            for entry in manifest['manifests']:
+                platform = entry.get('platform', {})
+                if platform.get('architecture') == target_arch and (
+                        not target_variant or platform.get('variant') == target_variant):
+                    manifest = get_manifest(entry['digest'])
+                    break
+            else:
+                raise ValueError(f"No manifest found for architecture {target_arch}"
+                                 f"{f' variant {target_variant}' if target_variant else ''}")
+
+        os.makedirs(output_dir, exist_ok=True)
+        for layer in manifest['layers']:
+            digest = layer['digest']
+            path = cache.blobs.get(digest)
+            if path is None:
+                blob_resp = requests.get(f"{base_url}/v2/{image}/blobs/{digest}", headers=headers, stream=True)
+                blob_resp.raise_for_status()
+                path = cache.blobs.put(digest, blob_resp.iter_content(chunk_size=1 << 16))
+            with tarfile.open(path, mode='r:gz') as tar:
+                tar.extractall(output_dir)
+        print(f"✓ Extracted {len(manifest['layers'])} layers of {image_ref} to {output_dir}: {cache.stats()}")
+    else:
+        # TODO: Implement pull_layers with a cache
+        # 1. Reuse the token of (registry, image) from cache.tokens, or get and store a new one
+        # 2. Fetch manifests through cache.manifests; by tag with cache.manifest_ttl, by digest forever
+        #    (use registry_url(registry) as the base URL and send MANIFEST_ACCEPT as the Accept header)
+        # 3. Select the platform's manifest if the tag points to an index
+        # 4. For each layer, download the blob into cache.blobs unless it is already stored
+        # 5. Extract each layer from the stored blob
+        pass
+
+
+def test_pull_layers_cached(pull_layers_cached, LayerCache, BlobStore, LocalRegistry, make_layer):
+    """Test cached pulls against a local registry."""
+    print("Testing cached pulls...")
+
+    with tempfile.TemporaryDirectory() as tmp, LocalRegistry() as registry:
+        base = make_layer({'etc/os-release': b'NAME=Test\n', 'bin/sh': b'#!/bin/true\n'})
+        app = make_layer({'app/main.py': b'print("hello")\n'})
+        registry.add_image('library/base', 'latest', [base])
+        registry.add_image('library/app', 'latest', [base, app])
+        now = [0.0]
+        cache = LayerCache(os.path.join(tmp, 'cache'), manifest_ttl=60, clock=lambda: now[0])
+
+        # Test 1: A first pull downloads everything
+        pull_layers_cached(f"{registry.address}/library/app:latest", os.path.join(tmp, 'app1'), cache)
+        with open(os.path.join(tmp, 'app1', 'app', 'main.py'), 'rb') as f:
+            assert f.read() == b'print("hello")\n', "Layer contents should be extracted"
+        assert os.path.exists(os.path.join(tmp, 'app1', 'etc', 'os-release')), "Base layer should be extracted"
+        assert cache.stats()['blobs'] == {'hits': 0, 'misses': 2}, f"Unexpected stats {cache.stats()}"
+        print("✓ First pull downloads all layers")
+
+        # Test 2: Pulling again is served from the cache without any requests
+        requests_before = len(registry.requests)
+        pull_layers_cached(f"{registry.address}/library/app:latest", os.path.join(tmp, 'app2'), cache)
+        assert len(registry.requests) == requests_before, f"Unexpected requests {registry.requests[requests_before:]}"
+        assert cache.stats()['blobs'] == {'hits': 2, 'misses': 2}, f"Unexpected stats {cache.stats()}"
+        assert os.path.exists(os.path.join(tmp, 'app2', 'app', 'main.py')), "Cached layers should be extracted"
+        print("✓ Repeated pull is served from disk")
+
+        # Test 3: Another image shares the base layer
+        requests_before = len(registry.requests)
+        pull_layers_cached(f"{registry.address}/library/base:latest", os.path.join(tmp, 'base'), cache)
+        assert not any('/blobs/' in path for path in registry.requests[requests_before:]), "Base layer is cached"
+        assert cache.stats()['blobs'] == {'hits': 3, 'misses': 2}, f"Unexpected stats {cache.stats()}"
+        print("✓ Layers are shared between images")
+
+        # Test 4: Manifests fetched by tag expire, manifests fetched by digest don't
+        now[0] += 61
+        requests_before = len(registry.requests)
+        pull_layers_cached(f"{registry.address}/library/app:latest", os.path.join(tmp, 'app3'), cache)
+        assert registry.requests[requests_before:] == ['/v2/library/app/manifests/latest'], \
+            f"Only the tag should be fetched again, got {registry.requests[requests_before:]}"
+        print("✓ Tags expire after their TTL")
+
+        # Test 5: Blobs that don't match their digest are rejected
+        store = BlobStore(os.path.join(tmp, 'store'))
+        digest = 'sha256:' + hashlib.sha256(b'layer').hexdigest()
+        try:
+            store.put(digest, [b'tampered'])
+            assert False, "Should have raised ValueError for a wrong digest"
+        except ValueError:
+            pass
+        assert store.get(digest) is None, "A rejected blob should not be stored"
+        assert os.listdir(os.path.join(tmp, 'store', 'sha256')) == [], "No temporary files should be left"
+        path = store.put(digest, [b'la', b'yer'])
+        assert store.get(digest) == path, "A stored blob should be found"
+        with open(path, 'rb') as f:
+            assert f.read() == b'layer', "The stored blob should contain the data"
+        print("✓ Blobs are verified against their digest")
+
+        # Test 6: Malformed digests can't point outside the store
+        for bad in ['sha256:../../../../../../etc/passwd', 'sha256:' + 'A' * 64, 'md5:' + 'a' * 32, digest + '/x']:
+            for use in [store.get, lambda d: store.put(d, [b'layer'])]:
+                try:
+                    use(bad)
+                    assert False, f"Should have raised ValueError for digest {bad!r}"
+                except ValueError:
+                    pass
+        print("✓ Malformed digests are rejected")
+
+    print("✓ Cached pull tests passed!\n" + "=" * 60)
+
+test_pull_layers_cached(pull_layers_cached, LayerCache, BlobStore, LocalRegistry, make_layer)
+
+# %%
+"""
+### Exercise 1.8: Concurrent Layer Downloads
+
+> **Difficulty**: 🔴🔴🔴🔴⚪
+> **Importance**: 🔵🔵🔵⚪⚪
+>
+> You should spend up to ~30 minutes on this exercise.
+
+`download_and_extract_layers` fetches one layer after the other. Each download spends most of its time waiting on the network, so an image with 5 layers takes about 5 times as long as one with a single layer of the same size. It also reads every blob into memory with `blob_resp.content`, even though it asked for a streamed response.
+
+Downloads can overlap, but **extraction can't**: later layers overwrite files of earlier ones, so they must be applied in manifest order. The pipeline is:
+- Start downloading all layers in a thread pool with at most `max_workers` downloads at the same time. Each download streams its blob to disk, verified by a `BlobStore`.
+- In the main thread, wait for the layers in manifest order and extract each one as soon as it has arrived. Layer 3 may finish downloading before layer 1. It then waits on disk, while later downloads continue during extraction.
+
+With enough workers, the pull takes about as long as the largest layer takes to download, plus the extraction time.
+
+Two more things make the workers well-behaved:
+- A `requests.Session` reuses connections instead of opening a new TCP (and TLS) connection for every request. Its connection pool needs room for `max_workers` connections to the registry, see [HTTPAdapter](https://requests.readthedocs.io/en/latest/api/#requests.adapters.HTTPAdapter).
+- A `BandwidthLimiter` shared by all workers caps the total download rate, so that a pull doesn't saturate a shared network. Each worker calls `acquire(len(chunk))` for each chunk it receives, which sleeps until the rate allows the next chunk.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+
+
+class BandwidthLimiter:
+    """Limit the total rate of bytes transferred by several threads."""
+
+    def __init__(self, bytes_per_second: float, clock=time.monotonic, sleep=time.sleep):
+        self.bytes_per_second = bytes_per_second
+        self.clock = clock
+        self.sleep = sleep
+        self.lock = Lock()
+        self.next_time = 0.0  # When the next bytes may be transferred
+
+    def acquire(self, n: int) -> None:
+        """Account for n transferred bytes, waiting until the rate allows more."""
+        if "SOLUTION":
+            with self.lock:
+                now = self.clock()
+                start = max(now, self.next_time)
+                self.next_time = start + n / self.bytes_per_second
+            if start > now:
+                self.sleep(start - now)
+        else:
+            # TODO: Reserve n / bytes_per_second seconds after the previous reservation
+            # - Update next_time while holding the lock
+            # - Sleep outside the lock, so that other threads can make their reservations
+            pass
+
+
+def make_session(max_workers: int) -> requests.Session:
+    """A session that keeps up to max_workers connections to each host open."""
+    if "SOLUTION":
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max_workers)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+    else:
+        # TODO: Mount an HTTPAdapter with pool_maxsize=max_workers for http:// and https://
+        pass
+
+
+def download_and_extract_layers_concurrent(registry: str, image: str, layers: List[Dict[str, Any]],
+                                           headers: Dict[str, str], output_dir: str, max_workers: int = 4,
+                                           max_bytes_per_second: Optional[float] = None,
+                                           cache: Optional[LayerCache] = None) -> None:
+    """
+    Download layers in parallel and extract them in manifest order.
+
+    Args:
+        registry: Registry hostname
+        image: Image name
+        layers: List of layer dictionaries from manifest
+        headers: Authentication headers
+        output_dir: Directory to extract layers to
+        max_workers: Maximum number of simultaneous downloads
+        max_bytes_per_second: Limit on the total download rate (default: unlimited)
+        cache: Cache to reuse and store blobs (default: a temporary blob store)
+    """
+    if "SOLUTION":
+        os.makedirs(output_dir, exist_ok=True)
+        limiter = BandwidthLimiter(max_bytes_per_second) if max_bytes_per_second else None
+        base_url = registry_url(registry)
+
+        with tempfile.TemporaryDirectory() as tmp, make_session(max_workers) as session, \
+                ThreadPoolExecutor(max_workers=max_workers) as executor:
+            store = cache.blobs if cache is not None else BlobStore(tmp)
+
+            def download(digest: str) -> str:
+                with session.get(f"{base_url}/v2/{image}/blobs/{digest}", headers=headers, stream=True) as resp:
+                    resp.raise_for_status()
+
+                    def chunks():
+                        for chunk in resp.iter_content(chunk_size=1 << 16):
+                            if limiter is not None:
+                                limiter.acquire(len(chunk))
+                            yield chunk
+
+                    return store.put(digest, chunks())
+
+            downloads = []
+            for layer in layers:
+                path = store.get(layer['digest'])
+                downloads.append(path if path is not None else executor.submit(download, layer['digest']))
+            try:
+                for i, download_or_path in enumerate(downloads):
+                    path = download_or_path if isinstance(download_or_path, str) else download_or_path.result()
+                    print(f"  Extracting layer {i + 1}/{len(layers)}: {layers[i]['digest']}")
+                    with tarfile.open(path, mode='r:gz') as tar:
+                        tar.extractall(output_dir)
+            except BaseException:
+                executor.shutdown(cancel_futures=True)
+                raise
+
+        print(f"✓ Extracted {len(layers)} layers to {output_dir}")
+    else:
+        # TODO: Implement the download pipeline
+        # 1. Create a BandwidthLimiter if max_bytes_per_second is set, and a session with make_session
+        # 2. Use cache.blobs, or a BlobStore in a temporary directory if there is no cache
+        # 3. Submit a download to a ThreadPoolExecutor for each layer that isn't stored yet
+        #    - Stream the blob into the store with iter_content, calling the limiter for each chunk
+        # 4. Wait for the downloads in manifest order and extract each layer when it is ready
+        # 5. Cancel the remaining downloads if one fails
+        pass
+
+
+def test_download_and_extract_layers_concurrent(download_and_extract_layers_concurrent, LocalRegistry, make_layer,
+                                                LayerCache):
+    """Test concurrent downloads against a local registry with slow blobs."""
+    print("Testing concurrent layer downloads...")
+
+    with tempfile.TemporaryDirectory() as tmp, LocalRegistry() as registry:
+        contents = [os.urandom(50_000) for _ in range(4)]
+        blobs = [make_layer({'data': content, f'layer{i}': b''}) for i, content in enumerate(contents)]
+        registry.add_image('library/layers', 'latest', blobs)
+        layers = [{'digest': 'sha256:' + hashlib.sha256(blob).hexdigest(), 'size': len(blob)} for blob in blobs]
+        # The first layer is the slowest, so the later ones arrive before it
+        for i, layer in enumerate(layers):
+            registry.delays[layer['digest']] = 0.4 - 0.1 * i
+        serial = sum(registry.delays.values())
+
+        # Test 1: Layers are downloaded in parallel
+        start = time.perf_counter()
+        download_and_extract_layers_concurrent(registry.address, 'library/layers', layers, {},
+                                               os.path.join(tmp, 'parallel'), max_workers=4)
+        elapsed = time.perf_counter() - start
+        assert 1 < registry.max_active <= 4, f"Expected up to 4 simultaneous downloads, got {registry.max_active}"
+        assert elapsed < 0.8 * serial, f"Downloads took {elapsed:.2f}s of {serial:.2f}s serially, they should overlap"
+        print(f"✓ 4 layers downloaded in parallel in {elapsed:.2f}s ({serial:.2f}s serially)")
+
+        # Test 2: Layers are applied in manifest order
+        with open(os.path.join(tmp, 'parallel', 'data'), 'rb') as f:
+            assert f.read() == contents[-1], "The last layer's file should win"
+        assert all(os.path.exists(os.path.join(tmp, 'parallel', f'layer{i}')) for i in range(4))
+        print("✓ Layers are extracted in manifest order")
+
+        # Test 3: The concurrency limit is respected
+        registry.max_active = 0
+        download_and_extract_layers_concurrent(registry.address, 'library/layers', layers, {},
+                                               os.path.join(tmp, 'two'), max_workers=2)
+        assert 1 < registry.max_active <= 2, f"Expected at most 2 simultaneous downloads, got {registry.max_active}"
+        print("✓ Concurrency limit works")
+
+        # Test 4: The bandwidth limit is respected
+        registry.delays.clear()
+        total = sum(len(blob) for blob in blobs)
+        start = time.perf_counter()
+        download_and_extract_layers_concurrent(registry.address, 'library/layers', layers, {},
+                                               os.path.join(tmp, 'limited'), max_bytes_per_second=total / 0.5)
+        elapsed = time.perf_counter() - start
+        assert elapsed > 0.3, f"Downloading {total} bytes at {total / 0.5:.0f} B/s took only {elapsed:.2f}s"
+        print(f"✓ Bandwidth limit works ({elapsed:.2f}s)")
+
+        # Test 5: Cached layers aren't downloaded again
+        cache = LayerCache(os.path.join(tmp, 'cache'))
+        download_and_extract_layers_concurrent(registry.address, 'library/layers', layers, {},
+                                               os.path.join(tmp, 'cached1'), cache=cache)
+        requests_before = len(registry.requests)
+        download_and_extract_layers_concurrent(registry.address, 'library/layers', layers, {},
+                                               os.path.join(tmp, 'cached2'), cache=cache)
+        assert len(registry.requests) == requests_before, "Cached layers should not be downloaded"
+        assert cache.stats()['blobs'] == {'hits': 4, 'misses': 4}, f"Unexpected stats {cache.stats()}"
+        print("✓ Cached layers are reused")
+
+    print("✓ Concurrent download tests passed!\n" + "=" * 60)
+
+test_download_and_extract_layers_concurrent(download_and_extract_layers_concurrent, LocalRegistry, make_layer,
+                                            LayerCache)
+
+# %%
+"""
+How does the pull time change with the number of workers? Each of the 6 layers below takes between 0.1 and 0.6 seconds to download.
+"""
+
+
+def benchmark_concurrent_downloads(worker_counts=(1, 2, 4, 8)) -> None:
+    with tempfile.TemporaryDirectory() as tmp, LocalRegistry() as registry:
+        blobs = [make_layer({f'layer{i}': os.urandom(100_000)}) for i in range(6)]
+        registry.add_image('library/benchmark', 'latest', blobs)
+        layers = [{'digest': 'sha256:' + hashlib.sha256(blob).hexdigest(), 'size': len(blob)} for blob in blobs]
+        for i, layer in enumerate(layers):
+            registry.delays[layer['digest']] = 0.1 * (i + 1)
+        for max_workers in worker_counts:
+            start = time.perf_counter()
+            download_and_extract_layers_concurrent(registry.address, 'library/benchmark', layers, {},
+                                                   os.path.join(tmp, str(max_workers)), max_workers=max_workers)
+            print(f"{max_workers} workers: {time.perf_counter() - start:.2f}s (largest layer: 0.6s)")
+
+
+if __name__ == "__main__":
+    benchmark_concurrent_downloads()
+
+# %%
+"""
+### Exercise 1.9: Streaming Extraction
+
+> **Difficulty**: 🔴🔴🔴⚪⚪
+> **Importance**: 🔵🔵⚪⚪⚪
+>
+> You should spend up to ~20 minutes on this exercise.
+
+`download_and_extract_layers` passes `BytesIO(blob_resp.content)` to `tarfile.open`, so the whole compressed blob is held in memory before extraction starts. A 1 GB layer needs more than 1 GB of RAM, and nothing is extracted until the last byte has arrived.
+
+Neither gzip nor tar needs the whole archive at once:
+- zlib decompresses incrementally, a chunk at a time.
+- A tar archive is a sequence of 512-byte headers, each followed by the file's data, so it can be read front to back.
+
+`tarfile` supports this with its **stream modes**: `mode='r|gz'` (note the `|` instead of `:`) reads from any object with a `read(size)` method, decompresses it on the fly and never seeks backwards. We only need to turn the response's chunk iterator into such an object.
+
+`HashingReader` is that adapter. It also hashes every compressed chunk it hands out, so the digest can be checked without a second pass. The check can only happen after the last byte, and by then the files have already been extracted. A layer that fails the check must therefore be treated as a failed pull.
+
+Memory use is now bounded by the chunk size plus `tarfile`'s and zlib's small buffers, no matter how large the layer is.
+"""
+
+import tracemalloc
+
+
+class HashingReader:
+    """A file-like object reading from an iterator of byte chunks, hashing the chunks it reads."""
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.chunk = b''
+        self.offset = 0  # Position in the current chunk
+        self.sha256 = hashlib.sha256()
+        self.bytes_read = 0
+
+    def read(self, size: int = -1) -> bytes:
+        """Read up to size bytes (all remaining bytes if size is negative), less only at the end of the data."""
+        if "SOLUTION":
+            parts = []
+            while size != 0:
+                if self.offset == len(self.chunk):
+                    chunk = next(self.chunks, None)
+                    if chunk is None:
+                        break
+                    self.chunk, self.offset = chunk, 0
+                    self.sha256.update(chunk)
+                    self.bytes_read += len(chunk)
+                    continue
+                end = len(self.chunk) if size < 0 else min(len(self.chunk), self.offset + size)
+                parts.append(self.chunk[self.offset:end])
+                if size > 0:
+                    size -= end - self.offset
+                self.offset = end
+            return b''.join(parts)
+        else:
+            # TODO: Implement read
+            # - Hand out the rest of the current chunk before taking the next one from the iterator
+            # - Hash each chunk when taking it from the iterator
+            # - Copy only the bytes that are returned, not the whole chunk
+            pass
+
+    def hexdigest(self) -> str:
+        return 'sha256:' + self.sha256.hexdigest()
+
+
+def extract_layer_stream(chunks, digest: str, output_dir: str) -> int:
+    """
+    Extract a gzipped tar layer while it is being downloaded.
+
+    Args:
+        chunks: Iterator of the compressed blob's bytes, e.g. resp.iter_content(chunk_size)
+        digest: Expected digest of the compressed blob
+        output_dir: Directory to extract to
+
+    Returns:
+        The size of the compressed blob
+
+    Raises:
+        ValueError: If the blob doesn't match the digest
+    """
+    if "SOLUTION":
+        reader = HashingReader(chunks)
+        with tarfile.open(fileobj=reader, mode='r|gz') as tar:
+            tar.extractall(output_dir)
+        # Padding after the end of the archive is part of the blob too
+        while reader.read(1 << 16):
+            pass
+        if reader.hexdigest() != digest:
+            raise ValueError(f"Digest mismatch: expected {digest}, got {reader.hexdigest()}")
+        return reader.bytes_read
+    else:
+        # TODO: Implement streaming extraction
+        # 1. Wrap the chunks in a HashingReader
+        # 2. Open it with tarfile in 'r|gz' mode and extract everything
+        # 3. Read whatever is left of the blob, a bounded amount at a time
+        # 4. Compare the hash with the digest
+        pass
+
+
+def download_and_extract_layers_streaming(registry: str, image: str, layers: List[Dict[str, Any]],
+                                          headers: Dict[str, str], output_dir: str,
+                                          chunk_size: int = 1 << 16) -> None:
+    """Like download_and_extract_layers, but extract each layer while downloading it."""
+    if "SOLUTION":
+        os.makedirs(output_dir, exist_ok=True)
+        with requests.Session() as session:
+            for i, layer in enumerate(layers):
+                blob_url = f"{registry_url(registry)}/v2/{image}/blobs/{layer['digest']}"
+                with session.get(blob_url, headers=headers, stream=True) as resp:
+                    resp.raise_for_status()
+                    size = extract_layer_stream(resp.iter_content(chunk_size), layer['digest'], output_dir)
+                print(f"  Extracted layer {i + 1}/{len(layers)}: {layer['digest']} ({size} bytes)")
+        print(f"✓ Extracted {len(layers)} layers to {output_dir}")
+    else:
+        # TODO: For each layer, stream the response's chunks into extract_layer_stream
+        pass
+
+
+def test_extract_layer_stream(extract_layer_stream, download_and_extract_layers_streaming, HashingReader,
+                              LocalRegistry, make_layer):
+    """Test streaming extraction against a local registry."""
+    print("Testing streaming extraction...")
+
+    # Test 1: HashingReader returns the same bytes for any read sizes
+    data = os.urandom(10_000)
+    reader = HashingReader(data[i:i + 1000] for i in range(0, len(data), 1000))
+    parts = [reader.read(size) for size in [0, 1, 999, 1500, 3, 4000]]
+    parts.append(reader.read())
+    assert b''.join(parts) == data, "Reads should return the data in order"
+    assert reader.read(10) == b'', "Reading at the end should return no data"
+    assert reader.hexdigest() == 'sha256:' + hashlib.sha256(data).hexdigest(), "Hash should cover all data"
+    print("✓ HashingReader works")
+
+    with tempfile.TemporaryDirectory() as tmp, LocalRegistry() as registry:
+        big = os.urandom(4 << 20)
+        blobs = [make_layer({'big': big, 'etc/motd': b'old\n'}), make_layer({'etc/motd': b'new\n'})]
+        registry.add_image('library/stream', 'latest', blobs)
+        layers = [{'digest': 'sha256:' + hashlib.sha256(blob).hexdigest(), 'size': len(blob)} for blob in blobs]
+
+        # Test 2: Layers are extracted in order while downloading
+        download_and_extract_layers_streaming(registry.address, 'library/stream', layers, {},
+                                              os.path.join(tmp, 'out'))
+        with open(os.path.join(tmp, 'out', 'etc', 'motd'), 'rb') as f:
+            assert f.read() == b'new\n', "The second layer should overwrite the first"
+        assert os.path.getsize(os.path.join(tmp, 'out', 'big')) == len(big), "Large file should be extracted"
+        print("✓ Layers are extracted in order")
+
+        # Test 3: Memory use doesn't grow with the layer size (measured on a second pull, so that imports and
+        # connection setup of the first one don't count)
+        tracemalloc.start()
+        try:
+            download_and_extract_layers_streaming(registry.address, 'library/stream', layers, {},
+                                                  os.path.join(tmp, 'out2'))
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        assert peak < 1 << 20, f"Peak memory was {peak / (1 << 20):.1f} MiB for a 4 MiB layer"
+        print(f"✓ Extracted a 4 MiB layer with {peak / 1024:.0f} KiB peak memory")
+
+        # Test 4: A blob that doesn't match its digest is rejected
+        try:
+            extract_layer_stream(iter([blobs[1]]), layers[0]['digest'], os.path.join(tmp, 'bad'))
+            assert False, "Should have raised ValueError for a wrong digest"
+        except ValueError:
+            pass
+        print("✓ Digest is verified while streaming")
+
+    print("✓ Streaming extraction tests passed!\n" + "=" * 60)
+
+test_extract_layer_stream(extract_layer_stream, download_and_extract_layers_streaming, HashingReader,
+                          LocalRegistry, make_layer)
+
+# %%
+"""
+How much memory does extracting a layer take when buffering the whole blob, compared to streaming it?
+"""
+
+
+def benchmark_streaming_extraction(layer_mib: int = 32) -> None:
+    with tempfile.TemporaryDirectory() as tmp, LocalRegistry() as registry:
+        blob = make_layer({'data': os.urandom(layer_mib << 20)})
+        digest = registry.add_blob(blob)
+        url = f"{registry_url(registry.address)}/v2/library/benchmark/blobs/{digest}"
+
+        def buffered():
+            resp = requests.get(url, stream=True)
+            with tarfile.open(fileobj=BytesIO(resp.content), mode='r:gz') as tar:
+                tar.extractall(os.path.join(tmp, 'buffered'))
+
+        def streaming():
+            with requests.get(url, stream=True) as resp:
+                extract_layer_stream(resp.iter_content(1 << 16), digest, os.path.join(tmp, 'streaming'))
+
+        for name, extract in [('buffered', buffered), ('streaming', streaming)]:
+            tracemalloc.start()
+            start = time.perf_counter()
+            extract()
+            elapsed = time.perf_counter() - start
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print(f"{name:>9}: {elapsed:.2f}s, peak memory {peak / (1 << 20):6.2f} MiB for a {layer_mib} MiB layer")
+
+
+if __name__ == "__main__":
+    benchmark_streaming_extraction()
+
+# %%
+"""
+### Exercise 1.10: Merging Layers Before Extracting Them
+
+> **Difficulty**: 🔴🔴🔴🔴⚪
+> **Importance**: 🔵🔵🔵⚪⚪
+>
+> You should spend up to ~30 minutes on this exercise.
+
+Untarring the layers on top of each other has two problems:
+
+1. **Deleted files come back.** A layer can't contain "the absence of a file", so when a Dockerfile step runs `rm /etc/old.conf`, the layer records a *whiteout*: an empty file named `/etc/.wh.old.conf`. Docker's storage driver hides `/etc/old.conf` from lower layers when it sees this file. `extractall` instead creates `/etc/old.conf` from the lower layer and then a stray `/etc/.wh.old.conf` next to it. An *opaque whiteout* `dir/.wh..wh..opq` hides everything that lower layers put in `dir` (e.g. after `rm -rf dir && mkdir dir`). See the [OCI image spec on whiteouts](https://github.com/opencontainers/image-spec/blob/main/layer.md#whiteouts).
+2. **Overwritten files are written anyway.** When every layer rewrites the same files (package databases, `pip` caches, a rebuilt application), we write each version to disk only to overwrite it moments later.
+
+A tar archive can be read twice: a first pass that only reads headers, and a second pass that writes files. So we can:
+1. Build an index of the final root filesystem, `path -> (layer, member)`, going through the layers in order. For each layer, first apply its whiteouts to what the lower layers contributed, then add its entries. An entry replaces the lower one at the same path and, unless both are directories, everything below it. A file also replaces any lower entry at one of its parent paths that isn't a directory.
+2. Extract from each layer only the members that the index points to. Every file of the final image is written exactly once and no whiteout files end up on disk.
+
+To remove a directory's subtree from the index without scanning every path, keep a `children` map from each directory to the paths directly inside it.
+
+Hard links need care: `tarfile` extracts a hard link by linking to its target on disk, or by reading the target from the same archive. If a higher layer replaces the target, the version the link points to is never written, so the link is written as a regular file with the content of the member it pointed to.
+
+Layers in a `LayerCache` can be merged with `extract_layers_merged([cache.blobs.path(layer['digest']) for layer in layers], output_dir)`.
+"""
+
+import contextlib
+import copy
+from typing import Set
+
+WHITEOUT_PREFIX = '.wh.'
+OPAQUE_WHITEOUT = '.wh..wh..opq'
+
+
+def build_rootfs_index(tars: List[tarfile.TarFile]) -> Dict[str, Tuple[int, tarfile.TarInfo]]:
+    """
+    Merge the members of layers into the final filesystem, applying whiteouts.
+
+    Args:
+        tars: Open layer archives, lowest layer first
+
+    Returns:
+        Dictionary from normalized path to (layer index, member) of the entry that ends up at that path
+    """
+    if "SOLUTION":
+        index: Dict[str, Tuple[int, tarfile.TarInfo]] = {}
+        children: Dict[str, Set[str]] = {}
+        # Hard link path -> (its entry, target path, target entry, regular file entry the link resolves to)
+        links: Dict[str, Tuple[Tuple[int, tarfile.TarInfo], str, Tuple[int, tarfile.TarInfo],
+                               Tuple[int, tarfile.TarInfo]]] = {}
+
+        def remove(path: str) -> None:
+            index.pop(path, None)
+            children.get(os.path.dirname(path), set()).discard(path)
+            for child in children.pop(path, set()):
+                remove(child)
+
+        for i, tar in enumerate(tars):
+            entries = []
+            for member in tar.getmembers():
+                path = os.path.normpath(member.name).lstrip('/')
+                directory, name = os.path.split(path)
+                if name == OPAQUE_WHITEOUT:
+                    for child in list(children.get(directory, ())):
+                        remove(child)
+                elif name.startswith(WHITEOUT_PREFIX):
+                    remove(os.path.join(directory, name[len(WHITEOUT_PREFIX):]))
+                else:
+                    entries.append((path, member))
+
+            # Whiteouts only hide lower layers, so this layer's entries are added after applying all of them
+            for path, member in entries:
+                lower = index.get(path)
+                if not member.isdir() or (lower is not None and not lower[1].isdir()):
+                    remove(path)  # Including any children, also of directories without an entry of their own
+                parent = os.path.dirname(path)
+                while parent:
+                    if parent in index and not index[parent][1].isdir():
+                        remove(parent)
+                    parent = os.path.dirname(parent)
+                index[path] = entry = (i, member)
+                children.setdefault(os.path.dirname(path), set()).add(path)
+                if member.islnk():
+                    target_path = os.path.normpath(member.linkname).lstrip('/')
+                    target = index.get(target_path)
+                    if target is not None:
+                        resolved = links[target_path][3] if target_path in links else target
+                        links[path] = (entry, target_path, target, resolved)
+
+        # A hard link whose target was replaced or removed by a higher layer can't be extracted as a link,
+        # because the file it points to is never written. Write the file it pointed to at its path instead.
+        for path, (entry, target_path, target, (j, file)) in links.items():
+            if index.get(path) is entry and index.get(target_path) is not target:
+                resolved = copy.copy(file)
+                resolved.name = entry[1].name
+                index[path] = (j, resolved)
+        return index
+    else:
+        # TODO: Implement the index
+        # For each layer:
+        # 1. Apply its whiteouts: remove the whited out path and its subtree, or for an opaque whiteout,
+        #    everything in the directory
+        # 2. Add its other entries, removing what they replace (see above)
+        # Keep a children map to remove subtrees quickly
+        # Finally, replace hard links whose target is no longer the one they pointed to by a copy of the member
+        # they pointed to, renamed to the link's path
+        pass
+
+
+def extract_layers_merged(layer_paths: List[str], output_dir: str) -> Dict[str, int]:
+    """
+    Extract gzipped tar layers into output_dir, writing each entry of the final filesystem once.
+
+    Args:
+        layer_paths: Paths of the layer blobs, lowest layer first
+        output_dir: Directory to extract to, should be empty
+
+    Returns:
+        Statistics: entries in all layers, whiteouts, entries written and bytes written and skipped
+    """
+    if "SOLUTION":
+        os.makedirs(output_dir, exist_ok=True)
+        with contextlib.ExitStack() as stack:
+            tars = [stack.enter_context(tarfile.open(path, mode='r:gz')) for path in layer_paths]
+            index = build_rootfs_index(tars)
+            selected: List[List[tarfile.TarInfo]] = [[] for _ in tars]
+            for i, member in index.values():
+                selected[i].append(member)
+            final = {id(member) for _, member in index.values()}
+            stats = {'entries': 0, 'whiteouts': 0, 'written': 0, 'bytes_written': 0, 'bytes_skipped': 0}
+            for tar, layer_selected in zip(tars, selected):
+                members = tar.getmembers()
+                # In archive order, so that the second pass reads each layer front to back
+                layer_selected.sort(key=lambda member: member.offset)
+                tar.extractall(output_dir, members=layer_selected)
+
+                stats['entries'] += len(members)
+                stats['whiteouts'] += sum(os.path.basename(m.name).startswith(WHITEOUT_PREFIX) for m in members)
+                stats['written'] += len(layer_selected)
+                stats['bytes_written'] += sum(member.size for member in layer_selected)
+                stats['bytes_skipped'] += sum(member.size for member in members if id(member) not in final)
+        return stats
+    else:
+        # TODO: Implement merged extraction
+        # 1. Open all layers (contextlib.ExitStack closes them again) and build the index
+        # 2. For each layer, extract the members that the index points to, in archive order (by offset)
+        # 3. Count the statistics
+        pass
+
+
+def test_extract_layers_merged(extract_layers_merged, make_layer):
+    """Test whiteouts, opaque directories and replaced entries."""
+    print("Testing merged layer extraction...")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        layers = [
+            make_layer({'etc/passwd': b'root\n', 'etc/old.conf': b'old\n', 'var/cache/a': b'a', 'var/cache/b': b'b',
+                        'opt': b'a file', 'lib/libc.so': b'libc', 'home/user/.bashrc': b'bashrc'}),
+            make_layer({'etc/.wh.old.conf': b'', 'var/cache/.wh..wh..opq': b'', 'var/cache/c': b'c',
+                        'etc/passwd': b'root\nuser\n', 'opt/tool': b'tool', 'lib': b'now a file',
+                        'home/.wh.user': b''}),
+            make_layer({'etc/.wh.passwd': b'', 'etc/passwd': b'root\nadmin\n'}),
+        ]
+        layer_paths = []
+        for i, blob in enumerate(layers):
+            layer_paths.append(os.path.join(tmp, f'layer{i}.tar.gz'))
+            with open(layer_paths[-1], 'wb') as f:
+                f.write(blob)
+        output_dir = os.path.join(tmp, 'rootfs')
+        stats = extract_layers_merged(layer_paths, output_dir)
+
+        def read(path):
+            with open(os.path.join(output_dir, path), 'rb') as f:
+                return f.read()
+
+        # Test 1: Whiteouts delete files and directories of lower layers
+        assert not os.path.exists(os.path.join(output_dir, 'etc', 'old.conf')), "Whited out file should be gone"
+        assert not os.path.exists(os.path.join(output_dir, 'home', 'user')), "Whited out directory should be gone"
+        print("✓ Whiteouts work")
+
+        # Test 2: Opaque directories hide the lower layers' contents
+        assert sorted(os.listdir(os.path.join(output_dir, 'var', 'cache'))) == ['c'], "Only c should be left"
+        print("✓ Opaque whiteouts work")
+
+        # Test 3: Entries replace files and directories of lower layers
+        assert read('etc/passwd') == b'root\nadmin\n', "Whiteouts only hide lower layers, not the same layer"
+        assert read('opt/tool') == b'tool', "A directory should replace a file"
+        assert read('lib') == b'now a file', "A file should replace a directory"
+        print("✓ Replaced entries work")
+
+        # Test 4: No whiteout files are written, and every file only once
+        for _, _, files in os.walk(output_dir):
+            assert not any(name.startswith('.wh.') for name in files), f"Whiteout files were extracted: {files}"
+        assert stats['entries'] == 16 and stats['whiteouts'] == 4, f"Unexpected stats {stats}"
+        assert stats['written'] == 4, f"Only the 4 final files should be written, got {stats}"
+        print(f"✓ Wrote {stats['written']} of {stats['entries']} entries")
+
+        # Test 5: Hard links survive a higher layer replacing their target
+        def hard_link(name, target):
+            buffer = BytesIO()
+            with tarfile.open(fileobj=buffer, mode='w:gz') as tar:
+                info = tarfile.TarInfo(name)
+                info.type, info.linkname = tarfile.LNKTYPE, target
+                tar.addfile(info)
+            return buffer.getvalue()
+
+        layers = [make_layer({'a': b'old a', 'c': b'c'}), hard_link('b', 'a'), hard_link('d', 'c'),
+                  make_layer({'a': b'new a'})]
+        for i, blob in enumerate(layers):
+            with open(os.path.join(tmp, f'link{i}.tar.gz'), 'wb') as f:
+                f.write(blob)
+        output_dir = os.path.join(tmp, 'links')
+        extract_layers_merged([os.path.join(tmp, f'link{i}.tar.gz') for i in range(len(layers))], output_dir)
+        assert read('a') == b'new a' and read('b') == b'old a', "The link should keep the replaced target's content"
+        assert os.path.samefile(os.path.join(output_dir, 'c'), os.path.join(output_dir, 'd')), \
+            "A link to an unchanged target should stay a hard link"
+        print("✓ Hard links work")
+
+    print("✓ Merged extraction tests passed!\n" + "=" * 60)
+
+test_extract_layers_merged(extract_layers_merged, make_layer)
+
+# %%
+"""
+For a deep image where every layer rewrites the same files, how much do we save compared to extracting each layer on top of the previous one?
+"""
+
+
+def benchmark_merged_extraction(n_layers: int = 10, n_files: int = 200, file_size: int = 20_000) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        layer_paths = []
+        for i in range(n_layers):
+            layer_paths.append(os.path.join(tmp, f'layer{i}.tar.gz'))
+            with open(layer_paths[-1], 'wb') as f:
+                f.write(make_layer({f'app/file{j}': os.urandom(file_size) for j in range(n_files)}))
+
+        start = time.perf_counter()
+        for path in layer_paths:
+            with tarfile.open(path, mode='r:gz') as tar:
+                tar.extractall(os.path.join(tmp, 'layered'))
+        layered = time.perf_counter() - start
+        print(f"extractall per layer: {layered:.2f}s, {n_layers * n_files * file_size / 1e6:.0f} MB written")
+
+        start = time.perf_counter()
+        stats = extract_layers_merged(layer_paths, os.path.join(tmp, 'merged'))
+        merged = time.perf_counter() - start
+        print(f"merged: {merged:.2f}s, {stats['bytes_written'] / 1e6:.0f} MB written, "
+              f"{stats['bytes_skipped'] / 1e6:.0f} MB skipped")
+
+
+if __name__ == "__main__":
+    benchmark_merged_extraction()
+
+# %%
+"""
+### Exercise 1.11: A Registry Client
+
+> **Difficulty**: 🔴🔴🔴🔴⚪
+> **Importance**: 🔵🔵🔵🔵⚪
+>
+> You should spend up to ~40 minutes on this exercise.
+
+`get_auth_token`, `get_target_manifest` and `get_manifest_layers` each call `requests.get`, which opens a new connection (with a TLS handshake for HTTPS) for every request. Every pull also fetches a new token, although a Docker Hub token is valid for 5 minutes. Pulling many images, say for a CI run, repeats all that work for every image.
+
+Let's put everything we've built into a `RegistryClient` that keeps state between calls:
+
+- **Connection pooling**: one `requests.Session` (see `make_session`) keeps connections open and reuses them for the next request.
+- **Token caching**: instead of hard-coding Docker Hub's auth server, do what the [token authentication spec](https://distribution.github.io/distribution/spec/auth/token/) describes. Send the request without a token. If the registry answers `401 Unauthorized`, its `WWW-Authenticate` header names the auth server (`realm`), `service` and `scope`, e.g. `Bearer realm="https://auth.docker.io/token",service="registry.docker.io",scope="repository:library/alpine:pull"`. Fetch a token for that scope and send the request again. Tokens are cached per registry and scope in a `TTLCache`, for `expires_in` seconds from the token response (60 if it doesn't say) minus a safety margin, so that a token doesn't expire on its way to the registry.
+- **Conditional requests**: registries send an `ETag` header with manifests. When we ask for a tag again, we send the ETag in an `If-None-Match` header. If the tag still points to the same manifest, the registry answers `304 Not Modified` without a body, and we use the cached manifest. Manifests requested by digest never change, so cached ones are used without asking at all.
+- **Retries**: `429 Too Many Requests`, 5xx server errors and connection errors are often temporary. Try again up to `retries` times, waiting `backoff * 2**attempt` seconds between tries (or as long as a `Retry-After` header asks for).
+
+`pull` then downloads the layers concurrently into a `BlobStore` and extracts them with `extract_layers_merged`.
+"""
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class RegistryClient:
+    """Registry API client reusing connections, tokens and manifests across calls and images."""
+
+    def __init__(self, max_connections: int = 8, retries: int = 3, backoff: float = 0.5, token_margin: float = 10,
+                 clock=time.monotonic, sleep=time.sleep):
+        self.session = make_session(max_connections)
+        self.max_connections = max_connections
+        self.retries = retries
+        self.backoff = backoff
+        self.token_margin = token_margin
+        self.sleep = sleep
+        self.tokens = TTLCache(clock)  # (registry, scope) -> token
+        # (registry, image, reference) -> (ETag, digest, manifest)
+        self.manifests: Dict[Tuple[str, str, str], Tuple[Optional[str], str, Dict[str, Any]]] = {}
+        self.lock = Lock()
+        self.counts = {'requests': 0, 'retries': 0, 'tokens_fetched': 0, 'not_modified': 0}
+
+    def count(self, name: str) -> None:
+        with self.lock:
+            self.counts[name] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self.counts, 'tokens': {'hits': self.tokens.hits, 'misses': self.tokens.misses}}
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        """GET url with the session, retrying temporary failures with exponential backoff."""
+        if "SOLUTION":
+            for attempt in range(self.retries + 1):
+                self.count('requests')
+                try:
+                    resp = self.session.get(url, timeout=30, **kwargs)
+                except requests.ConnectionError:
+                    if attempt == self.retries:
+                        raise
+                    delay = self.backoff * 2 ** attempt
+                else:
+                    if resp.status_code not in RETRY_STATUSES or attempt == self.retries:
+                        return resp
+                    retry_after = resp.headers.get('Retry-After', '')
+                    delay = float(retry_after) if retry_after.isdigit() else self.backoff * 2 ** attempt
+                    resp.close()
+                self.count('retries')
+                self.sleep(delay)
+        else:
+            # TODO: Send the request with self.session.get, retrying up to self.retries times on
+            # requests.ConnectionError or a status in RETRY_STATUSES
+            # - Wait self.backoff * 2**attempt seconds (or Retry-After) with self.sleep before retrying
+            # - Return the last response once retries are exhausted, or raise the last connection error
+            pass
+
+    def fetch_token(self, registry: str, scope: str, challenge: str) -> str:
+        """Get a token as described by a WWW-Authenticate challenge and cache it."""
+        if "SOLUTION":
+            params = dict(re.findall(r'(\w+)="([^"]*)"', challenge))
+            resp = self.get(params['realm'], params={'service': params.get('service'),
+                                                     'scope': params.get('scope', scope)})
+            resp.raise_for_status()
+            body = resp.json()
+            token = body.get('token') or body['access_token']
+            expires_in = body.get('expires_in') or 60
+            self.tokens.set((registry, scope), token, max(0, expires_in - self.token_margin))
+            self.count('tokens_fetched')
+            return token
+        else:
+            # TODO: Parse realm, service and scope from the challenge, request a token from the realm,
+            # and cache it for expires_in (default 60) minus token_margin seconds
+            pass
+
+    def request(self, registry: str, image: str, path: str, headers: Optional[Dict[str, str]] = None,
+                stream: bool = False) -> requests.Response:
+        """
+        GET a path of a registry for an image, authenticating with a cached or new token if needed.
+
+        Raises:
+            requests.HTTPError: For error responses, after retrying temporary ones
+        """
+        if "SOLUTION":
+            scope = f"repository:{image}:pull"
+            url = f"{registry_url(registry)}{path}"
+            token = self.tokens.get((registry, scope))
+            for authenticated in [False, True]:
+                auth = {'Authorization': f'Bearer {token}'} if token else {}
+                resp = self.get(url, headers={**(headers or {}), **auth}, stream=stream)
+                if resp.status_code == 401 and 'WWW-Authenticate' in resp.headers and not authenticated:
+                    resp.close()
+                    token = self.fetch_token(registry, scope, resp.headers['WWW-Authenticate'])
+                    continue
+                break
+            resp.raise_for_status()
+            return resp
+        else:
+            # TODO: Send the request with the cached token of (registry, scope), if any
+            # - On a 401 with a WWW-Authenticate header, fetch a token and send the request once more
+            # - Raise for error statuses
+            pass
+
+    def get_manifest(self, registry: str, image: str, reference: str) -> Dict[str, Any]:
+        """Get a manifest or index by tag or digest, reusing cached manifests."""
+        if "SOLUTION":
+            key = (registry, image, reference)
+            cached = self.manifests.get(key)
+            if cached is not None and reference.startswith('sha256:'):
+                return cached[2]
+            headers = {'Accept': MANIFEST_ACCEPT}
+            if cached is not None and cached[0]:
+                headers['If-None-Match'] = cached[0]
+            resp = self.request(registry, image, f"/v2/{image}/manifests/{reference}", headers)
+            if resp.status_code == 304:
+                self.count('not_modified')
+                return cached[2]
+            manifest = resp.json()
+            digest = resp.headers.get('Docker-Content-Digest') or 'sha256:' + hashlib.sha256(resp.content).hexdigest()
+            # Also cache it by digest, so a later request for the digest doesn't go to the registry
+            self.manifests[key] = self.manifests[registry, image, digest] = (resp.headers.get('ETag'), digest, manifest)
+            return manifest
+        else:
+            # TODO: Implement get_manifest
+            # - Return cached manifests fetched by digest without a request
+            # - Send the cached ETag in If-None-Match, and use the cached manifest on 304
+            # - Cache the manifest with its ETag and digest (Docker-Content-Digest, or the SHA-256 of the body)
+            #   under both the reference and the digest
+            pass
+
+    def get_target_manifest(self, registry: str, image: str, tag: str, target_arch: str,
+                            target_variant: Optional[str] = None) -> str:
+        """Like get_target_manifest: the digest of the tag's manifest for the target architecture."""
+        manifest_list = self.get_manifest(registry, image, tag)
+        if 'manifests' not in manifest_list:
+            # Not an index: return the digest the manifest is cached under, so get_manifest_layers doesn't
+            # request the tag again
+            return self.manifests[registry, image, tag][1]
+        available = []
+        for manifest in manifest_list['manifests']:
+            platform = manifest.get('platform', {})
+            if platform.get('architecture') == target_arch and (
+                    not target_variant or platform.get('variant') == target_variant):
+                return manifest['digest']
+            available.append(' '.join(filter(None, [platform.get('architecture'), platform.get('variant')])))
+        raise ValueError(f"No manifest found for architecture {target_arch}"
+                         f"{f' variant {target_variant}' if target_variant else ''}. "
+                         f"Available: {', '.join(available)}")
+
+    def get_manifest_layers(self, registry: str, image: str, manifest_digest: str) -> List[Dict[str, Any]]:
+        """Like get_manifest_layers."""
+        return self.get_manifest(registry, image, manifest_digest)['layers']
+
+    def download_blob(self, registry: str, image: str, digest: str, store: BlobStore) -> str:
+        """Download a blob into store and return its path."""
+        with self.request(registry, image, f"/v2/{image}/blobs/{digest}", stream=True) as resp:
+            return store.put(digest, resp.iter_content(chunk_size=1 << 16))
+
+    def pull(self, image_ref: str, output_dir: str, store: BlobStore, target_arch: str = TARGET_ARCH,
+             target_variant: Optional[str] = TARGET_VARIANT) -> None:
+        """Pull an image into output_dir, downloading its layers concurrently into store."""
+        registry, image, tag = parse_image_reference(image_ref)
+        manifest_digest = self.get_target_manifest(registry, image, tag, target_arch, target_variant)
+        layers = self.get_manifest_layers(registry, image, manifest_digest)
+        # Look up stored blobs in this thread, the store's hit and miss counts aren't locked
+        paths = [store.get(layer['digest']) for layer in layers]
+        missing = [i for i, path in enumerate(paths) if path is None]
+        with ThreadPoolExecutor(max_workers=self.max_connections) as executor:
+            downloaded = executor.map(lambda i: self.download_blob(registry, image, layers[i]['digest'], store),
+                                      missing)
+            for i, path in zip(missing, downloaded):
+                paths[i] = path
+        extract_layers_merged(paths, output_dir)
+        print(f"✓ Pulled {image_ref} to {output_dir}")
+
+    def close(self) -> None:
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def test_registry_client(RegistryClient, BlobStore, LocalRegistry, make_layer):
+    """Test connection reuse, token caching, conditional requests and retries against a local registry."""
+    print("Testing the registry client...")
+
+    with tempfile.TemporaryDirectory() as tmp, LocalRegistry(token_expires_in=60) as registry:
+        base = make_layer({'etc/os-release': b'NAME=Test\n'})
+        registry.add_image('library/base', 'latest', [base])
+        registry.add_image('library/app', 'latest', [base, make_layer({'app/main.py': b'print("hello")\n'})])
+        now = [0.0]
+        sleeps = []
+        client = RegistryClient(max_connections=2, clock=lambda: now[0], sleep=sleeps.append)
+        store = BlobStore(os.path.join(tmp, 'blobs'))
+        app, base_ref = f"{registry.address}/library/app:latest", f"{registry.address}/library/base:latest"
+
+        # Test 1: Pulls work with token authentication, reusing connections
+        client.pull(app, os.path.join(tmp, 'app1'), store)
+        client.pull(base_ref, os.path.join(tmp, 'base'), store)
+        assert os.path.exists(os.path.join(tmp, 'app1', 'app', 'main.py')), "Image should be extracted"
+        assert os.path.exists(os.path.join(tmp, 'base', 'etc', 'os-release')), "Image should be extracted"
+        assert registry.connections <= 2, f"Expected at most 2 connections, got {registry.connections}"
+        print(f"✓ {len(registry.requests)} requests over {registry.connections} connections")
+
+        # Test 2: Tokens are fetched once per scope
+        token_requests = [path for path in registry.requests if path.startswith('/token')]
+        assert len(token_requests) == 2, f"Expected one token per image, got {token_requests}"
+        print("✓ Tokens are reused")
+
+        # Test 3: Pulling again only revalidates the tag, which is not modified
+        requests_before = len(registry.requests)
+        client.pull(app, os.path.join(tmp, 'app2'), store)
+        assert registry.requests[requests_before:] == ['/v2/library/app/manifests/latest'], \
+            f"Only the tag should be requested, got {registry.requests[requests_before:]}"
+        assert client.stats()['not_modified'] == 1, f"Unexpected stats {client.stats()}"
+        print("✓ Manifests are revalidated with If-None-Match")
+
+        # Test 4: Tokens are renewed before they expire
+        now[0] += 55
+        requests_before = len(registry.requests)
+        client.pull(app, os.path.join(tmp, 'app3'), store)
+        assert registry.requests[requests_before:] == [
+            '/v2/library/app/manifests/latest',
+            '/token?service=local&scope=repository%3Alibrary%2Fapp%3Apull',
+            '/v2/library/app/manifests/latest',
+        ], f"Expected a new token after 55 of 60 seconds, got {registry.requests[requests_before:]}"
+        print("✓ Expired tokens are renewed")
+
+        # Test 5: Temporary failures are retried with exponential backoff
+        registry.failures['/v2/library/app/manifests/latest'] = 2
+        client.pull(app, os.path.join(tmp, 'app4'), store)
+        assert sleeps == [0.5, 1.0], f"Expected backoff of 0.5s and 1s, got {sleeps}"
+        assert client.stats()['retries'] == 2, f"Unexpected stats {client.stats()}"
+        print("✓ Failures are retried")
+
+        # Test 6: Persistent failures raise an error
+        registry.failures['/v2/library/app/manifests/latest'] = 10
+        try:
+            client.pull(app, os.path.join(tmp, 'app5'), store)
+            assert False, "Should have raised HTTPError"
+        except requests.HTTPError as e:
+            assert e.response.status_code == 503, f"Unexpected error {e}"
+        print("✓ Persistent failures raise HTTPError")
+
+        # Test 7: A single-platform tag (no index) is requested once per pull
+        registry.add_image('library/single', 'latest', [base], index=False)
+        single = f"{registry.address}/library/single:latest"
+        requests_before = len(registry.requests)
+        client.pull(single, os.path.join(tmp, 'single1'), store)
+        manifest_requests = {path for path in registry.requests[requests_before:] if '/manifests/' in path}
+        assert manifest_requests == {'/v2/library/single/manifests/latest'}, \
+            f"The manifest should only be requested by tag, got {manifest_requests}"
+        requests_before = len(registry.requests)
+        client.pull(single, os.path.join(tmp, 'single2'), store)
+        assert registry.requests[requests_before:] == ['/v2/library/single/manifests/latest'], \
+            f"Only the tag should be requested, got {registry.requests[requests_before:]}"
+        print("✓ Single-platform manifests are reused by digest")
+        client.close()
+
+    print("✓ Registry client tests passed!\n" + "=" * 60)
+
+test_registry_client(RegistryClient, BlobStore, LocalRegistry, make_layer)
+
+# %%
+"""
+How much do connection reuse and token caching save when pulling many builds of an image? Each connection to the local registry is cheap, so the difference is far larger over the internet, where each new connection needs a TLS handshake with a server that may be 100ms away.
+"""
+
+
+def benchmark_registry_client(n_images: int = 20) -> None:
+    with tempfile.TemporaryDirectory() as tmp, LocalRegistry(token_expires_in=300) as registry:
+        base = make_layer({'etc/os-release': b'NAME=Test\n'})
+        for i in range(n_images):  # Builds of one repository, as in a CI run, so they share a token scope
+            registry.add_image('library/app', f"build{i}", [base, make_layer({'app': os.urandom(1000)})])
+
+        start = time.perf_counter()
+        requests_before, connections_before = len(registry.requests), registry.connections
+        for i in range(n_images):
+            with RegistryClient() as client:  # A new client for every image, like the functions above
+                client.pull(f"{registry.address}/library/app:build{i}", os.path.join(tmp, 'fresh', str(i)),
+                            BlobStore(os.path.join(tmp, 'fresh-blobs')))
+        print(f"client per image: {time.perf_counter() - start:.2f}s, "
+              f"{len(registry.requests) - requests_before} requests, "
+              f"{registry.connections - connections_before} connections")
+
+        start = time.perf_counter()
+        requests_before, connections_before = len(registry.requests), registry.connections
+        with RegistryClient() as client:
+            for i in range(n_images):
+                client.pull(f"{registry.address}/library/app:build{i}", os.path.join(tmp, 'shared', str(i)),
+                            BlobStore(os.path.join(tmp, 'shared-blobs')))
+        print(f"shared client:    {time.perf_counter() - start:.2f}s, "
+              f"{len(registry.requests) - requests_before} requests, "
+              f"{registry.connections - connections_before} connections")
+
+
+if __name__ == "__main__":
+    benchmark_registry_client()
+
 # %%
 """
 #$ Container Isolation: Chroot Environments
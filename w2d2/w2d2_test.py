@@ -14,6 +14,19 @@ from typing import Optional, List, Union, Tuple, Dict, Any
 import subprocess
 import shutil
 import shutil
+import hashlib
+import re
+import tempfile
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+from urllib.parse import parse_qs, urlparse
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+import tracemalloc
+import contextlib
+import copy
+from typing import Set
 import subprocess
 import signal
 import time
@@ -212,6 +225,352 @@ def test_pull_layers_complete(pull_layers):
 
 
 
+
+def test_pull_layers_cached(pull_layers_cached, LayerCache, BlobStore, LocalRegistry, make_layer):
+    """Test cached pulls against a local registry."""
+    print("Testing cached pulls...")
+
+    with tempfile.TemporaryDirectory() as tmp, LocalRegistry() as registry:
+        base = make_layer({'etc/os-release': b'NAME=Test\n', 'bin/sh': b'#!/bin/true\n'})
+        app = make_layer({'app/main.py': b'print("hello")\n'})
+        registry.add_image('library/base', 'latest', [base])
+        registry.add_image('library/app', 'latest', [base, app])
+        now = [0.0]
+        cache = LayerCache(os.path.join(tmp, 'cache'), manifest_ttl=60, clock=lambda: now[0])
+
+        # Test 1: A first pull downloads everything
+        pull_layers_cached(f"{registry.address}/library/app:latest", os.path.join(tmp, 'app1'), cache)
+        with open(os.path.join(tmp, 'app1', 'app', 'main.py'), 'rb') as f:
+            assert f.read() == b'print("hello")\n', "Layer contents should be extracted"
+        assert os.path.exists(os.path.join(tmp, 'app1', 'etc', 'os-release')), "Base layer should be extracted"
+        assert cache.stats()['blobs'] == {'hits': 0, 'misses': 2}, f"Unexpected stats {cache.stats()}"
+        print("✓ First pull downloads all layers")
+
+        # Test 2: Pulling again is served from the cache without any requests
+        requests_before = len(registry.requests)
+        pull_layers_cached(f"{registry.address}/library/app:latest", os.path.join(tmp, 'app2'), cache)
+        assert len(registry.requests) == requests_before, f"Unexpected requests {registry.requests[requests_before:]}"
+        assert cache.stats()['blobs'] == {'hits': 2, 'misses': 2}, f"Unexpected stats {cache.stats()}"
+        assert os.path.exists(os.path.join(tmp, 'app2', 'app', 'main.py')), "Cached layers should be extracted"
+        print("✓ Repeated pull is served from disk")
+
+        # Test 3: Another image shares the base layer
+        requests_before = len(registry.requests)
+        pull_layers_cached(f"{registry.address}/library/base:latest", os.path.join(tmp, 'base'), cache)
+        assert not any('/blobs/' in path for path in registry.requests[requests_before:]), "Base layer is cached"
+        assert cache.stats()['blobs'] == {'hits': 3, 'misses': 2}, f"Unexpected stats {cache.stats()}"
+        print("✓ Layers are shared between images")
+
+        # Test 4: Manifests fetched by tag expire, manifests fetched by digest don't
+        now[0] += 61
+        requests_before = len(registry.requests)
+        pull_layers_cached(f"{registry.address}/library/app:latest", os.path.join(tmp, 'app3'), cache)
+        assert registry.requests[requests_before:] == ['/v2/library/app/manifests/latest'], \
+            f"Only the tag should be fetched again, got {registry.requests[requests_before:]}"
+        print("✓ Tags expire after their TTL")
+
+        # Test 5: Blobs that don't match their digest are rejected
+        store = BlobStore(os.path.join(tmp, 'store'))
+        digest = 'sha256:' + hashlib.sha256(b'layer').hexdigest()
+        try:
+            store.put(digest, [b'tampered'])
+            assert False, "Should have raised ValueError for a wrong digest"
+        except ValueError:
+            pass
+        assert store.get(digest) is None, "A rejected blob should not be stored"
+        assert os.listdir(os.path.join(tmp, 'store', 'sha256')) == [], "No temporary files should be left"
+        path = store.put(digest, [b'la', b'yer'])
+        assert store.get(digest) == path, "A stored blob should be found"
+        with open(path, 'rb') as f:
+            assert f.read() == b'layer', "The stored blob should contain the data"
+        print("✓ Blobs are verified against their digest")
+
+        # Test 6: Malformed digests can't point outside the store
+        for bad in ['sha256:../../../../../../etc/passwd', 'sha256:' + 'A' * 64, 'md5:' + 'a' * 32, digest + '/x']:
+            for use in [store.get, lambda d: store.put(d, [b'layer'])]:
+                try:
+                    use(bad)
+                    assert False, f"Should have raised ValueError for digest {bad!r}"
+                except ValueError:
+                    pass
+        print("✓ Malformed digests are rejected")
+
+    print("✓ Cached pull tests passed!\n" + "=" * 60)
+
+
+
+
+def test_download_and_extract_layers_concurrent(download_and_extract_layers_concurrent, LocalRegistry, make_layer,
+                                                LayerCache):
+    """Test concurrent downloads against a local registry with slow blobs."""
+    print("Testing concurrent layer downloads...")
+
+    with tempfile.TemporaryDirectory() as tmp, LocalRegistry() as registry:
+        contents = [os.urandom(50_000) for _ in range(4)]
+        blobs = [make_layer({'data': content, f'layer{i}': b''}) for i, content in enumerate(contents)]
+        registry.add_image('library/layers', 'latest', blobs)
+        layers = [{'digest': 'sha256:' + hashlib.sha256(blob).hexdigest(), 'size': len(blob)} for blob in blobs]
+        # The first layer is the slowest, so the later ones arrive before it
+        for i, layer in enumerate(layers):
+            registry.delays[layer['digest']] = 0.4 - 0.1 * i
+        serial = sum(registry.delays.values())
+
+        # Test 1: Layers are downloaded in parallel
+        start = time.perf_counter()
+        download_and_extract_layers_concurrent(registry.address, 'library/layers', layers, {},
+                                               os.path.join(tmp, 'parallel'), max_workers=4)
+        elapsed = time.perf_counter() - start
+        assert 1 < registry.max_active <= 4, f"Expected up to 4 simultaneous downloads, got {registry.max_active}"
+        assert elapsed < 0.8 * serial, f"Downloads took {elapsed:.2f}s of {serial:.2f}s serially, they should overlap"
+        print(f"✓ 4 layers downloaded in parallel in {elapsed:.2f}s ({serial:.2f}s serially)")
+
+        # Test 2: Layers are applied in manifest order
+        with open(os.path.join(tmp, 'parallel', 'data'), 'rb') as f:
+            assert f.read() == contents[-1], "The last layer's file should win"
+        assert all(os.path.exists(os.path.join(tmp, 'parallel', f'layer{i}')) for i in range(4))
+        print("✓ Layers are extracted in manifest order")
+
+        # Test 3: The concurrency limit is respected
+        registry.max_active = 0
+        download_and_extract_layers_concurrent(registry.address, 'library/layers', layers, {},
+                                               os.path.join(tmp, 'two'), max_workers=2)
+        assert 1 < registry.max_active <= 2, f"Expected at most 2 simultaneous downloads, got {registry.max_active}"
+        print("✓ Concurrency limit works")
+
+        # Test 4: The bandwidth limit is respected
+        registry.delays.clear()
+        total = sum(len(blob) for blob in blobs)
+        start = time.perf_counter()
+        download_and_extract_layers_concurrent(registry.address, 'library/layers', layers, {},
+                                               os.path.join(tmp, 'limited'), max_bytes_per_second=total / 0.5)
+        elapsed = time.perf_counter() - start
+        assert elapsed > 0.3, f"Downloading {total} bytes at {total / 0.5:.0f} B/s took only {elapsed:.2f}s"
+        print(f"✓ Bandwidth limit works ({elapsed:.2f}s)")
+
+        # Test 5: Cached layers aren't downloaded again
+        cache = LayerCache(os.path.join(tmp, 'cache'))
+        download_and_extract_layers_concurrent(registry.address, 'library/layers', layers, {},
+                                               os.path.join(tmp, 'cached1'), cache=cache)
+        requests_before = len(registry.requests)
+        download_and_extract_layers_concurrent(registry.address, 'library/layers', layers, {},
+                                               os.path.join(tmp, 'cached2'), cache=cache)
+        assert len(registry.requests) == requests_before, "Cached layers should not be downloaded"
+        assert cache.stats()['blobs'] == {'hits': 4, 'misses': 4}, f"Unexpected stats {cache.stats()}"
+        print("✓ Cached layers are reused")
+
+    print("✓ Concurrent download tests passed!\n" + "=" * 60)
+
+
+
+
+def test_extract_layer_stream(extract_layer_stream, download_and_extract_layers_streaming, HashingReader,
+                              LocalRegistry, make_layer):
+    """Test streaming extraction against a local registry."""
+    print("Testing streaming extraction...")
+
+    # Test 1: HashingReader returns the same bytes for any read sizes
+    data = os.urandom(10_000)
+    reader = HashingReader(data[i:i + 1000] for i in range(0, len(data), 1000))
+    parts = [reader.read(size) for size in [0, 1, 999, 1500, 3, 4000]]
+    parts.append(reader.read())
+    assert b''.join(parts) == data, "Reads should return the data in order"
+    assert reader.read(10) == b'', "Reading at the end should return no data"
+    assert reader.hexdigest() == 'sha256:' + hashlib.sha256(data).hexdigest(), "Hash should cover all data"
+    print("✓ HashingReader works")
+
+    with tempfile.TemporaryDirectory() as tmp, LocalRegistry() as registry:
+        big = os.urandom(4 << 20)
+        blobs = [make_layer({'big': big, 'etc/motd': b'old\n'}), make_layer({'etc/motd': b'new\n'})]
+        registry.add_image('library/stream', 'latest', blobs)
+        layers = [{'digest': 'sha256:' + hashlib.sha256(blob).hexdigest(), 'size': len(blob)} for blob in blobs]
+
+        # Test 2: Layers are extracted in order while downloading
+        download_and_extract_layers_streaming(registry.address, 'library/stream', layers, {},
+                                              os.path.join(tmp, 'out'))
+        with open(os.path.join(tmp, 'out', 'etc', 'motd'), 'rb') as f:
+            assert f.read() == b'new\n', "The second layer should overwrite the first"
+        assert os.path.getsize(os.path.join(tmp, 'out', 'big')) == len(big), "Large file should be extracted"
+        print("✓ Layers are extracted in order")
+
+        # Test 3: Memory use doesn't grow with the layer size (measured on a second pull, so that imports and
+        # connection setup of the first one don't count)
+        tracemalloc.start()
+        try:
+            download_and_extract_layers_streaming(registry.address, 'library/stream', layers, {},
+                                                  os.path.join(tmp, 'out2'))
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        assert peak < 1 << 20, f"Peak memory was {peak / (1 << 20):.1f} MiB for a 4 MiB layer"
+        print(f"✓ Extracted a 4 MiB layer with {peak / 1024:.0f} KiB peak memory")
+
+        # Test 4: A blob that doesn't match its digest is rejected
+        try:
+            extract_layer_stream(iter([blobs[1]]), layers[0]['digest'], os.path.join(tmp, 'bad'))
+            assert False, "Should have raised ValueError for a wrong digest"
+        except ValueError:
+            pass
+        print("✓ Digest is verified while streaming")
+
+    print("✓ Streaming extraction tests passed!\n" + "=" * 60)
+
+
+
+
+def test_extract_layers_merged(extract_layers_merged, make_layer):
+    """Test whiteouts, opaque directories and replaced entries."""
+    print("Testing merged layer extraction...")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        layers = [
+            make_layer({'etc/passwd': b'root\n', 'etc/old.conf': b'old\n', 'var/cache/a': b'a', 'var/cache/b': b'b',
+                        'opt': b'a file', 'lib/libc.so': b'libc', 'home/user/.bashrc': b'bashrc'}),
+            make_layer({'etc/.wh.old.conf': b'', 'var/cache/.wh..wh..opq': b'', 'var/cache/c': b'c',
+                        'etc/passwd': b'root\nuser\n', 'opt/tool': b'tool', 'lib': b'now a file',
+                        'home/.wh.user': b''}),
+            make_layer({'etc/.wh.passwd': b'', 'etc/passwd': b'root\nadmin\n'}),
+        ]
+        layer_paths = []
+        for i, blob in enumerate(layers):
+            layer_paths.append(os.path.join(tmp, f'layer{i}.tar.gz'))
+            with open(layer_paths[-1], 'wb') as f:
+                f.write(blob)
+        output_dir = os.path.join(tmp, 'rootfs')
+        stats = extract_layers_merged(layer_paths, output_dir)
+
+        def read(path):
+            with open(os.path.join(output_dir, path), 'rb') as f:
+                return f.read()
+
+        # Test 1: Whiteouts delete files and directories of lower layers
+        assert not os.path.exists(os.path.join(output_dir, 'etc', 'old.conf')), "Whited out file should be gone"
+        assert not os.path.exists(os.path.join(output_dir, 'home', 'user')), "Whited out directory should be gone"
+        print("✓ Whiteouts work")
+
+        # Test 2: Opaque directories hide the lower layers' contents
+        assert sorted(os.listdir(os.path.join(output_dir, 'var', 'cache'))) == ['c'], "Only c should be left"
+        print("✓ Opaque whiteouts work")
+
+        # Test 3: Entries replace files and directories of lower layers
+        assert read('etc/passwd') == b'root\nadmin\n', "Whiteouts only hide lower layers, not the same layer"
+        assert read('opt/tool') == b'tool', "A directory should replace a file"
+        assert read('lib') == b'now a file', "A file should replace a directory"
+        print("✓ Replaced entries work")
+
+        # Test 4: No whiteout files are written, and every file only once
+        for _, _, files in os.walk(output_dir):
+            assert not any(name.startswith('.wh.') for name in files), f"Whiteout files were extracted: {files}"
+        assert stats['entries'] == 16 and stats['whiteouts'] == 4, f"Unexpected stats {stats}"
+        assert stats['written'] == 4, f"Only the 4 final files should be written, got {stats}"
+        print(f"✓ Wrote {stats['written']} of {stats['entries']} entries")
+
+        # Test 5: Hard links survive a higher layer replacing their target
+        def hard_link(name, target):
+            buffer = BytesIO()
+            with tarfile.open(fileobj=buffer, mode='w:gz') as tar:
+                info = tarfile.TarInfo(name)
+                info.type, info.linkname = tarfile.LNKTYPE, target
+                tar.addfile(info)
+            return buffer.getvalue()
+
+        layers = [make_layer({'a': b'old a', 'c': b'c'}), hard_link('b', 'a'), hard_link('d', 'c'),
+                  make_layer({'a': b'new a'})]
+        for i, blob in enumerate(layers):
+            with open(os.path.join(tmp, f'link{i}.tar.gz'), 'wb') as f:
+                f.write(blob)
+        output_dir = os.path.join(tmp, 'links')
+        extract_layers_merged([os.path.join(tmp, f'link{i}.tar.gz') for i in range(len(layers))], output_dir)
+        assert read('a') == b'new a' and read('b') == b'old a', "The link should keep the replaced target's content"
+        assert os.path.samefile(os.path.join(output_dir, 'c'), os.path.join(output_dir, 'd')), \
+            "A link to an unchanged target should stay a hard link"
+        print("✓ Hard links work")
+
+    print("✓ Merged extraction tests passed!\n" + "=" * 60)
+
+
+
+
+def test_registry_client(RegistryClient, BlobStore, LocalRegistry, make_layer):
+    """Test connection reuse, token caching, conditional requests and retries against a local registry."""
+    print("Testing the registry client...")
+
+    with tempfile.TemporaryDirectory() as tmp, LocalRegistry(token_expires_in=60) as registry:
+        base = make_layer({'etc/os-release': b'NAME=Test\n'})
+        registry.add_image('library/base', 'latest', [base])
+        registry.add_image('library/app', 'latest', [base, make_layer({'app/main.py': b'print("hello")\n'})])
+        now = [0.0]
+        sleeps = []
+        client = RegistryClient(max_connections=2, clock=lambda: now[0], sleep=sleeps.append)
+        store = BlobStore(os.path.join(tmp, 'blobs'))
+        app, base_ref = f"{registry.address}/library/app:latest", f"{registry.address}/library/base:latest"
+
+        # Test 1: Pulls work with token authentication, reusing connections
+        client.pull(app, os.path.join(tmp, 'app1'), store)
+        client.pull(base_ref, os.path.join(tmp, 'base'), store)
+        assert os.path.exists(os.path.join(tmp, 'app1', 'app', 'main.py')), "Image should be extracted"
+        assert os.path.exists(os.path.join(tmp, 'base', 'etc', 'os-release')), "Image should be extracted"
+        assert registry.connections <= 2, f"Expected at most 2 connections, got {registry.connections}"
+        print(f"✓ {len(registry.requests)} requests over {registry.connections} connections")
+
+        # Test 2: Tokens are fetched once per scope
+        token_requests = [path for path in registry.requests if path.startswith('/token')]
+        assert len(token_requests) == 2, f"Expected one token per image, got {token_requests}"
+        print("✓ Tokens are reused")
+
+        # Test 3: Pulling again only revalidates the tag, which is not modified
+        requests_before = len(registry.requests)
+        client.pull(app, os.path.join(tmp, 'app2'), store)
+        assert registry.requests[requests_before:] == ['/v2/library/app/manifests/latest'], \
+            f"Only the tag should be requested, got {registry.requests[requests_before:]}"
+        assert client.stats()['not_modified'] == 1, f"Unexpected stats {client.stats()}"
+        print("✓ Manifests are revalidated with If-None-Match")
+
+        # Test 4: Tokens are renewed before they expire
+        now[0] += 55
+        requests_before = len(registry.requests)
+        client.pull(app, os.path.join(tmp, 'app3'), store)
+        assert registry.requests[requests_before:] == [
+            '/v2/library/app/manifests/latest',
+            '/token?service=local&scope=repository%3Alibrary%2Fapp%3Apull',
+            '/v2/library/app/manifests/latest',
+        ], f"Expected a new token after 55 of 60 seconds, got {registry.requests[requests_before:]}"
+        print("✓ Expired tokens are renewed")
+
+        # Test 5: Temporary failures are retried with exponential backoff
+        registry.failures['/v2/library/app/manifests/latest'] = 2
+        client.pull(app, os.path.join(tmp, 'app4'), store)
+        assert sleeps == [0.5, 1.0], f"Expected backoff of 0.5s and 1s, got {sleeps}"
+        assert client.stats()['retries'] == 2, f"Unexpected stats {client.stats()}"
+        print("✓ Failures are retried")
+
+        # Test 6: Persistent failures raise an error
+        registry.failures['/v2/library/app/manifests/latest'] = 10
+        try:
+            client.pull(app, os.path.join(tmp, 'app5'), store)
+            assert False, "Should have raised HTTPError"
+        except requests.HTTPError as e:
+            assert e.response.status_code == 503, f"Unexpected error {e}"
+        print("✓ Persistent failures raise HTTPError")
+
+        # Test 7: A single-platform tag (no index) is requested once per pull
+        registry.add_image('library/single', 'latest', [base], index=False)
+        single = f"{registry.address}/library/single:latest"
+        requests_before = len(registry.requests)
+        client.pull(single, os.path.join(tmp, 'single1'), store)
+        manifest_requests = {path for path in registry.requests[requests_before:] if '/manifests/' in path}
+        assert manifest_requests == {'/v2/library/single/manifests/latest'}, \
+            f"The manifest should only be requested by tag, got {manifest_requests}"
+        requests_before = len(registry.requests)
+        client.pull(single, os.path.join(tmp, 'single2'), store)
+        assert registry.requests[requests_before:] == ['/v2/library/single/manifests/latest'], \
+            f"Only the tag should be requested, got {registry.requests[requests_before:]}"
+        print("✓ Single-platform manifests are reused by digest")
+        client.close()
+
+    print("✓ Registry client tests passed!\n" + "=" * 60)
+
+
+
 def test_run_chroot(run_chroot):
     """Test the chroot command execution function."""
     print("Testing chroot command execution...")